@@ -10,6 +10,11 @@ import pandas as pd
 import json
 from typing import Dict, List, Any
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from embedding_cache import EmbeddingCache
+from rate_limiting import shared_rate_limiter
 
 # Cargar variables de entorno
 load_dotenv()
@@ -65,6 +70,15 @@ class WatsonxRAGConfigReal:
         self.wml_client = None
         self.discovery_client = None
         
+        # Limitador compartido con el sistema RAG (token bucket + concurrencia adaptativa)
+        self.rate_limiter = shared_rate_limiter()
+        
+        # Caché persistente de embeddings compartida con el sistema RAG
+        self.embedding_cache = EmbeddingCache(
+            os.getenv("EMBEDDING_CACHE_DIR", str(Path(__file__).parent / ".embedding_cache")),
+            self.decode_ev_config["embedding_model"]
+        )
+        
     def initialize_clients(self):
         """
         Inicializa clientes REALES de IBM watsonx y Watson Discovery
@@ -77,7 +91,7 @@ class WatsonxRAGConfigReal:
             self.wml_client.set.default_project(self.watsonx_credentials["project_id"])
             
             # Verificar conexión
-            project_details = self.wml_client.projects.get_details()
+            project_details = self.rate_limiter.call("watsonx_admin", self.wml_client.projects.get_details)
             logger.info(f"✅ Conectado a proyecto: {project_details['entity']['name']}")
             
             logger.info("🔄 Conectando con Watson Discovery...")
@@ -91,9 +105,9 @@ class WatsonxRAGConfigReal:
             self.discovery_client.set_service_url(self.discovery_credentials["url"])
             
             # Verificar conexión
-            collections = self.discovery_client.list_collections(
+            collections = self.rate_limiter.call("discovery_admin", lambda: self.discovery_client.list_collections(
                 project_id=self.watsonx_credentials["project_id"]
-            ).get_result()
+            ).get_result())
             logger.info(f"✅ Watson Discovery conectado. Colecciones: {len(collections['collections'])}")
             
             return True
@@ -115,10 +129,10 @@ class WatsonxRAGConfigReal:
                 'language': 'es'  # Español
             }
             
-            result = self.discovery_client.create_collection(
+            result = self.rate_limiter.call("discovery_admin", lambda: self.discovery_client.create_collection(
                 project_id=self.watsonx_credentials["project_id"],
                 **collection_config
-            ).get_result()
+            ).get_result())
             
             collection_id = result['collection_id']
             logger.info(f"✅ Colección creada exitosamente")
@@ -137,10 +151,7 @@ class WatsonxRAGConfigReal:
         try:
             logger.info(f"📤 Subiendo {len(documents)} documentos a Watson Discovery...")
             
-            uploaded_count = 0
-            failed_count = 0
-            
-            for doc in documents:
+            def upload(doc: Dict) -> bool:
                 try:
                     # Preparar documento para Watson Discovery
                     discovery_doc = {
@@ -150,20 +161,26 @@ class WatsonxRAGConfigReal:
                         "metadata": doc.get('metadata', {})
                     }
                     
-                    # Subir documento
-                    result = self.discovery_client.add_document(
+                    # Subir documento (el limitador decide cuántas cargas van en paralelo)
+                    self.rate_limiter.call("discovery_upload", lambda: self.discovery_client.add_document(
                         project_id=self.watsonx_credentials["project_id"],
                         collection_id=collection_id,
                         file=json.dumps(discovery_doc).encode('utf-8'),
                         filename=f"{doc.get('id')}.json",
                         file_content_type='application/json'
-                    ).get_result()
-                    
-                    uploaded_count += 1
+                    ).get_result())
+                    return True
                     
                 except Exception as doc_error:
                     logger.warning(f"⚠️ Error subiendo documento {doc.get('id')}: {doc_error}")
-                    failed_count += 1
+                    return False
+            
+            max_workers = self.rate_limiter.endpoint("discovery_upload").limits.max_concurrency
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                results = list(executor.map(upload, documents))
+            
+            uploaded_count = sum(results)
+            failed_count = len(results) - uploaded_count
             
             logger.info(f"✅ Documentos subidos: {uploaded_count}")
             logger.info(f"❌ Documentos fallidos: {failed_count}")
@@ -192,7 +209,9 @@ class WatsonxRAGConfigReal:
                 }
             }
             
-            response = self.wml_client.foundation_models.generate_text(**generation_params)
+            response = self.rate_limiter.call(
+                "generation", lambda: self.wml_client.foundation_models.generate_text(**generation_params)
+            )
             generated_text = response['results'][0]['generated_text']
             
             logger.info("✅ Generación con Granite exitosa")
@@ -211,13 +230,19 @@ class WatsonxRAGConfigReal:
         try:
             logger.info("🧠 Probando embeddings con IBM Slate...")
             
-            embedding_params = {
-                "input": texts,
-                "model_id": self.decode_ev_config["embedding_model"]
-            }
+            def generate(missing_texts: List[str]) -> List[List[float]]:
+                embedding_params = {
+                    "input": missing_texts,
+                    "model_id": self.decode_ev_config["embedding_model"]
+                }
+                response = self.rate_limiter.call(
+                    "embeddings", lambda: self.wml_client.foundation_models.generate_embeddings(**embedding_params)
+                )
+                return [result['embedding'] for result in response['results']]
             
-            response = self.wml_client.foundation_models.generate_embeddings(**embedding_params)
-            embeddings = response['results']
+            # Solo los textos ausentes de la caché se envían a Slate
+            vectors = self.embedding_cache.get_or_compute(texts, generate)
+            embeddings = [{"embedding": vector} for vector in vectors.tolist()]
             
             logger.info(f"✅ Embeddings generados para {len(texts)} textos")
             logger.info(f"📊 Dimensión: {len(embeddings[0]['embedding'])}")
@@ -248,7 +273,6 @@ if __name__ == "__main__":
                 
                 # Cargar dataset procesado para subir
                 import jsonlines
-                from pathlib import Path
                 
                 dataset_path = Path(__file__).parent / "dataset_processed_watsonx.jsonl"
                 
@@ -7,8 +7,11 @@ import jsonlines
 from typing import Dict, List, Any, Optional
 from pathlib import Path
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 
+from rate_limiting import shared_rate_limiter
+
 class DecodeEVDatasetIntegrator:
     """
     Integrador del dataset DECODE-EV con IBM watsonx RAG
@@ -25,6 +28,9 @@ class DecodeEVDatasetIntegrator:
         self.config = config
         self.dataset_stats = {}
         
+        # Mismo limitador que la configuración y el sistema RAG (cuota compartida por proceso)
+        self.rate_limiter = shared_rate_limiter()
+        
     def load_decode_ev_dataset(self, dataset_path: str) -> List[Dict]:
         """
         Carga dataset DECODE-EV desde archivos JSONL
@@ -162,10 +168,10 @@ class DecodeEVDatasetIntegrator:
             # Crear colección usando Discovery API
             environment_id = os.getenv("DISCOVERY_ENVIRONMENT_ID")
             
-            response = self.config.discovery_client.create_collection(
+            response = self.rate_limiter.call("discovery_admin", lambda: self.config.discovery_client.create_collection(
                 environment_id=environment_id,
                 **collection_config
-            ).get_result()
+            ).get_result())
             
             collection_id = response["collection_id"]
             print(f"✅ Colección '{collection_name}' creada exitosamente")
@@ -194,28 +200,31 @@ class DecodeEVDatasetIntegrator:
             
             print(f"📤 Iniciando carga de {len(documents)} documentos...")
             
-            for i, doc in enumerate(documents):
-                try:
-                    # Convertir documento a JSON
-                    doc_json = json.dumps(doc, ensure_ascii=False, indent=2)
-                    
-                    # Subir documento individual
-                    response = self.config.discovery_client.add_document(
-                        environment_id=environment_id,
-                        collection_id=collection_id,
-                        file=doc_json.encode('utf-8'),
-                        filename=f"{doc['document_id']}.json",
-                        file_content_type='application/json'
-                    ).get_result()
-                    
-                    successful_uploads += 1
+            def upload(doc: Dict) -> None:
+                # Convertir documento a JSON
+                doc_json = json.dumps(doc, ensure_ascii=False, indent=2)
+                
+                # Subir documento individual (token bucket + concurrencia adaptativa)
+                self.rate_limiter.call("discovery_upload", lambda: self.config.discovery_client.add_document(
+                    environment_id=environment_id,
+                    collection_id=collection_id,
+                    file=doc_json.encode('utf-8'),
+                    filename=f"{doc['document_id']}.json",
+                    file_content_type='application/json'
+                ).get_result())
+            
+            max_workers = self.rate_limiter.endpoint("discovery_upload").limits.max_concurrency
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = {executor.submit(upload, doc): i for i, doc in enumerate(documents)}
+                for completed, future in enumerate(as_completed(futures), 1):
+                    try:
+                        future.result()
+                        successful_uploads += 1
+                    except Exception as e:
+                        print(f"   ❌ Error subiendo documento {futures[future]}: {e}")
                     
-                    if (i + 1) % 50 == 0:
-                        print(f"   📊 Progreso: {i + 1}/{len(documents)} documentos")
-                        
-                except Exception as e:
-                    print(f"   ❌ Error subiendo documento {i}: {e}")
-                    continue
+                    if completed % 50 == 0:
+                        print(f"   📊 Progreso: {completed}/{len(documents)} documentos")
             
             print(f"✅ Carga completada: {successful_uploads}/{len(documents)} documentos exitosos")
             self.dataset_stats["uploaded_documents"] = successful_uploads
@@ -6,11 +6,30 @@ import json
 import jsonlines
 import pandas as pd
 import numpy as np
-from typing import Dict, List, Any, Optional, Tuple
+from typing import Dict, List, Any, Optional, Tuple, Union
 import logging
 from datetime import datetime
 from pathlib import Path
 import re
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field, replace
+
+from vector_index import DenseVectorIndex, IVFIndex, top_k_indices
+from quantized_index import QuantizedVectorIndex, ScalarQuantizer, ProductQuantizer, StackedRows
+from lexical_index import BM25Index
+from hashing_embeddings import HashingEmbedder
+from hybrid_retrieval import HybridRetriever
+from query_preprocessing import QueryPreprocessor
+from reranker import FeatureReranker, MENTION_FIELDS, detect_metadata_mentions
+from context_packer import ContextPacker, PackedContext, estimate_tokens
+from metadata_filters import BitmapIndex, filters_key, validate_filters
+from index_snapshots import IndexSnapshotStore, documents_fingerprint
+from document_store import ColumnarDocumentStore
+from result_cache import QueryResultCache, SemanticAnswerCache, query_cache_key
+from incremental_index import (SegmentedDocumentStore, SegmentedBitmapIndex, BackgroundMerger,
+                               compaction_map, document_key, should_merge)
 
 # Importación condicional de librerías IBM
 try:
@@ -28,23 +47,48 @@ except ImportError:
 # Configuración de logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+# Clases persistidas en los snapshots de índices (su estructura forma parte de la clave)
+SNAPSHOT_SCHEMA = (DenseVectorIndex, QuantizedVectorIndex, ScalarQuantizer, ProductQuantizer,
+                   IVFIndex, BM25Index, SegmentedBitmapIndex, BitmapIndex)
+
+@dataclass
+class RAGQuery:
+    """Estructura para consultas RAG"""
+    question: str
+    context_filters: Dict[str, Any] = field(default_factory=dict)
+    max_retrieved_docs: int = 5
+    temperature: float = 0.3
+    max_tokens: int = 512
+
+@dataclass
+class RAGResponse:
+    """Estructura para respuestas RAG"""
+    answer: str
+    retrieved_documents: List[Dict]
+    confidence_score: float
+    processing_time: float
+    metadata: Dict[str, Any] = field(default_factory=dict)
+
 class DecodeEVRAGSystem:
     """
     Sistema RAG principal para DECODE-EV integrado con IBM watsonx
     Permite consultas conversacionales sobre datos CAN vehiculares
     """
     
-    def __init__(self, wml_client: Any = None, discovery_client: Any = None):
+    def __init__(self, config: Optional[Dict[str, Any]] = None, collection_id: str = "default",
+                 wml_client: Any = None, discovery_client: Any = None):
         """
         Inicializa el sistema RAG con clientes IBM watsonx
         """
+        self.config = config or {}
+        self.collection_id = collection_id
         self.wml_client = wml_client
         self.discovery_client = discovery_client
         self.logger = logging.getLogger(__name__)
         
-        # Dataset procesado cargado en memoria
-        self.documents = []
-        self.vector_index = {}
+        # Dataset procesado cargado en memoria (segmento base + delta)
+        self.documents = SegmentedDocumentStore()
+        self.metadata_index = SegmentedBitmapIndex()
         
         # Configuración del modelo RAG
         self.rag_config = {
@@ -105,35 +149,104 @@ Análisis:"""
             # Paso 1: Modelo de embeddings
             "embedding_model": "ibm/slate-125m-english-rtrvr",
             "embedding_dimension": 768,
+            "embedding_backend": "local_hashing",  # embeddings deterministas sin conexión
             
             # Paso 2: Vector store
             "vector_store": "watsonx_milvus",
-            "similarity_threshold": 0.7,
+            "similarity_threshold": 0.7,  # coseno (escala de los embeddings)
+            "ivf_nprobe": 16,
+            "ivf_min_documents": 50000,
+            "delta_merge_threshold": 1000,
+            "tombstone_merge_ratio": 0.2,
+            "vector_quantization": None,  # None (float32), "int8" o "pq"
+            "pq_subvectors": 96,
+            "rescore_factor": None,  # candidatos re-puntuados por resultado (None: según método)
+            "rescore_vectors_dir": None,  # vectores float32 mapeados desde disco (None: directorio temporal)
             
             # Paso 3: Retrieval
             "retrieval_method": "semantic_hybrid",
+            "hybrid_min_score": 0.0,  # umbral sobre el score fusionado [0, 1], no sobre el coseno
             "max_retrieved_docs": 10,
             "reranking_enabled": True,
             
             # Paso 4: Reranking
             "reranker_model": "ibm/slate-125m-english-rtrvr",
             "rerank_top_k": 5,
+            "rerank_score_threshold": 0.5,
             
             # Paso 5: Prompt Engineering
             "system_prompt": self._get_decode_ev_system_prompt(),
             "context_window": 4096,
+            "context_snippet_tokens": 512,
             
             # Paso 6: LLM Generation
             "generation_model": "ibm/granite-13b-chat-v2",
             "temperature": 0.3,
             "max_tokens": 1024,
+            "batch_max_concurrency": 8,
             
             # Paso 7: Response Processing
             "include_sources": True,
-            "confidence_calculation": True
+            "confidence_calculation": True,
+            
+            # Caché de resultados (LRU + TTL)
+            "result_cache_size": 256,
+            "result_cache_ttl": 300,
+            
+            # Caché semántica (preguntas parafraseadas con filtros idénticos)
+            "semantic_cache_enabled": None,  # None: solo con embeddings semánticos (no con local_hashing)
+            "semantic_cache_size": 512,
+            "semantic_cache_threshold": 0.92,
+            "semantic_cache_ttl": 3600,
+            
+            # Memoización del preprocesamiento de consultas (Paso 1)
+            "query_cache_size": 1024
         }
         
-        # Métricas del sistema
+        # Paso 1: expansión de abreviaciones en una pasada, memorizada por consulta
+        self.query_preprocessor = QueryPreprocessor(cache_size=self.rag_config["query_cache_size"])
+        
+        # Backend local de embeddings (feature hashing, misma dimensión que Slate)
+        self.local_embedder = HashingEmbedder(self.rag_config["embedding_dimension"])
+        
+        # Índice vectorial denso (filas alineadas con self.documents)
+        self.dense_index = DenseVectorIndex(self.rag_config["embedding_dimension"])
+        
+        # Índice aproximado IVF_FLAT (solo para corpus grandes)
+        self.ann_index = None
+        
+        # Segmento delta: vectores agregados después de la última indexación/merge
+        self.delta_index = DenseVectorIndex(self.rag_config["embedding_dimension"])
+        self._index_lock = threading.RLock()
+        self.merger = BackgroundMerger(self._merge_segments, name="decode_ev_merge")
+        
+        # Caché de resultados: la versión cambia con cada modificación del corpus
+        self.index_version = 0
+        self.result_cache = QueryResultCache(self.rag_config["result_cache_size"],
+                                             self.rag_config["result_cache_ttl"])
+        
+        # Caché semántica: misma versión del corpus, mismos filtros y coseno >= umbral
+        self.semantic_cache = SemanticAnswerCache(self.rag_config["embedding_dimension"],
+                                                  self.rag_config["semantic_cache_size"],
+                                                  self.rag_config["semantic_cache_threshold"],
+                                                  self.rag_config["semantic_cache_ttl"])
+        if self.rag_config["semantic_cache_enabled"] and self.rag_config["embedding_backend"] == "local_hashing":
+            self.logger.warning("⚠️ Caché semántica con embeddings por hashing: solo reconoce "
+                                "reformulaciones casi literales, no paráfrasis")
+        
+        # Contexto acotado a context_window (encabezados por documento en caché)
+        self.context_packer = ContextPacker(self._context_header, label="\nDOCUMENTO {n}:\n",
+                                            max_snippet_tokens=self.rag_config["context_snippet_tokens"])
+        
+        # Reranker de segunda etapa (Paso 5)
+        self.reranker = FeatureReranker(self.rag_config["rerank_top_k"], self.rag_config["rerank_score_threshold"])
+        
+        # Índice léxico BM25 y retriever híbrido (Paso 4)
+        self.lexical_index = BM25Index()
+        self.hybrid_retriever = None
+        
+        # Métricas del sistema (query_rag_batch las actualiza desde varios hilos)
+        self._metrics_lock = threading.Lock()
         self.metrics = {
             "total_queries": 0,
             "successful_retrievals": 0,
@@ -257,8 +370,12 @@ Mantén un tono profesional y técnico apropiado para ingenieros y técnicos veh
                 "collection_name": f"decode_ev_vectors_{self.collection_id}",
                 "dimension": self.rag_config["embedding_dimension"],
                 "metric_type": "COSINE",
-                "index_type": "IVF_FLAT"
+                "index_type": "IVF_FLAT",
+                "params": {"nprobe": self.rag_config["ivf_nprobe"]}
             }
+            
+            # Vector store local: IVF_FLAT sobre el índice denso ya cargado
+            self._build_ann_index()
             print("✅ Paso 3: Vector store configurado")
             return True
         except Exception as e:
@@ -272,9 +389,16 @@ Mantén un tono profesional y técnico apropiado para ingenieros y técnicos veh
             retrieval_config = {
                 "semantic_weight": 0.7,
                 "keyword_weight": 0.3,
-                "min_score": self.rag_config["similarity_threshold"],
+                "min_score": self.rag_config["hybrid_min_score"],
                 "max_results": self.rag_config["max_retrieved_docs"]
             }
+            
+            self.hybrid_retriever = HybridRetriever(
+                lexical_search=self._lexical_search,
+                dense_search=self._dense_search,
+                dense_search_batch=self._dense_search_batch,
+                **retrieval_config
+            )
             print("✅ Paso 4: Sistema de retrieval configurado")
             return True
         except Exception as e:
@@ -288,8 +412,10 @@ Mantén un tono profesional y técnico apropiado para ingenieros y técnicos veh
             rerank_config = {
                 "model_id": self.rag_config["reranker_model"],
                 "top_k": self.rag_config["rerank_top_k"],
-                "score_threshold": 0.5
+                "score_threshold": self.rag_config["rerank_score_threshold"],
+                "features": FeatureReranker.FEATURES
             }
+            self.reranker = FeatureReranker(rerank_config["top_k"], rerank_config["score_threshold"])
             print("✅ Paso 5: Sistema de reranking configurado")
             return True
         except Exception as e:
@@ -344,6 +470,17 @@ Mantén un tono profesional y técnico apropiado para ingenieros y técnicos veh
         """
         start_time = datetime.now()
         
+        # Filtros inválidos: error explícito, sin pasar por la caché
+        try:
+            validate_filters(query.context_filters, self.metadata_index.fields)
+        except ValueError as e:
+            return self._error_response(e, start_time)
+        
+        cache_key = query_cache_key(query, self.index_version)
+        cached = self.result_cache.get(cache_key)
+        if cached is not None:
+            return self._cached_response(cached, start_time)
+        
         try:
             # Paso 1: Procesar query
             processed_query = self._preprocess_query(query.question)
@@ -351,80 +488,595 @@ Mantén un tono profesional y técnico apropiado para ingenieros y técnicos veh
             # Paso 2: Generar embeddings de la consulta
             query_embedding = self._generate_query_embedding(processed_query)
             
-            # Paso 3: Retrieval semántico
-            retrieved_docs = self._semantic_retrieval(query_embedding, query.max_retrieved_docs)
+            # Pregunta parafraseada ya respondida con los mismos filtros y parámetros
+            semantic_scope = self._semantic_scope(query)
+            semantic_cache_active = self._semantic_cache_active()
+            if semantic_cache_active:
+                semantic_hit = self.semantic_cache.get(query_embedding, semantic_scope, self.index_version,
+                                                       query.question)
+                if semantic_hit is not None:
+                    return self._semantic_cached_response(*semantic_hit, start_time)
             
-            # Paso 4: Reranking
-            reranked_docs = self._rerank_documents(processed_query, retrieved_docs)
+            # Paso 3: Retrieval híbrido (semántico + keyword) o solo semántico,
+            # restringido a los documentos que pasan context_filters
+            with self._index_lock:
+                candidate_mask = self._candidate_mask(query.context_filters)
+                
+                if self.hybrid_retriever is not None and len(self.documents) > 0:
+                    retrieved_docs = self._hybrid_retrieval(processed_query, query_embedding,
+                                                            query.max_retrieved_docs, candidate_mask)
+                else:
+                    retrieved_docs = self._semantic_retrieval(query_embedding, query.max_retrieved_docs, candidate_mask)
             
-            # Paso 5: Construcción de contexto
-            context = self._build_context(reranked_docs)
+            response = self._complete_query(query, processed_query, retrieved_docs, start_time)
+            self.result_cache.put(cache_key, response)
+            if semantic_cache_active:
+                self.semantic_cache.put(query_embedding, semantic_scope, self.index_version, response,
+                                        query.question)
+            return response
             
-            # Paso 6: Generación de respuesta
-            generated_answer = self._generate_answer(processed_query, context, query)
+        except Exception as e:
+            return self._error_response(e, start_time)
+    
+    def query_rag_batch(self, queries: List[RAGQuery], max_concurrency: Optional[int] = None) -> List[RAGResponse]:
+        """
+        Ejecuta varias consultas compartiendo los pasos costosos del pipeline
+        
+        - Pasos 1-2: preprocesamiento y embeddings de todas las preguntas en lote
+        - Paso 3: las consultas se agrupan por filtros idénticos; cada grupo
+          evalúa sus filtros una vez y resuelve la parte densa con una sola
+          multiplicación matricial
+        - Pasos 4-7: reranking, contexto y generación en paralelo, con a lo
+          sumo `max_concurrency` consultas simultáneas
+        
+        Las consultas en caché se responden directamente y las repetidas
+        dentro del lote se ejecutan una sola vez. Un filtro inválido solo
+        produce una respuesta de error para su propia consulta.
+        
+        Returns:
+            Respuestas en el mismo orden que `queries`
+        """
+        queries = list(queries)
+        start_time = datetime.now()
+        
+        responses: List[Optional[RAGResponse]] = [None] * len(queries)
+        pending: Dict[Tuple, List[int]] = {}
+        for i, query in enumerate(queries):
+            try:
+                validate_filters(query.context_filters, self.metadata_index.fields)
+            except ValueError as e:
+                responses[i] = self._error_response(e, start_time)
+                continue
             
-            # Paso 7: Post-procesamiento
-            final_response = self._postprocess_response(
-                generated_answer, reranked_docs, query
-            )
+            cache_key = query_cache_key(query, self.index_version)
+            if cache_key in pending:
+                pending[cache_key].append(i)
+                continue
+            cached = self.result_cache.get(cache_key)
+            if cached is not None:
+                responses[i] = self._cached_response(cached, start_time)
+            else:
+                pending[cache_key] = [i]
+        
+        if pending:
+            keys = list(pending)
+            results = self._run_batch([queries[pending[key][0]] for key in keys], max_concurrency, start_time)
+            for key, response in zip(keys, results):
+                if "error" not in response.metadata:
+                    self.result_cache.put(key, response)
+                for i in pending[key]:
+                    responses[i] = response
+        
+        return responses
+    
+    def _run_batch(self, queries: List[RAGQuery], max_concurrency: Optional[int],
+                   start_time: datetime) -> List[RAGResponse]:
+        """Pipeline por lotes sobre consultas que no están en caché"""
+        try:
+            # Pasos 1-2 en lote
+            processed_queries = [self._preprocess_query(query.question) for query in queries]
+            query_embeddings = self._generate_query_embeddings(processed_queries)
             
-            # Calcular métricas
-            processing_time = (datetime.now() - start_time).total_seconds()
-            confidence_score = self._calculate_confidence(reranked_docs, final_response)
-            
-            # Actualizar métricas del sistema
-            self._update_metrics(processing_time, confidence_score, True)
-            
-            return RAGResponse(
-                answer=final_response,
-                retrieved_documents=reranked_docs,
-                confidence_score=confidence_score,
-                processing_time=processing_time,
-                metadata={
-                    "query_processed": processed_query,
-                    "embedding_model": self.rag_config["embedding_model"],
-                    "generation_model": self.rag_config["generation_model"],
-                    "retrieved_count": len(retrieved_docs),
-                    "reranked_count": len(reranked_docs)
-                }
-            )
+            # Paso 3 por grupo de filtros (y profundidad de retrieval)
+            groups: Dict[Tuple[str, int], List[int]] = {}
+            for i, query in enumerate(queries):
+                groups.setdefault((filters_key(query.context_filters), query.max_retrieved_docs), []).append(i)
+        except Exception as e:
+            return [self._error_response(e, start_time) for _ in queries]
+        
+        # Un error de retrieval solo afecta a las consultas de su grupo
+        retrieved: List[List[Dict]] = [[] for _ in queries]
+        errors: List[Optional[Exception]] = [None] * len(queries)
+        with self._index_lock:
+            for (_, max_docs), indices in groups.items():
+                try:
+                    candidate_mask = self._candidate_mask(queries[indices[0]].context_filters)
+                    group_docs = self._batch_retrieval([processed_queries[i] for i in indices],
+                                                       query_embeddings[indices], max_docs, candidate_mask)
+                except Exception as e:
+                    for i in indices:
+                        errors[i] = e
+                    continue
+                for i, docs in zip(indices, group_docs):
+                    retrieved[i] = docs
+        
+        def complete(i: int) -> RAGResponse:
+            if errors[i] is not None:
+                return self._error_response(errors[i], start_time)
+            try:
+                return self._complete_query(queries[i], processed_queries[i], retrieved[i], start_time)
+            except Exception as e:
+                return self._error_response(e, start_time)
+        
+        # Pasos 4-7 con concurrencia acotada
+        max_workers = min(max_concurrency or self.rag_config["batch_max_concurrency"], len(queries))
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="rag_batch") as executor:
+            return list(executor.map(complete, range(len(queries))))
+    
+    def _candidate_mask(self, filters: Optional[Dict[str, Any]]) -> Optional[np.ndarray]:
+        """Documentos vigentes que pasan `filters` (None = todos)"""
+        if not self.documents:
+            return None
+        
+        candidate_mask = self.metadata_index.filter_mask(filters)
+        live_mask = self._live_mask()
+        if live_mask is not None:
+            # Los documentos con tombstone no se recuperan hasta el merge
+            candidate_mask = live_mask if candidate_mask is None else candidate_mask & live_mask
+        return candidate_mask
+    
+    def _complete_query(self, query: RAGQuery, processed_query: str, retrieved_docs: List[Dict],
+                        start_time: datetime) -> RAGResponse:
+        """Pasos 4-7 del pipeline sobre los documentos recuperados"""
+        # Paso 4: Reranking
+        reranked_docs = self._rerank_documents(processed_query, retrieved_docs)
+        
+        # Paso 5: Construcción de contexto (solo los documentos que caben en context_window)
+        packed = self._pack_context(reranked_docs, processed_query)
+        
+        # Paso 6: Generación de respuesta
+        generated_answer = self._generate_answer(processed_query, packed.text, query)
+        
+        # Paso 7: Post-procesamiento
+        final_response = self._postprocess_response(
+            generated_answer, packed.documents, query
+        )
+        
+        # Calcular métricas
+        processing_time = (datetime.now() - start_time).total_seconds()
+        confidence_score = self._calculate_confidence(reranked_docs, final_response)
+        
+        # Actualizar métricas del sistema
+        self._update_metrics(processing_time, confidence_score, True)
+        
+        return RAGResponse(
+            answer=final_response,
+            retrieved_documents=reranked_docs,
+            confidence_score=confidence_score,
+            processing_time=processing_time,
+            metadata={
+                "query_processed": processed_query,
+                "embedding_model": self.rag_config["embedding_model"],
+                "generation_model": self.rag_config["generation_model"],
+                "retrieved_count": len(retrieved_docs),
+                "reranked_count": len(reranked_docs),
+                "context_documents": len(packed.documents),
+                "context_tokens": packed.tokens
+            }
+        )
+    
+    def _cached_response(self, cached: RAGResponse, start_time: datetime) -> RAGResponse:
+        """Copia de una respuesta en caché con el tiempo de esta consulta"""
+        processing_time = (datetime.now() - start_time).total_seconds()
+        self._update_metrics(processing_time, cached.confidence_score, True)
+        return replace(cached, processing_time=processing_time, metadata={**cached.metadata, "cache_hit": True})
+    
+    def _semantic_cached_response(self, cached: RAGResponse, similarity: float,
+                                  start_time: datetime) -> RAGResponse:
+        """Respuesta de la caché semántica, con la similitud del acierto en metadata"""
+        response = self._cached_response(cached, start_time)
+        response.metadata.update({"semantic_cache_hit": True, "semantic_similarity": similarity})
+        return response
+    
+    def _semantic_cache_active(self) -> bool:
+        """
+        La caché semántica se usa si se habilitó explícitamente o, por
+        defecto (None), solo cuando los embeddings son semánticos: con
+        feature hashing las paráfrasis no alcanzan el umbral
+        """
+        enabled = self.rag_config["semantic_cache_enabled"]
+        if enabled is None:
+            return self.rag_config["embedding_backend"] != "local_hashing"
+        return bool(enabled)
+    
+    @staticmethod
+    def _semantic_scope(query: RAGQuery) -> Tuple:
+        """Todo lo que define la respuesta salvo la pregunta: filtros canónicos y parámetros"""
+        return (filters_key(query.context_filters), query.max_retrieved_docs, query.temperature, query.max_tokens)
+    
+    def _error_response(self, error: Exception, start_time: datetime) -> RAGResponse:
+        processing_time = (datetime.now() - start_time).total_seconds()
+        self._update_metrics(processing_time, 0.0, False)
+        
+        return RAGResponse(
+            answer=f"Error procesando consulta: {str(error)}",
+            retrieved_documents=[],
+            confidence_score=0.0,
+            processing_time=processing_time,
+            metadata={"error": str(error)}
+        )
+    
+    def _preprocess_query(self, question: str) -> str:
+        """
+        Preprocesa la consulta para mejorar retrieval: expande abreviaciones
+        técnicas (CAN, SOC, RPM, km/h) como palabras completas. El resultado
+        y sus términos léxicos se memorizan, así que BM25 y el reranker
+        reutilizan la misma forma normalizada.
+        """
+        return self.query_preprocessor.preprocess(question).text
+    
+    def _generate_query_embedding(self, query: str) -> List[float]:
+        """Genera embedding para la consulta"""
+        return self._generate_query_embeddings([query])[0].tolist()
+    
+    def _generate_query_embeddings(self, queries: List[str]) -> np.ndarray:
+        """Genera embeddings para varias consultas (matriz n_consultas x dimensión)"""
+        # Backend local: feature hashing vectorizado sobre todo el lote
+        return self.local_embedder.embed(queries)
+    
+    def _generate_document_embeddings(self, texts: List[str]) -> np.ndarray:
+        """Genera embeddings para los documentos del corpus"""
+        return self.local_embedder.embed(texts)
+    
+    def index_documents(self, documents: List[Dict], embeddings: Optional[List[List[float]]] = None,
+                        snapshot_dir: Optional[str] = None) -> bool:
+        """
+        Indexa documentos procesados en el índice vectorial denso
+        
+        Args:
+            documents: Documentos del dataset procesado (JSONL de Feature Engineering)
+            embeddings: Embeddings precalculados (uno por documento); si no se
+                entregan se generan con el modelo de embeddings
+            snapshot_dir: Directorio de snapshots; si contiene uno para estos
+                documentos se restauran los índices sin generar embeddings
+            
+        Returns:
+            True si el índice quedó construido
+        """
+        try:
+            documents = list(documents)
+            snapshots, fingerprint = None, None
+            
+            if snapshot_dir:
+                # La huella incluye modelo y dimensión: otro modelo invalida el snapshot
+                extra = (f"{self.rag_config['embedding_model']}:{self.rag_config['embedding_dimension']}:"
+                         f"{self.rag_config['embedding_backend']}:{self.rag_config['vector_quantization']}:"
+                         f"{self.rag_config['pq_subvectors']}")
+                if embeddings is not None:
+                    extra += ":" + hashlib.sha256(np.asarray(embeddings, dtype=np.float32).tobytes()).hexdigest()
+                fingerprint = documents_fingerprint(documents, extra)
+                snapshots = IndexSnapshotStore(snapshot_dir, name="rag_indexes", schema=SNAPSHOT_SCHEMA)
+                
+                payload = snapshots.load(fingerprint)
+                if payload is not None:
+                    self.documents = SegmentedDocumentStore(ColumnarDocumentStore.from_documents(documents))
+                    self.delta_index = DenseVectorIndex(self.rag_config["embedding_dimension"])
+                    self._replace_dense_index(payload["dense_index"])
+                    self.ann_index = payload["ann_index"]
+                    self.lexical_index = payload["lexical_index"]
+                    self.metadata_index = payload["metadata_index"]
+                    self._invalidate_results()
+                    
+                    self.logger.info(f"⚡ Índices restaurados desde snapshot: {len(self.dense_index)} documentos")
+                    return True
+            
+            if embeddings is None:
+                embeddings = self._generate_document_embeddings([doc.get('text', '') for doc in documents])
+            
+            if len(embeddings) != len(documents):
+                raise ValueError(f"Se esperaban {len(documents)} embeddings, se recibieron {len(embeddings)}")
+            
+            self.documents = SegmentedDocumentStore(ColumnarDocumentStore.from_documents(documents))
+            self.delta_index = DenseVectorIndex(self.rag_config["embedding_dimension"])
+            self._replace_dense_index(self._create_dense_index(embeddings))
+            self._build_ann_index()
+            self.lexical_index.build(doc.get('text', '') for doc in self.documents)
+            self.metadata_index.build(self.documents)
+            self._invalidate_results()
+            
+            if snapshots is not None:
+                snapshots.save(fingerprint, {
+                    "dense_index": self.dense_index,
+                    "ann_index": self.ann_index,
+                    "lexical_index": self.lexical_index,
+                    "metadata_index": self.metadata_index
+                })
+            
+            self.logger.info(f"✅ Índice vectorial construido: {len(self.dense_index)} documentos")
+            return True
             
         except Exception as e:
-            processing_time = (datetime.now() - start_time).total_seconds()
-            self._update_metrics(processing_time, 0.0, False)
-            
-            return RAGResponse(
-                answer=f"Error procesando consulta: {str(e)}",
-                retrieved_documents=[],
-                confidence_score=0.0,
-                processing_time=processing_time,
-                metadata={"error": str(e)}
+            self.logger.error(f"❌ Error indexando documentos: {e}")
+            return False
+    
+    def _create_dense_index(self, embeddings) -> Union[DenseVectorIndex, QuantizedVectorIndex]:
+        """
+        Índice denso del segmento base: float32 exacto o, con
+        `vector_quantization`, códigos int8/PQ en RAM con re-scoring exacto
+        """
+        method = self.rag_config["vector_quantization"]
+        if method is None:
+            dense_index = DenseVectorIndex(self.rag_config["embedding_dimension"])
+        else:
+            dense_index = QuantizedVectorIndex(
+                dimension=self.rag_config["embedding_dimension"],
+                method=method,
+                rescore_factor=self.rag_config["rescore_factor"],
+                n_subvectors=self.rag_config["pq_subvectors"],
+                rescore_dir=self.rag_config["rescore_vectors_dir"]
             )
+        dense_index.build(embeddings)
+        return dense_index
     
-    def _preprocess_query(self, question: str) -> str:
-        """Preprocesa la consulta para mejorar retrieval"""
-        # Expandir abreviaciones técnicas comunes
-        expansions = {
-            "CAN": "Controller Area Network",
-            "SOC": "State of Charge",
-            "RPM": "Revoluciones Por Minuto",
-            "km/h": "kilómetros por hora"
-        }
+    def _replace_dense_index(self, dense_index):
+        previous, self.dense_index = self.dense_index, dense_index
+        if previous is not dense_index and isinstance(previous, QuantizedVectorIndex):
+            previous.release()
+    
+    def _build_ann_index(self):
+        """
+        Construye el índice IVF_FLAT cuando el corpus supera `ivf_min_documents`;
+        por debajo de ese tamaño la búsqueda exacta es más rápida
+        """
+        self.ann_index = self._create_ann_index(self.dense_index)
+        if self.ann_index is not None:
+            self.logger.info(f"📊 Índice IVF_FLAT construido (nlist={self.ann_index.nlist})")
+    
+    def _create_ann_index(self, dense_index: DenseVectorIndex) -> Optional[IVFIndex]:
+        n_docs = len(dense_index)
+        if n_docs < self.rag_config["ivf_min_documents"]:
+            return None
+        if self.rag_config["vector_quantization"] is not None:
+            # IVF_FLAT guarda los vectores float32 en RAM: con cuantización se recorren los códigos
+            return None
+        
+        ann_index = IVFIndex(
+            dimension=self.rag_config["embedding_dimension"],
+            nlist=int(4 * np.sqrt(n_docs)),
+            nprobe=self.rag_config["ivf_nprobe"]
+        )
+        ann_index.build(dense_index.matrix)
+        return ann_index
+    
+    def add_documents(self, documents: List[Dict], embeddings: Optional[List[List[float]]] = None) -> int:
+        """
+        Agrega documentos nuevos (p. ej. eventos CAN recién procesados).
+        Quedan buscables de inmediato: sus vectores van al segmento delta
+        (búsqueda exacta) y el texto al índice BM25.
+        """
+        documents = list(documents)
+        if embeddings is None:
+            embeddings = self._generate_document_embeddings([doc.get('text', '') for doc in documents])
+        if len(embeddings) != len(documents):
+            raise ValueError(f"Se esperaban {len(documents)} embeddings, se recibieron {len(embeddings)}")
+        
+        with self._index_lock:
+            self._append_documents(documents, embeddings)
+            self._invalidate_results()
         
-        processed = question
-        for abbrev, expansion in expansions.items():
-            processed = processed.replace(abbrev, f"{abbrev} ({expansion})")
+        self.logger.info(f"➕ {len(documents)} documentos agregados al segmento delta")
+        self._maybe_schedule_merge()
+        return len(documents)
+    
+    def update_documents(self, documents: List[Dict], embeddings: Optional[List[List[float]]] = None) -> int:
+        """
+        Reemplaza documentos existentes por `id` (los ids desconocidos se
+        agregan). La versión anterior queda con tombstone hasta el merge.
+        """
+        documents = list(documents)
+        keys = [document_key(doc) for doc in documents]
+        if any(key is None for key in keys):
+            raise ValueError("Todos los documentos a actualizar requieren 'id'")
+        if embeddings is None:
+            embeddings = self._generate_document_embeddings([doc.get('text', '') for doc in documents])
+        
+        with self._index_lock:
+            self.documents.delete(self.documents.positions(keys))
+            self._append_documents(documents, embeddings)
+            self._invalidate_results()
+        
+        self.logger.info(f"🔄 {len(documents)} documentos actualizados")
+        self._maybe_schedule_merge()
+        return len(documents)
+    
+    def delete_documents(self, document_ids: List[str]) -> int:
+        """Elimina documentos por `id`; retorna cuántos existían"""
+        with self._index_lock:
+            positions = self.documents.positions(document_ids)
+            self.documents.delete(positions)
+            if positions:
+                self._invalidate_results()
+        
+        self.logger.info(f"🗑️ {len(positions)} documentos eliminados")
+        self._maybe_schedule_merge()
+        return len(positions)
+    
+    def _append_documents(self, documents: List[Dict], embeddings: List[List[float]]):
+        """Agrega documentos y vectores al segmento delta y al índice BM25"""
+        self.documents.append(documents)
+        self.delta_index.add(embeddings)
+        self.metadata_index.update_delta(self.documents.delta_documents)
+        for doc in documents:
+            # BM25 es append-only: los ids coinciden con las posiciones del almacén
+            self.lexical_index.add_document(doc.get('text', ''))
+    
+    def _invalidate_results(self):
+        """Nueva versión del corpus: las respuestas en caché dejan de ser válidas"""
+        self.index_version += 1
+        self.result_cache.clear()
+        self.semantic_cache.clear()
+        self.context_packer.clear()
+    
+    def _live_mask(self) -> Optional[np.ndarray]:
+        """Máscara de documentos vigentes, o None si no hay tombstones"""
+        if self.documents.live_count == len(self.documents):
+            return None
+        return self.documents.live_mask
+    
+    def _maybe_schedule_merge(self):
+        store = self.documents
+        if should_merge(len(store.delta_documents), len(store), len(store) - store.live_count,
+                        self.rag_config["delta_merge_threshold"], self.rag_config["tombstone_merge_ratio"]):
+            self.merger.request()
+    
+    def _merge_segments(self):
+        """
+        Compacta base + delta (documentos, vectores, BM25 y bitmaps) en un
+        nuevo segmento base sin tombstones. Los vectores se reutilizan, no se
+        vuelven a calcular embeddings. La reconstrucción corre fuera del lock;
+        los cambios que llegan durante el merge se reaplican al final.
+        """
+        try:
+            with self._index_lock:
+                store = self.documents
+                cut = len(store)
+                live_before = store.live_mask
+                segments = [self.dense_index.matrix, self.delta_index.matrix]
+            
+            positions = np.flatnonzero(live_before)
+            merged = ColumnarDocumentStore.from_documents(store.to_dict(i) for i in positions.tolist())
+            # Filas vigentes de base + delta sin apilarlas: con cuantización se leen por bloques desde disco
+            dense_index = self._create_dense_index(StackedRows(segments, positions))
+            ann_index = self._create_ann_index(dense_index)
+            metadata_index = SegmentedBitmapIndex(BitmapIndex(self.metadata_index.fields))
+            metadata_index.build(merged)
+            lexical_index = BM25Index()
+            lexical_index.build(merged.text(i) for i in range(len(merged)))
+            delta_index = DenseVectorIndex(self.rag_config["embedding_dimension"])
             
-        return processed
+            with self._index_lock:
+                if self.documents is not store:
+                    # Se reindexó el corpus durante el merge
+                    return
+                
+                new_store = SegmentedDocumentStore(merged)
+                deleted_during = np.flatnonzero(store.deleted[:cut] & live_before)
+                new_store.delete(compaction_map(live_before)[deleted_during])
+                
+                pending = store.delta_documents[cut - store.base_size:]
+                if pending:
+                    start = len(new_store)
+                    new_store.append(pending)
+                    new_store.delete(start + np.flatnonzero(store.deleted[cut:]))
+                    delta_index.add(self.delta_index.matrix[cut - store.base_size:])
+                    metadata_index.update_delta(new_store.delta_documents)
+                    for doc in pending:
+                        lexical_index.add_document(doc.get('text', ''))
+                
+                self.documents = new_store
+                self._replace_dense_index(dense_index)
+                self.ann_index = ann_index
+                self.delta_index = delta_index
+                self.metadata_index = metadata_index
+                self.lexical_index = lexical_index
+            
+            self.logger.info(f"🔀 Merge de segmentos completado: {new_store.live_count} documentos")
+            
+        except Exception as e:
+            self.logger.error(f"❌ Error en merge de segmentos: {e}")
     
-    def _generate_query_embedding(self, query: str) -> List[float]:
-        """Genera embedding para la consulta"""
-        # Simulación - en implementación real usar watsonx embeddings
-        return [0.1] * self.rag_config["embedding_dimension"]
+    def _format_retrieved_document(self, doc_id: int, score: float) -> Dict:
+        """Adapta un documento del corpus al formato usado por reranking y contexto"""
+        doc = self.documents[doc_id]
+        metadata = doc.get('metadata', {})
+        
+        return {
+            "document_id": doc.get('id', doc.get('document_id', f"decode_ev_{doc_id:06d}")),
+            "title": doc.get('title') or f"Evento CAN: {metadata.get('evento_vehiculo', doc.get('document_type', 'N/A'))}",
+            "text": doc.get('text', ''),
+            "score": float(score),
+            "technical_density_score": doc.get('technical_density_score', 0),
+            "metadata": {
+                **metadata,
+                "event_type": metadata.get('event_type', metadata.get('evento_vehiculo', 'N/A')),
+                "severity": metadata.get('severity', metadata.get('intensidad', 'N/A')),
+                "timestamp": metadata.get('timestamp', metadata.get('timestamp_inicio', 'N/A'))
+            }
+        }
+    
+    def _dense_search(self, query_embedding: List[float], top_k: int,
+                      mask: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Búsqueda densa de una consulta (ver `_dense_search_batch`)"""
+        ids, scores = self._dense_search_batch(np.asarray(query_embedding, dtype=np.float32)[None, :], top_k, mask)
+        valid = ids[0] >= 0
+        return ids[0][valid], scores[0][valid]
     
-    def _semantic_retrieval(self, query_embedding: List[float], max_docs: int) -> List[Dict]:
+    def _dense_search_batch(self, query_embeddings: np.ndarray, top_k: int,
+                            mask: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Búsqueda densa sobre el segmento base (IVF_FLAT si está construido,
+        exacta en otro caso) y el segmento delta, fusionando por score.
+        Retorna matrices (n_consultas x k); las filas incompletas se rellenan con -1.
+        """
+        queries = np.asarray(query_embeddings, dtype=np.float32).reshape(-1, self.rag_config["embedding_dimension"])
+        base_size = len(self.dense_index)
+        if mask is not None:
+            # Pre-filtrado: búsqueda exacta solo sobre las filas que pasan el filtro
+            ids, scores = self.dense_index.search_batch(queries, top_k=top_k,
+                                                        candidate_ids=np.flatnonzero(mask[:base_size]))
+        elif self.ann_index is not None:
+            # Búsqueda aproximada: solo las `nprobe` listas más cercanas
+            ids, scores = self.ann_index.search_batch(queries, top_k=top_k)
+        else:
+            # Una sola multiplicación matricial (consultas x corpus) + top-k con argpartition
+            ids, scores = self.dense_index.search_batch(queries, top_k=top_k)
+        
+        if len(self.delta_index) == 0:
+            return ids, scores
+        
+        candidates = None if mask is None else np.flatnonzero(mask[base_size:])
+        delta_ids, delta_scores = self.delta_index.search_batch(queries, top_k=top_k, candidate_ids=candidates)
+        
+        ids = np.hstack([ids, delta_ids + base_size])
+        scores = np.hstack([scores, delta_scores])
+        top = top_k_indices(scores, top_k)
+        return np.take_along_axis(ids, top, axis=-1), np.take_along_axis(scores, top, axis=-1)
+    
+    def _lexical_search(self, query: str, top_k: int,
+                        mask: Optional[np.ndarray] = None) -> List[Tuple[int, float]]:
+        """Búsqueda léxica BM25"""
+        return self.lexical_index.search_terms(self.query_preprocessor.terms(query), top_k=top_k, mask=mask)
+    
+    def _hybrid_retrieval(self, query: str, query_embedding: List[float], max_docs: int,
+                          mask: Optional[np.ndarray] = None) -> List[Dict]:
+        """Ejecuta retrieval híbrido con fusión de scores léxicos y semánticos"""
+        hits = self.hybrid_retriever.search(query, query_embedding, top_k=max_docs, mask=mask)
+        return [self._format_retrieved_document(doc_id, score) for doc_id, score in hits]
+    
+    def _batch_retrieval(self, queries: List[str], query_embeddings: np.ndarray, max_docs: int,
+                         mask: Optional[np.ndarray] = None) -> List[List[Dict]]:
+        """Paso 3 para un grupo de consultas con los mismos filtros"""
+        if len(self.documents) == 0:
+            return [self._semantic_retrieval(embedding, max_docs, mask) for embedding in query_embeddings]
+        
+        if self.hybrid_retriever is not None:
+            hits = self.hybrid_retriever.search_batch(queries, query_embeddings, top_k=max_docs, mask=mask)
+            return [[self._format_retrieved_document(doc_id, score) for doc_id, score in row] for row in hits]
+        
+        doc_ids, scores = self._dense_search_batch(query_embeddings, max_docs, mask)
+        return [
+            [self._format_retrieved_document(int(i), s) for i, s in zip(row_ids, row_scores) if i >= 0]
+            for row_ids, row_scores in zip(doc_ids, scores)
+        ]
+    
+    def _semantic_retrieval(self, query_embedding: List[float], max_docs: int,
+                            mask: Optional[np.ndarray] = None) -> List[Dict]:
         """Ejecuta retrieval semántico"""
-        # Simulación de documentos recuperados
+        if len(self.documents) > 0:
+            doc_ids, scores = self._dense_search(query_embedding, max_docs, mask)
+            return [self._format_retrieved_document(int(i), s) for i, s in zip(doc_ids, scores)]
+        
+        # Simulación de documentos recuperados (sin corpus indexado)
         mock_docs = [
             {
                 "document_id": "decode_ev_000001",
@@ -453,27 +1105,42 @@ Mantén un tono profesional y técnico apropiado para ingenieros y técnicos veh
         return mock_docs[:max_docs]
     
     def _rerank_documents(self, query: str, documents: List[Dict]) -> List[Dict]:
-        """Reordena documentos por relevancia"""
-        # En implementación real, usar modelo de reranking de watsonx
-        return sorted(documents, key=lambda x: x.get("score", 0), reverse=True)
+        """
+        Reordena los candidatos con el reranker de características y conserva
+        solo `rerank_top_k` (los pasos de contexto y generación ven menos documentos)
+        """
+        known_values = {field: self.metadata_index.values(field)
+                        for field in MENTION_FIELDS if field in self.metadata_index.fields}
+        mentions = detect_metadata_mentions(query, known_values)
+        idf = self.lexical_index.idf if len(self.lexical_index) else None
+        return self.reranker.rerank(query, documents, mentions, idf, self.query_preprocessor.terms(query))
     
-    def _build_context(self, documents: List[Dict]) -> str:
+    def _build_context(self, documents: List[Dict], query: str = "") -> str:
         """Construye contexto para generación"""
-        context_parts = []
-        
-        for i, doc in enumerate(documents, 1):
-            context_part = f"""
-DOCUMENTO {i}:
-Título: {doc['title']}
-Contenido: {doc['text']}
-Tipo de Evento: {doc['metadata'].get('event_type', 'N/A')}
-Severidad: {doc['metadata'].get('severity', 'N/A')}
-Timestamp: {doc['metadata'].get('timestamp', 'N/A')}
----
-"""
-            context_parts.append(context_part)
+        return self._pack_context(documents, query).text
+    
+    def _pack_context(self, documents: List[Dict], query: str = "") -> PackedContext:
+        """
+        Selecciona documentos por relevancia/token dentro del presupuesto:
+        context_window - max_tokens - prompt de sistema - consulta
+        """
+        budget = (self.rag_config["context_window"] - self.rag_config["max_tokens"]
+                  - estimate_tokens(self.rag_config["system_prompt"]) - estimate_tokens(query))
+        relevance = [doc.get("rerank_score", doc.get("score", 0.0)) for doc in documents]
+        packed = self.context_packer.pack(documents, max(budget, 0), relevance)
         
-        return "\n".join(context_parts)
+        if packed.dropped or packed.truncated:
+            self.logger.info(f"✂️ Contexto ajustado a {packed.tokens}/{packed.budget} tokens: "
+                             f"{packed.dropped} documentos omitidos, {len(packed.truncated)} recortados")
+        return packed
+    
+    def _context_header(self, doc: Dict) -> Tuple[str, str]:
+        """Encabezado (antes del contenido) y pie de un documento en el contexto"""
+        metadata = doc['metadata']
+        return (f"Título: {doc['title']}\nContenido: ",
+                f"\nTipo de Evento: {metadata.get('event_type', 'N/A')}\n"
+                f"Severidad: {metadata.get('severity', 'N/A')}\n"
+                f"Timestamp: {metadata.get('timestamp', 'N/A')}\n---\n")
     
     def _generate_answer(self, query: str, context: str, rag_query: RAGQuery) -> str:
         """Genera respuesta usando LLM"""
@@ -529,23 +1196,24 @@ Los datos muestran eventos de alta severidad relacionados con maniobras bruscas
     
     def _update_metrics(self, processing_time: float, confidence: float, success: bool):
         """Actualiza métricas del sistema"""
-        self.metrics["total_queries"] += 1
-        
-        if success:
-            self.metrics["successful_retrievals"] += 1
-        
-        # Promedio móvil de tiempo de respuesta
-        total = self.metrics["total_queries"]
-        self.metrics["average_response_time"] = (
-            (self.metrics["average_response_time"] * (total - 1) + processing_time) / total
-        )
-        
-        # Promedio móvil de confianza
-        if success:
-            successful = self.metrics["successful_retrievals"]
-            self.metrics["average_confidence"] = (
-                (self.metrics["average_confidence"] * (successful - 1) + confidence) / successful
+        with self._metrics_lock:
+            self.metrics["total_queries"] += 1
+            
+            if success:
+                self.metrics["successful_retrievals"] += 1
+            
+            # Promedio móvil de tiempo de respuesta
+            total = self.metrics["total_queries"]
+            self.metrics["average_response_time"] = (
+                (self.metrics["average_response_time"] * (total - 1) + processing_time) / total
             )
+            
+            # Promedio móvil de confianza
+            if success:
+                successful = self.metrics["successful_retrievals"]
+                self.metrics["average_confidence"] = (
+                    (self.metrics["average_confidence"] * (successful - 1) + confidence) / successful
+                )
     
     def get_system_metrics(self) -> Dict[str, Any]:
         """Retorna métricas actuales del sistema"""
@@ -560,6 +1228,19 @@ Los datos muestran eventos de alta severidad relacionados con maniobras bruscas
             "success_rate": f"{success_rate:.2%}",
             "average_response_time": f"{self.metrics['average_response_time']:.2f}s",
             "average_confidence": f"{self.metrics['average_confidence']:.2f}",
+            "index_segments": {
+                "live_documents": self.documents.live_count,
+                "delta_documents": len(self.documents.delta_documents),
+                "tombstones": len(self.documents) - self.documents.live_count,
+                "merges_completed": self.merger.merges_completed
+            },
+            "index_version": self.index_version,
+            "vector_storage": {
+                "quantization": self.rag_config["vector_quantization"] or "float32",
+                "ram_bytes": self.dense_index.memory_usage() + self.delta_index.memory_usage()
+            },
+            "result_cache": self.result_cache.stats(),
+            "semantic_cache": {**self.semantic_cache.stats(), "active": self._semantic_cache_active()},
             "rag_configuration": self.rag_config,
             "last_updated": datetime.now().isoformat()
         }
@@ -581,6 +1262,12 @@ def demo_decode_ev_rag():
     # Inicializar sistema RAG
     rag_system = DecodeEVRAGSystem(config, "demo-collection-id")
     
+    # Indexar dataset procesado si está disponible
+    dataset_path = Path(__file__).parent / "dataset_processed_watsonx.jsonl"
+    if dataset_path.exists():
+        with jsonlines.open(dataset_path) as reader:
+            rag_system.index_documents(list(reader), snapshot_dir=str(dataset_path.parent / ".index_snapshots"))
+    
     # Inicializar pipeline
     if rag_system.initialize_rag_pipeline():
         
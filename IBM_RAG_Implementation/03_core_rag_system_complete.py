@@ -3,16 +3,30 @@
 
 import os
 import json
-import jsonlines
 import pandas as pd
 import numpy as np
-from typing import Dict, List, Any, Optional, Tuple
+from typing import Dict, FrozenSet, Iterator, List, Any, Optional, Tuple
 import logging
 from datetime import datetime
 from pathlib import Path
 import re
-from dataclasses import dataclass, field
+from dataclasses import dataclass, field, replace
 import time
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+from lexical_index import BM25Index
+from metadata_filters import BitmapIndex, filters_key, validate_filters
+from document_store import ColumnarDocumentStore
+from binary_corpus import load_or_compile
+from index_snapshots import IndexSnapshotStore, dataset_fingerprint
+from result_cache import InFlightCall, QueryResultCache, SingleFlight, query_cache_key
+from context_packer import ContextPacker, PackedContext, estimate_tokens
+from query_intents import IntentMatcher, first_intent
+from streaming_generation import GenerationStream, GraniteStreamClient, text_chunks
+from incremental_index import (SegmentedDocumentStore, SegmentedBitmapIndex, BackgroundMerger,
+                               compaction_map, document_key, should_merge)
 
 # Importación condicional de librerías IBM
 try:
@@ -30,6 +44,17 @@ except ImportError:
 # Configuración de logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+# Clases persistidas en los snapshots de índices (su estructura forma parte de la clave)
+SNAPSHOT_SCHEMA = (SegmentedBitmapIndex, BitmapIndex, BM25Index)
+
+# Categorías de recuperación (en orden de prioridad) y plantilla por tipo de respuesta
+ROUTE_PRIORITY = ('voltaje', 'corriente', 'temperatura', 'carga', 'documentacion_tecnica')
+TEMPLATE_BY_INTENT = {
+    "diagnostico": "diagnostico_can",
+    "explicacion": "explicacion_evento",
+    "tendencias": "analisis_tendencias"
+}
+
 @dataclass
 class RAGQuery:
     """Estructura para consultas RAG"""
@@ -46,25 +71,44 @@ class RAGResponse:
     retrieved_documents: List[Dict]
     confidence_score: float
     processing_time: float
+    time_to_first_token: Optional[float] = None
     metadata: Dict[str, Any] = field(default_factory=dict)
 
+@dataclass(frozen=True)
+class PrecomputedFilterMask:
+    """Máscara de context_filters calculada en una generación del índice (solo válida en esa generación)"""
+    generation: int
+    mask: Optional[np.ndarray]
+
 class DecodeEVRAGSystem:
     """
     Sistema RAG principal para DECODE-EV integrado con IBM watsonx
     Permite consultas conversacionales sobre datos CAN vehiculares
     """
     
-    def __init__(self, wml_client: Any = None, discovery_client: Any = None):
+    def __init__(self, wml_client: Any = None, discovery_client: Any = None,
+                 generation_client: Optional[GraniteStreamClient] = None):
         """
-        Inicializa el sistema RAG con clientes IBM watsonx
+        Inicializa el sistema RAG con clientes IBM watsonx.
+        Sin `generation_client` la respuesta se simula a partir de los documentos.
         """
         self.wml_client = wml_client
         self.discovery_client = discovery_client
+        self.generation_client = generation_client
         self.logger = logging.getLogger(__name__)
         
-        # Dataset procesado cargado en memoria
-        self.documents = []
-        self.vector_index = {}
+        # Dataset procesado cargado en memoria (almacén columnar + segmento delta)
+        self.documents = SegmentedDocumentStore()
+        self.metadata_index = SegmentedBitmapIndex()
+        self.lexical_index = BM25Index()
+        self.relevance_scores = np.zeros(0)
+        self.route_rankings = {}
+        self.route_masks = {}
+        self.dataset_fingerprint = None
+        
+        # Cambios incrementales: el lock protege el intercambio de índices tras un merge
+        self._index_lock = threading.RLock()
+        self.merger = BackgroundMerger(self._merge_segments, name="decode_ev_merge")
         
         # Configuración del modelo RAG
         self.rag_config = {
@@ -73,9 +117,26 @@ class DecodeEVRAGSystem:
             "max_context_length": 4096,
             "top_k_retrieval": 3,
             "temperature": 0.3,
-            "max_new_tokens": 512
+            "max_new_tokens": 512,
+            "context_snippet_tokens": 256,
+            "batch_max_concurrency": 8,
+            "delta_merge_threshold": 1000,
+            "tombstone_merge_ratio": 0.2,
+            "result_cache_size": 256,
+            "result_cache_ttl": 300,
+            "single_flight_timeout": 120
         }
         
+        # Caché de resultados: la versión cambia con cada modificación del corpus
+        self.index_version = 0
+        # Generación del índice: cambia también con el merge (las posiciones se compactan)
+        self.index_generation = 0
+        self.result_cache = QueryResultCache(self.rag_config["result_cache_size"],
+                                             self.rag_config["result_cache_ttl"])
+        
+        # Consultas idénticas en vuelo: una sola recuperación + generación
+        self.single_flight = SingleFlight()
+        
         # Plantillas de prompt especializadas
         self.prompt_templates = {
             "diagnostico_can": """Basándote en la siguiente información técnica de redes CAN vehiculares, 
@@ -118,6 +179,15 @@ Análisis requerido:
 
 Análisis:"""
         }
+        
+        # Intenciones de la consulta: un solo matcher compilado para plantilla, ruteo y respuesta
+        self.intent_matcher = IntentMatcher()
+        
+        # Contexto acotado al presupuesto de tokens (encabezados por documento en caché)
+        self.context_packer = ContextPacker(self._context_header, label="[Documento {n}]\n",
+                                            max_snippet_tokens=self.rag_config["context_snippet_tokens"])
+        self._prompt_overhead_tokens = max(estimate_tokens(template.format(query="", context=""))
+                                           for template in self.prompt_templates.values())
     
     def load_processed_dataset(self, dataset_path: str) -> bool:
         """
@@ -130,165 +200,397 @@ Análisis:"""
                 self.logger.error(f"❌ Dataset no encontrado: {dataset_path}")
                 return False
             
-            # Cargar documentos procesados
-            self.documents = []
-            with jsonlines.open(dataset_path) as reader:
-                for doc in reader:
-                    self.documents.append(doc)
+            # Mapear el corpus binario compilado (se compila si el JSONL cambió);
+            # el texto de cada documento solo se decodifica al accederlo
+            self.documents = SegmentedDocumentStore(load_or_compile(dataset_path))
             
             self.logger.info(f"✅ Cargados {len(self.documents)} documentos procesados")
             
-            # Generar índice simple por tipo de documento
-            self._build_simple_index()
+            # Los índices se reconstruyen solo si el contenido del dataset cambió
+            self.dataset_fingerprint = dataset_fingerprint(dataset_path)
+            snapshots = IndexSnapshotStore(Path(dataset_path).parent / ".index_snapshots",
+                                           name=Path(dataset_path).stem, schema=SNAPSHOT_SCHEMA)
             
+            if not self._load_index_snapshot(snapshots):
+                # Generar índice simple por tipo de documento
+                self._build_simple_index()
+                
+                # Índice léxico BM25 (se construye una sola vez por carga)
+                self._build_lexical_index()
+                
+                snapshots.save(self.dataset_fingerprint, self._index_snapshot_payload())
+            
+            self._invalidate_results()
             return True
             
         except Exception as e:
             self.logger.error(f"❌ Error cargando dataset: {e}")
             return False
     
+    def _index_snapshot_payload(self) -> Dict[str, Any]:
+        """Índices de retrieval que se persisten en el snapshot"""
+        return {
+            "n_docs": len(self.documents),
+            "metadata_index": self.metadata_index,
+            "lexical_index": self.lexical_index,
+            "relevance_scores": self.relevance_scores,
+            "route_masks": self.route_masks,
+            "route_rankings": self.route_rankings
+        }
+    
+    def _load_index_snapshot(self, snapshots: IndexSnapshotStore) -> bool:
+        """
+        Restaura los índices desde el snapshot del dataset actual.
+        Retorna False si no existe o no corresponde (checksum, versión o tamaño).
+        """
+        payload = snapshots.load(self.dataset_fingerprint)
+        if payload is None or payload.get("n_docs") != len(self.documents):
+            return False
+        
+        self.metadata_index = payload["metadata_index"]
+        self.lexical_index = payload["lexical_index"]
+        self.relevance_scores = payload["relevance_scores"]
+        self.route_masks = payload["route_masks"]
+        self.route_rankings = payload["route_rankings"]
+        
+        self.logger.info(f"⚡ Índices restaurados desde snapshot ({self.dataset_fingerprint[:12]})")
+        return True
+    
     def _build_simple_index(self):
         """
-        Construye índice simple de documentos por categorías
+        Construye los índices bitmap de metadatos (document_type, red_can,
+        intensidad, evento_vehiculo, contexto_operativo, vehicle_id)
+        """
+        self.metadata_index = SegmentedBitmapIndex()
+        self.metadata_index.build(self.documents)
+        
+        self.logger.info("📊 Índice de documentos construido")
+        
+    def _build_lexical_index(self):
+        """
+        Construye el índice BM25 y los rankings precalculados por categoría
+        de consulta (una sola vez por carga del dataset)
+        """
+        self.lexical_index = BM25Index()
+        self.lexical_index.build(doc.get('text', '') for doc in self.documents)
+        
+        self._build_route_rankings()
+        
+        self.logger.info(f"📚 Índice BM25 construido ({len(self.lexical_index.postings)} términos)")
+    
+    def _build_route_rankings(self):
         """
-        self.vector_index = {
-            'eventos_can': [],
-            'documentacion_tecnica': [],
-            'por_red_can': {},
-            'por_intensidad': {},
-            'por_evento': {}
+        Máscaras y rankings por categoría, restringidos a los documentos
+        vigentes. Se reconstruyen completos al cargar y en cada merge; los
+        cambios incrementales usan `_extend_route_rankings` y `_drop_from_routes`
+        """
+        store = self.documents
+        route_masks, relevance_scores = self._route_columns(store, self.metadata_index)
+        
+        route_rankings = {}
+        for route, mask in route_masks.items():
+            mask &= store.live_mask
+            ranking = np.flatnonzero(mask)
+            route_rankings[route] = ranking[np.argsort(-relevance_scores[ranking], kind='stable')]
+        
+        self.relevance_scores = relevance_scores
+        self.route_masks = route_masks
+        self.route_rankings = route_rankings
+    
+    def _route_columns(self, store, bitmaps) -> Tuple[Dict[str, np.ndarray], np.ndarray]:
+        """Máscaras por categoría y orden de respaldo de un almacén (completo o solo el delta)"""
+        # Máscaras por categoría calculadas sobre columnas y bitmaps (sin recorrer dicts)
+        route_masks = {
+            'voltaje': store.numeric('density_voltaje') > 0,
+            'corriente': store.numeric('density_corriente') > 0,
+            'temperatura': store.numeric('density_temperatura') > 0,
+            'carga': bitmaps.filter_mask({'evento_vehiculo': 'carga'}),
+            'documentacion_tecnica': bitmaps.filter_mask({'document_type': 'documentacion_tecnica'}),
+            'general': store.numeric('technical_density_score') > 0
         }
         
-        for i, doc in enumerate(self.documents):
-            doc_type = doc.get('document_type', 'unknown')
-            metadata = doc.get('metadata', {})
-            
-            # Índice por tipo de documento
-            if doc_type == 'evento_can':
-                self.vector_index['eventos_can'].append(i)
-            elif doc_type == 'documentacion_tecnica':
-                self.vector_index['documentacion_tecnica'].append(i)
-            
-            # Índice por red CAN
-            red_can = metadata.get('red_can', 'unknown')
-            if red_can not in self.vector_index['por_red_can']:
-                self.vector_index['por_red_can'][red_can] = []
-            self.vector_index['por_red_can'][red_can].append(i)
-            
-            # Índice por intensidad
-            intensidad = metadata.get('intensidad', 'unknown')
-            if intensidad not in self.vector_index['por_intensidad']:
-                self.vector_index['por_intensidad'][intensidad] = []
-            self.vector_index['por_intensidad'][intensidad].append(i)
-            
-            # Índice por tipo de evento
-            evento = metadata.get('evento_vehiculo', 'unknown')
-            if evento not in self.vector_index['por_evento']:
-                self.vector_index['por_evento'][evento] = []
-            self.vector_index['por_evento'][evento].append(i)
+        # Orden de respaldo: densidad técnica + complejidad
+        relevance_scores = store.numeric('technical_density_score') + store.numeric('complexity_score')
+        return route_masks, relevance_scores
+    
+    def _extend_route_rankings(self, start: int):
+        """
+        Incorpora las posiciones [start, len) recién agregadas al delta:
+        máscaras y puntajes solo del delta, y cada ranking recibe las nuevas
+        posiciones por inserción ordenada (sin reordenar el corpus)
+        """
+        store = self.documents
+        base_size = store.base_size
+        delta_masks, delta_scores = self._route_columns(store.delta, self.metadata_index.delta)
+        delta_live = store.live_mask[base_size:]
         
-        self.logger.info("📊 Índice de documentos construido")
+        self.relevance_scores = np.concatenate([self.relevance_scores[:base_size], delta_scores])
+        new_positions = np.arange(start, len(store))
         
-    def retrieve_relevant_documents(self, query: str, top_k: int = 3) -> List[Dict]:
+        for route, delta_mask in delta_masks.items():
+            delta_mask &= delta_live
+            base_mask = self.route_masks.get(route, np.zeros(0, dtype=bool))[:base_size]
+            self.route_masks[route] = np.concatenate([base_mask, delta_mask])
+            
+            added = new_positions[delta_mask[start - base_size:]]
+            if not added.size:
+                continue
+            added = added[np.argsort(-self.relevance_scores[added], kind='stable')]
+            ranking = np.asarray(self.route_rankings.get(route, []), dtype=np.int64)
+            # Empates: las posiciones nuevas van después (igual que el orden estable del build)
+            slots = np.searchsorted(-self.relevance_scores[ranking], -self.relevance_scores[added], side='right')
+            self.route_rankings[route] = np.insert(ranking, slots, added)
+    
+    def _drop_from_routes(self, positions: List[int]):
+        """
+        Quita documentos con tombstone de las máscaras por categoría; los
+        rankings los conservan hasta el merge y la recuperación los omite
+        """
+        if positions:
+            for mask in self.route_masks.values():
+                mask[positions] = False
+    
+    def add_documents(self, documents: List[Dict]) -> int:
+        """
+        Agrega documentos nuevos (p. ej. eventos CAN recién procesados).
+        Quedan buscables de inmediato a través del segmento delta.
         """
-        Recupera documentos relevantes basado en la consulta
+        documents = list(documents)
+        with self._index_lock:
+            self._append_documents(documents)
+            self._invalidate_results()
+        
+        self.logger.info(f"➕ {len(documents)} documentos agregados al segmento delta")
+        self._maybe_schedule_merge()
+        return len(documents)
+    
+    def update_documents(self, documents: List[Dict]) -> int:
+        """
+        Reemplaza documentos existentes por `id` (los ids desconocidos se
+        agregan). La versión anterior queda con tombstone hasta el merge.
+        """
+        documents = list(documents)
+        keys = [document_key(doc) for doc in documents]
+        if any(key is None for key in keys):
+            raise ValueError("Todos los documentos a actualizar requieren 'id'")
+        
+        with self._index_lock:
+            positions = self.documents.positions(keys)
+            self.documents.delete(positions)
+            self._drop_from_routes(positions)
+            self._append_documents(documents)
+            self._invalidate_results()
+        
+        self.logger.info(f"🔄 {len(documents)} documentos actualizados")
+        self._maybe_schedule_merge()
+        return len(documents)
+    
+    def delete_documents(self, document_ids: List[str]) -> int:
+        """Elimina documentos por `id`; retorna cuántos existían"""
+        with self._index_lock:
+            positions = self.documents.positions(document_ids)
+            self.documents.delete(positions)
+            self._drop_from_routes(positions)
+            if positions:
+                self._invalidate_results()
+        
+        self.logger.info(f"🗑️ {len(positions)} documentos eliminados")
+        self._maybe_schedule_merge()
+        return len(positions)
+    
+    def _append_documents(self, documents: List[Dict]):
+        """Agrega documentos al delta y actualiza los índices léxico, de metadatos y por categoría"""
+        start = len(self.documents)
+        self.documents.append(documents)
+        self.metadata_index.update_delta(self.documents.delta_documents)
+        for doc in documents:
+            # BM25 es append-only: los ids coinciden con las posiciones del almacén
+            self.lexical_index.add_document(doc.get('text', ''))
+        self._extend_route_rankings(start)
+    
+    def _invalidate_results(self):
+        """Nueva versión del corpus: las respuestas en caché dejan de ser válidas"""
+        self.index_version += 1
+        self.index_generation += 1
+        self.result_cache.clear()
+        self.context_packer.clear()
+    
+    def _maybe_schedule_merge(self):
+        store = self.documents
+        if should_merge(len(store.delta_documents), len(store), len(store) - store.live_count,
+                        self.rag_config["delta_merge_threshold"], self.rag_config["tombstone_merge_ratio"]):
+            self.merger.request()
+    
+    def _merge_segments(self):
+        """
+        Compacta base + delta en un nuevo segmento base sin tombstones.
+        La reconstrucción corre fuera del lock; los cambios que llegan durante
+        el merge se reaplican al intercambiar los índices.
         """
         try:
-            # Análisis simple de la consulta para determinar categoría
-            query_lower = query.lower()
-            relevant_docs = []
-            
-            # Estrategia de recuperación basada en palabras clave
-            if any(keyword in query_lower for keyword in ['voltaje', 'voltage', 'v']):
-                # Buscar documentos con densidad de voltaje
-                for i, doc in enumerate(self.documents):
-                    if doc.get('metadata', {}).get('density_voltaje', 0) > 0:
-                        relevant_docs.append((i, doc))
-            
-            elif any(keyword in query_lower for keyword in ['corriente', 'current', 'amper']):
-                # Buscar documentos con densidad de corriente
-                for i, doc in enumerate(self.documents):
-                    if doc.get('metadata', {}).get('density_corriente', 0) > 0:
-                        relevant_docs.append((i, doc))
-            
-            elif any(keyword in query_lower for keyword in ['temperatura', 'temperature', 'calor']):
-                # Buscar documentos con densidad de temperatura
-                for i, doc in enumerate(self.documents):
-                    if doc.get('metadata', {}).get('density_temperatura', 0) > 0:
-                        relevant_docs.append((i, doc))
-            
-            elif any(keyword in query_lower for keyword in ['carga', 'charging', 'bateria']):
-                # Buscar eventos de carga
-                for i, doc in enumerate(self.documents):
-                    if doc.get('metadata', {}).get('evento_vehiculo') == 'carga':
-                        relevant_docs.append((i, doc))
-            
-            elif any(keyword in query_lower for keyword in ['j1939', 'protocol', 'standard']):
-                # Buscar documentación técnica
-                indices = self.vector_index.get('documentacion_tecnica', [])
-                for i in indices:
-                    relevant_docs.append((i, self.documents[i]))
-            
-            else:
-                # Recuperación general - documentos con mayor densidad técnica
-                for i, doc in enumerate(self.documents):
-                    density_score = doc.get('technical_density_score', 0)
-                    if density_score > 0:
-                        relevant_docs.append((i, doc))
-            
-            # Ordenar por relevancia (densidad técnica o score de complejidad)
-            relevant_docs.sort(key=lambda x: (
-                x[1].get('technical_density_score', 0) + 
-                x[1].get('complexity_score', 0)
-            ), reverse=True)
-            
-            # Retornar top-k documentos
-            return [doc for _, doc in relevant_docs[:top_k]]
+            with self._index_lock:
+                store = self.documents
+                cut = len(store)
+                live_before = store.live_mask
+            
+            merged = ColumnarDocumentStore.from_documents(store.to_dict(i) for i in np.flatnonzero(live_before).tolist())
+            metadata_index = SegmentedBitmapIndex(BitmapIndex(self.metadata_index.fields))
+            metadata_index.build(merged)
+            lexical_index = BM25Index()
+            lexical_index.build(merged.text(i) for i in range(len(merged)))
+            
+            with self._index_lock:
+                if self.documents is not store:
+                    # El dataset se recargó durante el merge
+                    return
+                
+                new_store = SegmentedDocumentStore(merged)
+                deleted_during = np.flatnonzero(store.deleted[:cut] & live_before)
+                new_store.delete(compaction_map(live_before)[deleted_during])
+                
+                pending = store.delta_documents[cut - store.base_size:]
+                if pending:
+                    start = len(new_store)
+                    new_store.append(pending)
+                    new_store.delete(start + np.flatnonzero(store.deleted[cut:]))
+                    metadata_index.update_delta(new_store.delta_documents)
+                    for doc in pending:
+                        lexical_index.add_document(doc.get('text', ''))
+                
+                self.documents = new_store
+                self.metadata_index = metadata_index
+                self.lexical_index = lexical_index
+                self._build_route_rankings()
+                self.index_generation += 1
+            
+            self.logger.info(f"🔀 Merge de segmentos completado: {new_store.live_count} documentos")
+            
+        except Exception as e:
+            self.logger.error(f"❌ Error en merge de segmentos: {e}")
+    
+    def _route_query(self, intents: FrozenSet[str]) -> str:
+        """
+        Determina la categoría de recuperación a partir de las intenciones de la consulta
+        """
+        return first_intent(intents, ROUTE_PRIORITY, 'general')
+    
+    def retrieve_relevant_documents(self, query: str, top_k: int = 3,
+                                    filters: Optional[Dict[str, Any]] = None,
+                                    filter_mask: Optional[PrecomputedFilterMask] = None,
+                                    intents: Optional[FrozenSet[str]] = None) -> List[Dict]:
+        """
+        Recupera documentos relevantes basado en la consulta.
+        Puntúa con BM25 solo los postings de los términos de la consulta,
+        restringidos a la categoría detectada y a los filtros de metadatos.
+        `filter_mask` e `intents` permiten reutilizar la máscara de `filters` y
+        las intenciones ya detectadas; la máscara solo se reutiliza si se
+        calculó en la generación actual del índice.
+        """
+        if intents is None:
+            intents = self.intent_matcher.match(query)
+        
+        # Un filtro inválido es un error de la consulta, no "sin resultados"
+        validate_filters(filters, self.metadata_index.fields)
+        
+        try:
+            with self._index_lock:
+                route = self._route_query(intents)
+                route_mask = self.route_masks.get(route)
+                
+                # Pre-filtrado por metadatos: solo se puntúan documentos vigentes que pasan el filtro
+                if filter_mask is not None and filter_mask.generation == self.index_generation:
+                    filter_mask = filter_mask.mask
+                else:
+                    filter_mask = self._filter_mask(filters)
+                if filter_mask is not None:
+                    mask = filter_mask if route_mask is None else route_mask & filter_mask
+                    # Los filtros explícitos tienen prioridad sobre la categoría detectada
+                    return self._retrieve_filtered(query, top_k, mask if mask.any() else filter_mask)
+                
+                hits = self.lexical_index.search(query, top_k=top_k, mask=route_mask)
+                selected = [doc_id for doc_id, _ in hits]
+                
+                # Completar con el ranking precalculado de la categoría
+                if len(selected) < top_k:
+                    seen = set(selected)
+                    for doc_id in self.route_rankings.get(route, ()):
+                        if len(selected) >= top_k:
+                            break
+                        # Los documentos con tombstone siguen en el ranking hasta el merge
+                        if doc_id not in seen and route_mask[doc_id]:
+                            selected.append(int(doc_id))
+                
+                return [self.documents[i] for i in selected]
             
         except Exception as e:
             self.logger.error(f"❌ Error en recuperación de documentos: {e}")
             return []
     
+    def _filter_mask(self, filters: Optional[Dict[str, Any]]) -> Optional[np.ndarray]:
+        """Documentos vigentes que pasan `filters`, o None si no hay filtros"""
+        filter_mask = self.metadata_index.filter_mask(filters)
+        if filter_mask is not None:
+            filter_mask &= self.documents.live_mask
+        return filter_mask
+    
+    def _retrieve_filtered(self, query: str, top_k: int, mask: np.ndarray) -> List[Dict]:
+        """
+        Recuperación restringida a una máscara de candidatos (categoría + filtros)
+        """
+        hits = self.lexical_index.search(query, top_k=top_k, mask=mask)
+        selected = [doc_id for doc_id, _ in hits]
+        
+        # Completar con los candidatos de mayor densidad técnica + complejidad
+        if len(selected) < top_k:
+            candidates = np.setdiff1d(np.flatnonzero(mask), selected)
+            order = np.argsort(-self.relevance_scores[candidates], kind='stable')
+            selected.extend(candidates[order[:top_k - len(selected)]].tolist())
+        
+        return [self.documents[i] for i in selected]
+    
     def generate_context_prompt(self, query: str, documents: List[Dict]) -> str:
         """
         Genera el contexto para el prompt basado en documentos recuperados
         """
-        context_parts = []
+        return self.pack_context(query, documents).text
+    
+    def pack_context(self, query: str, documents: List[Dict]) -> PackedContext:
+        """
+        Empaqueta los documentos (en orden de relevancia) dentro del presupuesto:
+        max_context_length - max_new_tokens - plantilla - consulta
+        """
+        budget = (self.rag_config["max_context_length"] - self.rag_config["max_new_tokens"]
+                  - self._prompt_overhead_tokens - estimate_tokens(query))
+        packed = self.context_packer.pack(documents, max(budget, 0))
         
-        for i, doc in enumerate(documents):
-            doc_text = doc.get('text', '')
-            metadata = doc.get('metadata', {})
-            
-            # Información del documento
-            doc_info = f"[Documento {i+1}]\n"
-            doc_info += f"Tipo: {doc.get('document_type', 'N/A')}\n"
-            
-            if metadata.get('red_can'):
-                doc_info += f"Red CAN: {metadata['red_can']}\n"
-            if metadata.get('evento_vehiculo'):
-                doc_info += f"Evento: {metadata['evento_vehiculo']}\n"
-            if metadata.get('intensidad'):
-                doc_info += f"Intensidad: {metadata['intensidad']}\n"
-            
-            doc_info += f"Contenido: {doc_text[:500]}...\n"
-            context_parts.append(doc_info)
+        if packed.dropped or packed.truncated:
+            self.logger.info(f"✂️ Contexto ajustado a {packed.tokens}/{packed.budget} tokens: "
+                             f"{packed.dropped} documentos omitidos, {len(packed.truncated)} recortados")
+        return packed
+    
+    def _context_header(self, doc: Dict) -> Tuple[str, str]:
+        """Encabezado (antes del contenido) y pie de un documento en el contexto"""
+        metadata = doc.get('metadata', {})
+        header = f"Tipo: {doc.get('document_type', 'N/A')}\n"
         
-        return "\n".join(context_parts)
+        if metadata.get('red_can'):
+            header += f"Red CAN: {metadata['red_can']}\n"
+        if metadata.get('evento_vehiculo'):
+            header += f"Evento: {metadata['evento_vehiculo']}\n"
+        if metadata.get('intensidad'):
+            header += f"Intensidad: {metadata['intensidad']}\n"
+        
+        return header + "Contenido: ", "\n"
     
-    def select_prompt_template(self, query: str) -> str:
+    def select_prompt_template(self, query: str, intents: Optional[FrozenSet[str]] = None) -> str:
         """
         Selecciona la plantilla de prompt más apropiada basada en la consulta
         """
-        query_lower = query.lower()
+        if intents is None:
+            intents = self.intent_matcher.match(query)
         
-        if any(keyword in query_lower for keyword in ['diagnostico', 'diagnostic', 'problema', 'error', 'falla']):
-            return "diagnostico_can"
-        elif any(keyword in query_lower for keyword in ['evento', 'event', 'que paso', 'explicar']):
-            return "explicacion_evento"  
-        elif any(keyword in query_lower for keyword in ['tendencia', 'trend', 'patron', 'analisis', 'analysis']):
-            return "analisis_tendencias"
-        else:
-            return "explicacion_evento"  # Default
+        intent = first_intent(intents, ("diagnostico", "explicacion", "tendencias"), "explicacion")
+        return TEMPLATE_BY_INTENT[intent]
     
     def query_rag_system(self, query: str, max_tokens: int = 512) -> Dict[str, Any]:
         """
@@ -299,8 +601,12 @@ Análisis:"""
         try:
             self.logger.info(f"🔍 Procesando consulta: {query[:100]}...")
             
+            # Intenciones detectadas una sola vez para ruteo, plantilla y respuesta
+            intents = self.intent_matcher.match(query)
+            
             # 1. Recuperar documentos relevantes
-            relevant_docs = self.retrieve_relevant_documents(query, top_k=self.rag_config["top_k_retrieval"])
+            relevant_docs = self.retrieve_relevant_documents(query, top_k=self.rag_config["top_k_retrieval"],
+                                                             intents=intents)
             
             if not relevant_docs:
                 return {
@@ -311,18 +617,19 @@ Análisis:"""
                     "processing_time": time.time() - start_time
                 }
             
-            # 2. Generar contexto
-            context = self.generate_context_prompt(query, relevant_docs)
+            # 2. Generar contexto (solo los documentos que caben en el presupuesto)
+            packed = self.pack_context(query, relevant_docs)
+            context, relevant_docs = packed.text, packed.documents
             
             # 3. Seleccionar plantilla de prompt
-            template_key = self.select_prompt_template(query)
+            template_key = self.select_prompt_template(query, intents)
             prompt_template = self.prompt_templates[template_key]
             
             # 4. Generar prompt final
             final_prompt = prompt_template.format(query=query, context=context)
             
             # 5. Generar respuesta (simulada por ahora)
-            response = self._generate_response_simulation(query, relevant_docs, context)
+            response = self._generate_response_simulation(query, relevant_docs, context, intents)
             
             # 6. Preparar fuentes
             sources = []
@@ -344,6 +651,7 @@ Análisis:"""
                 "success": True,
                 "prompt_template": template_key,
                 "context_length": len(context),
+                "context_tokens": packed.tokens,
                 "processing_time": processing_time
             }
             
@@ -357,48 +665,250 @@ Análisis:"""
                 "processing_time": time.time() - start_time
             }
     
-    def query_rag(self, query: RAGQuery) -> RAGResponse:
+    def query_rag(self, query: RAGQuery, filter_mask: Optional[PrecomputedFilterMask] = None) -> RAGResponse:
         """
-        Ejecuta consulta usando estructura de datos RAG formal
+        Ejecuta consulta usando estructura de datos RAG formal.
+        Consultas idénticas concurrentes (misma clave de caché) comparten una
+        sola ejecución: la primera recupera y genera, las demás esperan su resultado.
         """
         start_time = time.time()
         
+        # Filtros inválidos: error explícito, sin pasar por la caché ni por la coalescencia
         try:
-            # 1. Recuperar documentos relevantes
-            relevant_docs = self.retrieve_relevant_documents(query.question, top_k=query.max_retrieved_docs)
-            
-            # 2. Generar contexto
-            context = self.generate_context_prompt(query.question, relevant_docs)
+            validate_filters(query.context_filters, self.metadata_index.fields)
+        except ValueError as e:
+            return self._error_response(e, start_time)
+        
+        # Preguntas repetidas (consultas de ejemplo, chequeos de inicio de turno)
+        cache_key = query_cache_key(query, self.index_version)
+        cached = self.result_cache.get(cache_key)
+        if cached is not None:
+            return self._cached_response(cached, start_time, time.time() - start_time)
+        
+        # Misma pregunta ya en vuelo (p. ej. varios técnicos ante la misma falla)
+        call, leader = self.single_flight.begin(cache_key)
+        if not leader:
+            response, shared = self._await_shared(call, query, filter_mask, start_time, cache_key)
+            if not shared:
+                return response
+            return self._coalesced_response(response, start_time, time.time() - start_time)
+        
+        try:
+            rag_response = self._run_query(query, filter_mask, start_time, cache_key)
+        except BaseException as e:
+            self.single_flight.finish(cache_key, call, error=e)
+            raise
+        self.single_flight.finish(cache_key, call, rag_response)
+        return rag_response
+    
+    def _run_query(self, query: RAGQuery, filter_mask: Optional[PrecomputedFilterMask], start_time: float,
+                   cache_key: Tuple) -> RAGResponse:
+        try:
+            intents, packed = self._retrieve_and_pack(query, filter_mask)
             
             # 3. Generar respuesta
-            response = self._generate_response_simulation(query.question, relevant_docs, context)
+            stream = GenerationStream(self._generation_chunks(query, packed, intents), start_time)
+            stream.read()
             
-            # 4. Calcular confidence score
-            confidence = self._calculate_confidence_score(query.question, relevant_docs)
+            rag_response = self._build_response(query, intents, packed, stream, start_time)
+            self.result_cache.put(cache_key, rag_response)
+            return rag_response
             
-            processing_time = time.time() - start_time
+        except Exception as e:
+            return self._error_response(e, start_time)
+    
+    def query_rag_stream(self, query: RAGQuery, filter_mask: Optional[PrecomputedFilterMask] = None) -> GenerationStream:
+        """
+        Igual que query_rag, pero la respuesta se entrega en fragmentos a medida
+        que se genera (iterable con `for` o `async for`).
+        La recuperación y el contexto se resuelven antes de retornar; al agotar
+        el flujo, `stream.result` contiene el RAGResponse completo (con
+        time_to_first_token medido desde el inicio de la consulta).
+        Si la misma consulta ya está en vuelo, el flujo espera ese resultado y
+        lo entrega en un solo fragmento.
+        """
+        start_time = time.time()
+        
+        try:
+            validate_filters(query.context_filters, self.metadata_index.fields)
+        except ValueError as e:
+            response = self._error_response(e, start_time)
+            return GenerationStream(iter([response.answer]), start_time, lambda stream: response)
+        
+        cache_key = query_cache_key(query, self.index_version)
+        cached = self.result_cache.get(cache_key)
+        if cached is not None:
+            return GenerationStream(iter([cached.answer]), start_time,
+                                    lambda stream: self._cached_response(cached, start_time,
+                                                                         stream.time_to_first_token))
+        
+        call, leader = self.single_flight.begin(cache_key)
+        if not leader:
+            awaited = []
             
-            return RAGResponse(
-                answer=response,
-                retrieved_documents=relevant_docs,
-                confidence_score=confidence,
-                processing_time=processing_time,
-                metadata={
-                    "template_used": self.select_prompt_template(query.question),
-                    "context_length": len(context),
-                    "documents_retrieved": len(relevant_docs)
-                }
-            )
+            def shared_chunks() -> Iterator[str]:
+                awaited.append(self._await_shared(call, query, filter_mask, start_time, cache_key))
+                yield awaited[0][0].answer
             
+            def finalize_shared(stream: GenerationStream) -> RAGResponse:
+                response, shared = awaited[0]
+                if not shared:
+                    return replace(response, time_to_first_token=stream.time_to_first_token)
+                return self._coalesced_response(response, start_time, stream.time_to_first_token)
+            
+            return GenerationStream(shared_chunks(), start_time, finalize_shared)
+        
+        try:
+            intents, packed = self._retrieve_and_pack(query, filter_mask)
         except Exception as e:
-            self.logger.error(f"❌ Error en consulta RAG formal: {e}")
-            return RAGResponse(
-                answer=f"Error procesando la consulta: {str(e)}",
-                retrieved_documents=[],
-                confidence_score=0.0,
-                processing_time=time.time() - start_time,
-                metadata={"error": str(e)}
-            )
+            response = self._error_response(e, start_time)
+            self.single_flight.finish(cache_key, call, response)
+            return GenerationStream(iter([response.answer]), start_time, lambda stream: response)
+        
+        interrupted = RuntimeError("La consulta compartida se interrumpió")
+        
+        def leader_chunks() -> Iterator[str]:
+            completed = False
+            try:
+                yield from self._generation_chunks(query, packed, intents)
+                completed = True
+            except Exception as e:
+                self.single_flight.finish(cache_key, call, error=e)
+                raise
+            finally:
+                # Flujo abandonado (close/GeneratorExit): los seguidores ejecutan su propia consulta
+                if not completed:
+                    self.single_flight.finish(cache_key, call, error=interrupted)
+        
+        def finalize(stream: GenerationStream) -> RAGResponse:
+            try:
+                rag_response = self._build_response(query, intents, packed, stream, start_time)
+            except Exception as e:
+                self.single_flight.finish(cache_key, call, error=e)
+                raise
+            self.result_cache.put(cache_key, rag_response)
+            self.single_flight.finish(cache_key, call, rag_response)
+            return rag_response
+        
+        stream = GenerationStream(leader_chunks(), start_time, finalize)
+        # Flujo descartado sin iterarlo: el generador nunca arrancó y su `finally` no corre
+        weakref.finalize(stream, self.single_flight.finish, cache_key, call, None, interrupted)
+        return stream
+    
+    def _await_shared(self, call: InFlightCall, query: RAGQuery, filter_mask: Optional[PrecomputedFilterMask],
+                      start_time: float, cache_key: Tuple) -> Tuple[RAGResponse, bool]:
+        """
+        (respuesta, compartida): resultado de la ejecución en vuelo; si falla o
+        no termina a tiempo, consulta por cuenta propia (sin volver a unirse a
+        la coalescencia, así que se espera a lo sumo un timeout)
+        """
+        try:
+            return call.wait(self.rag_config["single_flight_timeout"]), True
+        except Exception as e:
+            self.logger.warning(f"⚠️ Consulta compartida no disponible ({e}); ejecutando de nuevo")
+            return self._run_query(query, filter_mask, start_time, cache_key), False
+    
+    def _coalesced_response(self, shared: RAGResponse, start_time: float,
+                            time_to_first_token: Optional[float]) -> RAGResponse:
+        return replace(shared, processing_time=time.time() - start_time, time_to_first_token=time_to_first_token,
+                       metadata={**shared.metadata, "coalesced": True})
+    
+    def _retrieve_and_pack(self, query: RAGQuery,
+                           filter_mask: Optional[PrecomputedFilterMask]) -> Tuple[FrozenSet[str], PackedContext]:
+        """Intenciones, recuperación (paso 1) y contexto empaquetado (paso 2)"""
+        intents = self.intent_matcher.match(query.question)
+        
+        # 1. Recuperar documentos relevantes
+        relevant_docs = self.retrieve_relevant_documents(
+            query.question,
+            top_k=query.max_retrieved_docs,
+            filters=query.context_filters,
+            filter_mask=filter_mask,
+            intents=intents
+        )
+        
+        # 2. Generar contexto (solo los documentos que caben en el presupuesto)
+        return intents, self.pack_context(query.question, relevant_docs)
+    
+    def _generation_chunks(self, query: RAGQuery, packed: PackedContext,
+                           intents: FrozenSet[str]) -> Iterator[str]:
+        """Fragmentos de la respuesta: Granite en streaming si hay cliente, si no la simulación"""
+        if self.generation_client is None:
+            return text_chunks(self._generate_response_simulation(query.question, packed.documents,
+                                                                  packed.text, intents))
+        
+        template_key = self.select_prompt_template(query.question, intents)
+        final_prompt = self.prompt_templates[template_key].format(query=query.question, context=packed.text)
+        return self.generation_client.stream(final_prompt, {
+            "temperature": query.temperature,
+            "max_new_tokens": query.max_tokens
+        })
+    
+    def _build_response(self, query: RAGQuery, intents: FrozenSet[str], packed: PackedContext,
+                        stream: GenerationStream, start_time: float) -> RAGResponse:
+        """4. Confidence score y respuesta final a partir del texto generado"""
+        relevant_docs = packed.documents
+        confidence = self._calculate_confidence_score(query.question, relevant_docs)
+        
+        return RAGResponse(
+            answer=stream.text,
+            retrieved_documents=relevant_docs,
+            confidence_score=confidence,
+            processing_time=time.time() - start_time,
+            time_to_first_token=stream.time_to_first_token,
+            metadata={
+                "template_used": self.select_prompt_template(query.question, intents),
+                "context_length": len(packed.text),
+                "context_tokens": packed.tokens,
+                "documents_retrieved": len(relevant_docs)
+            }
+        )
+    
+    def _cached_response(self, cached: RAGResponse, start_time: float,
+                         time_to_first_token: Optional[float]) -> RAGResponse:
+        return replace(cached, processing_time=time.time() - start_time,
+                       time_to_first_token=time_to_first_token,
+                       metadata={**cached.metadata, "cache_hit": True})
+    
+    def _error_response(self, error: Exception, start_time: float) -> RAGResponse:
+        self.logger.error(f"❌ Error en consulta RAG formal: {error}")
+        return RAGResponse(
+            answer=f"Error procesando la consulta: {str(error)}",
+            retrieved_documents=[],
+            confidence_score=0.0,
+            processing_time=time.time() - start_time,
+            metadata={"error": str(error)}
+        )
+    
+    def query_rag_batch(self, queries: List[RAGQuery], max_concurrency: Optional[int] = None) -> List[RAGResponse]:
+        """
+        Ejecuta varias consultas formales. Los filtros idénticos se evalúan una
+        sola vez sobre los bitmaps y la recuperación, el contexto y la
+        generación corren en paralelo con a lo sumo `max_concurrency` consultas
+        simultáneas. Las respuestas se retornan en el mismo orden que `queries`.
+        """
+        queries = list(queries)
+        if not queries:
+            return []
+        
+        filter_masks: Dict[str, Optional[PrecomputedFilterMask]] = {}
+        with self._index_lock:
+            for query in queries:
+                key = filters_key(query.context_filters)
+                if key not in filter_masks:
+                    try:
+                        filter_masks[key] = PrecomputedFilterMask(self.index_generation,
+                                                                  self._filter_mask(query.context_filters))
+                    except ValueError:
+                        # Filtro inválido: query_rag lo valida y reporta el error de esa consulta
+                        filter_masks[key] = None
+        
+        def run(query: RAGQuery) -> RAGResponse:
+            return self.query_rag(query, filter_mask=filter_masks[filters_key(query.context_filters)])
+        
+        max_workers = min(max_concurrency or self.rag_config["batch_max_concurrency"], len(queries))
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="rag_batch") as executor:
+            return list(executor.map(run, queries))
     
     def _calculate_confidence_score(self, query: str, documents: List[Dict]) -> float:
         """
@@ -413,7 +923,8 @@ Análisis:"""
         
         return min((avg_density * 10 + coverage_bonus) / 2, 1.0)
     
-    def _generate_response_simulation(self, query: str, docs: List[Dict], context: str) -> str:
+    def _generate_response_simulation(self, query: str, docs: List[Dict], context: str,
+                                      intents: Optional[FrozenSet[str]] = None) -> str:
         """
         Genera respuesta simulada basada en los documentos recuperados
         (En implementación real se usaría IBM Granite)
@@ -421,9 +932,11 @@ Análisis:"""
         response_parts = []
         
         # Análisis de la consulta
-        query_lower = query.lower()
+        if intents is None:
+            intents = self.intent_matcher.match(query)
+        signal = first_intent(intents, ("voltaje", "corriente", "temperatura"), None)
         
-        if any(keyword in query_lower for keyword in ['voltaje', 'voltage']):
+        if signal == 'voltaje':
             response_parts.append("📊 **Análisis de Voltaje en Sistema CAN:**")
             
             for doc in docs:
@@ -439,7 +952,7 @@ Análisis:"""
                     if voltage_matches:
                         response_parts.append(f"  Valores detectados: {', '.join(voltage_matches)} V")
         
-        elif any(keyword in query_lower for keyword in ['corriente', 'current']):
+        elif signal == 'corriente':
             response_parts.append("⚡ **Análisis de Corriente en Sistema CAN:**")
             
             for doc in docs:
@@ -453,7 +966,7 @@ Análisis:"""
                     if current_matches:
                         response_parts.append(f"  Valores: {', '.join(current_matches)} A")
         
-        elif any(keyword in query_lower for keyword in ['temperatura', 'temperature']):
+        elif signal == 'temperatura':
             response_parts.append("🌡️ **Análisis de Temperatura en Sistema CAN:**")
             
             for doc in docs:
@@ -495,37 +1008,24 @@ Análisis:"""
         """
         Obtiene estadísticas del sistema RAG
         """
+        store = self.documents
+        live = store.live_mask
+        
         stats = {
-            "total_documents": len(self.documents),
-            "document_types": {},
-            "redes_can": {},
+            "total_documents": store.live_count,
+            "document_types": store.value_counts('document_type'),
+            "redes_can": store.value_counts('red_can'),
             "average_technical_density": 0,
-            "total_words": 0
+            "total_words": int(store.numeric('word_count')[live].sum()),
+            "delta_documents": len(store.delta_documents),
+            "deleted_documents": len(store) - store.live_count,
+            "index_version": self.index_version,
+            "result_cache": self.result_cache.stats(),
+            "single_flight": self.single_flight.stats()
         }
         
-        total_density = 0
-        total_words = 0
-        
-        for doc in self.documents:
-            # Contar tipos de documento
-            doc_type = doc.get('document_type', 'unknown')
-            stats["document_types"][doc_type] = stats["document_types"].get(doc_type, 0) + 1
-            
-            # Contar redes CAN
-            red_can = doc.get('metadata', {}).get('red_can', 'unknown')
-            stats["redes_can"][red_can] = stats["redes_can"].get(red_can, 0) + 1
-            
-            # Densidad técnica promedio
-            density = doc.get('technical_density_score', 0)
-            total_density += density
-            
-            # Total de palabras
-            words = doc.get('word_count', 0)
-            total_words += words
-        
-        if self.documents:
-            stats["average_technical_density"] = total_density / len(self.documents)
-        stats["total_words"] = total_words
+        if store.live_count:
+            stats["average_technical_density"] = float(store.numeric('technical_density_score')[live].mean())
         
         return stats
 
@@ -574,6 +1074,8 @@ if __name__ == "__main__":
             result = rag_system.query_rag(query)
             
             print(f"✅ Respuesta generada en {result.processing_time:.2f}s")
+            if result.time_to_first_token is not None:
+                print(f"⚡ Primer token: {result.time_to_first_token:.2f}s")
             print(f"📊 Confianza: {result.confidence_score:.2f}")
             print(f"📄 Documentos utilizados: {len(result.retrieved_documents)}")
             print(f"📝 Respuesta: {result.answer[:200]}...")
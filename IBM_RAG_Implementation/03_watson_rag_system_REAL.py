@@ -4,13 +4,24 @@
 import os
 import json
 import time
+import asyncio
 import logging
-from typing import Dict, List, Any, Optional
+from typing import Callable, Dict, Iterator, List, Any, Optional, Tuple
 from dotenv import load_dotenv
 from ibm_watson_machine_learning import APIClient
 from ibm_watson import DiscoveryV2
 from ibm_cloud_sdk_core.authenticators import IAMAuthenticator
-from dataclasses import dataclass
+from dataclasses import dataclass, replace
+from pathlib import Path
+
+from embedding_cache import EmbeddingCache
+from result_cache import AsyncSingleFlight, SingleFlight, query_cache_key
+from query_intents import IntentMatcher, first_intent
+from streaming_generation import IAM_URL, GenerationStream, GraniteStreamClient
+from rate_limiting import shared_rate_limiter
+from discovery_resilience import CircuitBreaker, LocalFallbackIndex, ResilientCaller
+from async_watson_client import (AsyncConnectionPool, AsyncWatsonClient, StageTimeouts,
+                                 discovery_result_to_document)
 
 # Cargar variables de entorno
 load_dotenv()
@@ -36,6 +47,7 @@ class WatsonRAGResponse:
     confidence_score: float
     processing_time: float
     watson_metadata: Dict
+    time_to_first_token: Optional[float] = None
 
 class DecodeEVWatsonRAG:
     """
@@ -76,6 +88,57 @@ class DecodeEVWatsonRAG:
         self.wml_client = None
         self.discovery_client = None
         
+        # Caché persistente de embeddings (solo los textos nuevos llegan a Slate)
+        self.embedding_cache = EmbeddingCache(
+            os.getenv("EMBEDDING_CACHE_DIR", str(Path(__file__).parent / ".embedding_cache")),
+            self.models_config["embedding_model"]
+        )
+        
+        # Limitador compartido: token bucket + concurrencia adaptativa (AIMD) por endpoint
+        self.rate_limiter = shared_rate_limiter()
+        
+        # Cliente REST de streaming para Granite (SSE); no abre conexiones hasta usarse
+        self.generation_client = GraniteStreamClient(
+            self.watsonx_config["url"],
+            self.watsonx_config["apikey"],
+            self.watsonx_config["project_id"],
+            model_id=self.models_config["generation_model"],
+            iam_url=os.getenv("IBM_IAM_URL", IAM_URL)
+        )
+        
+        # Pipeline asíncrono: pool keep-alive compartido por Discovery, IAM y watsonx.ai
+        self.async_client = AsyncWatsonClient(
+            self.watsonx_config["url"],
+            self.watsonx_config["apikey"],
+            self.watsonx_config["project_id"],
+            self.discovery_config["url"],
+            self.discovery_config["apikey"],
+            discovery_version=self.discovery_config["version"],
+            iam_url=os.getenv("IBM_IAM_URL", IAM_URL),
+            pool=AsyncConnectionPool(max_connections_per_host=int(os.getenv("WATSON_MAX_CONNECTIONS", "100"))),
+            rate_limiter=self.rate_limiter
+        )
+        self.stage_timeouts = StageTimeouts()
+        
+        # Discovery con hedging tras el p95 y circuit breaker; respaldo en índice local
+        self.discovery_caller = ResilientCaller(
+            CircuitBreaker(
+                failure_threshold=int(os.getenv("DISCOVERY_BREAKER_FAILURES", "5")),
+                reset_timeout=float(os.getenv("DISCOVERY_BREAKER_RESET_SECONDS", "30"))
+            ),
+            timeout=self.stage_timeouts.discovery
+        )
+        self.local_index = LocalFallbackIndex(
+            embed_query=lambda text: (self.calculate_embeddings([text]) or [None])[0]
+        )
+        
+        # Consultas idénticas en vuelo comparten una sola búsqueda + generación
+        self.single_flight = SingleFlight()
+        self.async_single_flight = AsyncSingleFlight()
+        
+        # Matcher de intenciones compartido (vocabulario único en query_intents)
+        self.intent_matcher = IntentMatcher()
+        
         # Plantillas de prompt especializadas
         self.prompt_templates = {
             "diagnostico_vehicular": """Como experto en sistemas CAN vehiculares, analiza la siguiente consulta usando los documentos proporcionados.
@@ -134,7 +197,7 @@ Análisis:"""
             self.wml_client.set.default_project(self.watsonx_config["project_id"])
             
             # Verificar conexión WML
-            project_details = self.wml_client.projects.get_details()
+            project_details = self.rate_limiter.call("watsonx_admin", self.wml_client.projects.get_details)
             self.logger.info(f"✅ WML conectado a: {project_details['entity']['name']}")
             
             # Cliente Watson Discovery
@@ -146,9 +209,9 @@ Análisis:"""
             self.discovery_client.set_service_url(self.discovery_config["url"])
             
             # Verificar conexión Discovery
-            collections = self.discovery_client.list_collections(
+            collections = self.rate_limiter.call("discovery_admin", lambda: self.discovery_client.list_collections(
                 project_id=self.watsonx_config["project_id"]
-            ).get_result()
+            ).get_result())
             self.logger.info(f"✅ Discovery conectado. Colecciones: {len(collections['collections'])}")
             
             return True
@@ -172,21 +235,23 @@ Análisis:"""
                 'highlight': True
             }
             
-            # Ejecutar búsqueda
-            response = self.discovery_client.query(**search_params).get_result()
-            
-            # Procesar resultados
-            documents = []
-            for result in response.get('results', []):
-                doc = {
-                    'document_id': result.get('document_id'),
-                    'title': result.get('title', ''),
-                    'text': result.get('text', ''),
-                    'metadata': result.get('metadata', {}),
-                    'confidence': result.get('result_metadata', {}).get('confidence', 0),
-                    'highlights': result.get('highlight', {})
-                }
-                documents.append(doc)
+            def remote_search() -> List[Dict]:
+                response = self.rate_limiter.call(
+                    "discovery_query", lambda: self.discovery_client.query(**search_params).get_result()
+                )
+                return [discovery_result_to_document(result) for result in response.get('results', [])]
+            
+            # Ejecutar búsqueda (hedged); con Discovery caído responde el índice local
+            documents, source = self.discovery_caller.call(
+                remote_search, lambda: self.local_index.search(query, max_docs)
+            )
+            if source == "primary":
+                self.local_index.add_documents(documents)
+            else:
+                self.logger.warning(
+                    f"⚠️ Discovery no disponible (breaker {self.discovery_caller.breaker.state}): "
+                    f"usando índice local ({len(self.local_index)} documentos)"
+                )
             
             self.logger.info(f"✅ Encontrados {len(documents)} documentos relevantes")
             return documents
@@ -195,25 +260,33 @@ Análisis:"""
             self.logger.error(f"❌ Error en búsqueda Discovery: {e}")
             return []
     
+    def load_local_index(self, documents: List[Dict], embeddings: Optional[List[List[float]]] = None) -> int:
+        """Carga documentos (formato Discovery) en el índice local de respaldo"""
+        added = self.local_index.add_documents(documents, embeddings)
+        self.logger.info(f"📚 Índice local de respaldo: {len(self.local_index)} documentos")
+        return added
+    
+    def get_discovery_metrics(self) -> Dict[str, Any]:
+        """Estado del breaker, tasa de hedging y uso del índice local"""
+        return {**self.discovery_caller.stats(), 'local_index_documents': len(self.local_index)}
+    
     def generate_with_granite(self, prompt: str, temperature: float = 0.3, max_tokens: int = 512) -> str:
         """Genera respuesta usando IBM Granite"""
         try:
             self.logger.info("🤖 Generando respuesta con IBM Granite...")
             
-            generation_params = {
-                "model_id": self.models_config["generation_model"],
-                "input": prompt,
-                "parameters": {
-                    "temperature": temperature,
-                    "max_new_tokens": max_tokens,
-                    "top_p": 0.9,
-                    "top_k": 50,
-                    "repetition_penalty": 1.1
-                }
+            parameters = {
+                "temperature": temperature,
+                "max_new_tokens": max_tokens,
+                "top_p": 0.9,
+                "top_k": 50,
+                "repetition_penalty": 1.1
             }
             
-            response = self.wml_client.foundation_models.generate(**generation_params)
-            generated_text = response['results'][0]['generated_text']
+            # text/generation recibe un solo prompt por solicitud: se llama directo, bajo el limitador
+            generated_text = self.rate_limiter.call(
+                "generation", self.generation_client.generate, prompt, parameters
+            )
             
             self.logger.info("✅ Respuesta generada con Granite")
             return generated_text.strip()
@@ -222,33 +295,68 @@ Análisis:"""
             self.logger.error(f"❌ Error generación Granite: {e}")
             return f"Error generando respuesta: {str(e)}"
     
+    def generate_with_granite_stream(self, prompt: str, temperature: float = 0.3, max_tokens: int = 512,
+                                     started_at: Optional[float] = None,
+                                     finalize: Optional[Callable[[GenerationStream], Any]] = None) -> GenerationStream:
+        """
+        Genera respuesta con IBM Granite en streaming: el flujo entrega los
+        fragmentos a medida que el modelo los produce y mide el time-to-first-token
+        """
+        parameters = {
+            "temperature": temperature,
+            "max_new_tokens": max_tokens,
+            "top_p": 0.9,
+            "top_k": 50,
+            "repetition_penalty": 1.1
+        }
+        
+        def chunks() -> Iterator[str]:
+            try:
+                self.logger.info("🤖 Generando respuesta con IBM Granite (streaming)...")
+                with self.rate_limiter.slot("generation"):
+                    yield from self.generation_client.stream(prompt, parameters)
+                self.logger.info("✅ Respuesta generada con Granite")
+            except Exception as e:
+                self.logger.error(f"❌ Error generación Granite: {e}")
+                yield f"Error generando respuesta: {str(e)}"
+        
+        return GenerationStream(chunks(), started_at, finalize)
+    
     def calculate_embeddings(self, texts: List[str]) -> List[List[float]]:
         """Calcula embeddings usando IBM Slate"""
         try:
             self.logger.info(f"🧠 Calculando embeddings para {len(texts)} textos...")
             
-            embedding_params = {
-                "model_id": self.models_config["embedding_model"],
-                "input": texts
-            }
-            
-            response = self.wml_client.foundation_models.embed(**embedding_params)
-            embeddings = [result['embedding'] for result in response['results']]
+            misses_before = self.embedding_cache.misses
+            embeddings = self.embedding_cache.get_or_compute(texts, self._embed_with_slate)
             
-            self.logger.info(f"✅ Embeddings calculados (dim: {len(embeddings[0])})")
-            return embeddings
+            new_texts = self.embedding_cache.misses - misses_before
+            self.logger.info(f"✅ Embeddings calculados (dim: {embeddings.shape[1]}, "
+                             f"{len(texts) - new_texts} desde caché, {new_texts} con Slate)")
+            return embeddings.tolist()
             
         except Exception as e:
             self.logger.error(f"❌ Error cálculo embeddings: {e}")
             return []
     
+    def _embed_with_slate(self, texts: List[str]) -> List[List[float]]:
+        """Llamada a IBM Slate para los textos que no están en caché"""
+        embedding_params = {
+            "model_id": self.models_config["embedding_model"],
+            "input": texts
+        }
+        
+        response = self.rate_limiter.call(
+            "embeddings", lambda: self.wml_client.foundation_models.embed(**embedding_params)
+        )
+        return [result['embedding'] for result in response['results']]
+    
     def select_prompt_template(self, query: str) -> str:
         """Selecciona plantilla de prompt apropiada"""
-        query_lower = query.lower()
-        
-        if any(word in query_lower for word in ['diagnostico', 'problema', 'error', 'falla', 'anomalia']):
+        intent = first_intent(self.intent_matcher.match(query), ("diagnostico", "tendencias"), None)
+        if intent == "diagnostico":
             return "diagnostico_vehicular"
-        elif any(word in query_lower for word in ['tendencia', 'patron', 'analisis', 'evolucion', 'historico']):
+        elif intent == "tendencias":
             return "analisis_tendencias"
         else:
             return "explicacion_tecnica"
@@ -272,43 +380,102 @@ Análisis:"""
         
         return "\n\n".join(context_parts)
     
+    def _prepare_rag_prompt(self, query: WatsonRAGQuery) -> Tuple[List[Dict], str, str, str]:
+        """Pasos 1-4: documentos de Discovery, contexto, plantilla y prompt final"""
+        # 1. Buscar documentos relevantes en Discovery
+        documents = self.search_watson_discovery(
+            query.question, 
+            query.collection_id, 
+            query.max_docs
+        )
+        if not documents:
+            return documents, "", "", ""
+        
+        return (documents,) + self._build_prompt(query, documents)
+    
+    def _build_prompt(self, query: WatsonRAGQuery, documents: List[Dict]) -> Tuple[str, str, str]:
+        """Pasos 2-4: (contexto, plantilla, prompt final)"""
+        # 2. Construir contexto
+        context = self.build_context(documents)
+        
+        # 3. Seleccionar plantilla de prompt
+        template_key = self.select_prompt_template(query.question)
+        prompt_template = self.prompt_templates[template_key]
+        
+        # 4. Generar prompt final
+        final_prompt = prompt_template.format(
+            query=query.question,
+            context=context
+        )
+        return context, template_key, final_prompt
+    
+    def _build_rag_response(self, answer: str, documents: List[Dict], context: str, template_key: str,
+                            start_time: float, time_to_first_token: Optional[float]) -> WatsonRAGResponse:
+        """Paso 6: confidence score y respuesta final"""
+        avg_confidence = sum(doc.get('confidence', 0) for doc in documents) / len(documents)
+        
+        return WatsonRAGResponse(
+            answer=answer,
+            source_documents=documents,
+            confidence_score=avg_confidence,
+            processing_time=time.time() - start_time,
+            time_to_first_token=time_to_first_token,
+            watson_metadata={
+                'template_used': template_key,
+                'context_length': len(context),
+                'model_used': self.models_config["generation_model"],
+                'discovery_breaker': self.discovery_caller.breaker.state
+            }
+        )
+    
+    def _no_documents_response(self, start_time: float) -> WatsonRAGResponse:
+        return WatsonRAGResponse(
+            answer="No se encontraron documentos relevantes para tu consulta.",
+            source_documents=[],
+            confidence_score=0.0,
+            processing_time=time.time() - start_time,
+            watson_metadata={'error': 'no_documents_found'}
+        )
+    
+    def _error_response(self, error: Exception, start_time: float) -> WatsonRAGResponse:
+        self.logger.error(f"❌ Error en consulta RAG: {error}")
+        return WatsonRAGResponse(
+            answer=f"Error procesando consulta: {str(error)}",
+            source_documents=[],
+            confidence_score=0.0,
+            processing_time=time.time() - start_time,
+            watson_metadata={'error': str(error)}
+        )
+    
+    def _coalesced_response(self, shared: WatsonRAGResponse, start_time: float) -> WatsonRAGResponse:
+        """Copia del resultado compartido con los tiempos de esta consulta"""
+        elapsed = time.time() - start_time
+        return replace(shared, processing_time=elapsed, time_to_first_token=elapsed,
+                       watson_metadata={**shared.watson_metadata, 'coalesced': True})
+    
     def query_watson_rag(self, query: WatsonRAGQuery) -> WatsonRAGResponse:
-        """Ejecuta consulta RAG completa con Watson"""
+        """
+        Ejecuta consulta RAG completa con Watson.
+        Consultas idénticas concurrentes esperan a la que ya está en vuelo y
+        reciben su resultado (una sola llamada a Discovery y a Granite).
+        """
+        start_time = time.time()
+        
+        key = query_cache_key(query, self.models_config["generation_model"])
+        response, shared = self.single_flight.do(key, lambda: self._run_watson_query(query))
+        return self._coalesced_response(response, start_time) if shared else response
+    
+    def _run_watson_query(self, query: WatsonRAGQuery) -> WatsonRAGResponse:
         start_time = time.time()
         
         try:
             self.logger.info(f"🚀 Procesando consulta RAG: {query.question[:50]}...")
             
-            # 1. Buscar documentos relevantes en Discovery
-            documents = self.search_watson_discovery(
-                query.question, 
-                query.collection_id, 
-                query.max_docs
-            )
-            
+            documents, context, template_key, final_prompt = self._prepare_rag_prompt(query)
             if not documents:
-                return WatsonRAGResponse(
-                    answer="No se encontraron documentos relevantes para tu consulta.",
-                    source_documents=[],
-                    confidence_score=0.0,
-                    processing_time=time.time() - start_time,
-                    watson_metadata={'error': 'no_documents_found'}
-                )
+                return self._no_documents_response(start_time)
             
-            # 2. Construir contexto
-            context = self.build_context(documents)
-            
-            # 3. Seleccionar plantilla de prompt
-            template_key = self.select_prompt_template(query.question)
-            prompt_template = self.prompt_templates[template_key]
-            
-            # 4. Generar prompt final
-            final_prompt = prompt_template.format(
-                query=query.question,
-                context=context
-            )
-            
-            # 5. Generar respuesta con Granite
+            # 5. Generar respuesta con Granite (sin streaming, el primer token llega con la respuesta completa)
             answer = self.generate_with_granite(
                 final_prompt, 
                 query.temperature, 
@@ -316,38 +483,131 @@ Análisis:"""
             )
             
             # 6. Calcular confidence score
-            avg_confidence = sum(doc.get('confidence', 0) for doc in documents) / len(documents)
+            return self._build_rag_response(answer, documents, context, template_key,
+                                            start_time, time.time() - start_time)
             
-            processing_time = time.time() - start_time
+        except Exception as e:
+            return self._error_response(e, start_time)
+    
+    def query_watson_rag_stream(self, query: WatsonRAGQuery) -> GenerationStream:
+        """
+        Ejecuta la consulta RAG entregando la respuesta de Granite en fragmentos.
+        La recuperación ocurre antes de retornar; al agotar el flujo,
+        `stream.result` contiene el WatsonRAGResponse completo con
+        time_to_first_token y processing_time medidos desde el inicio de la consulta.
+        """
+        start_time = time.time()
+        
+        try:
+            self.logger.info(f"🚀 Procesando consulta RAG (streaming): {query.question[:50]}...")
+            documents, context, template_key, final_prompt = self._prepare_rag_prompt(query)
+        except Exception as e:
+            response = self._error_response(e, start_time)
+            return GenerationStream(iter([response.answer]), start_time, lambda stream: response)
+        
+        if not documents:
+            response = self._no_documents_response(start_time)
+            return GenerationStream(iter([response.answer]), start_time, lambda stream: response)
+        
+        # 5-6. Granite en streaming; la respuesta final se arma al agotar el flujo
+        return self.generate_with_granite_stream(
+            final_prompt, query.temperature, query.max_tokens, started_at=start_time,
+            finalize=lambda stream: self._build_rag_response(stream.text.strip(), documents, context,
+                                                             template_key, start_time, stream.time_to_first_token)
+        )
+    
+    async def query_watson_rag_async(self, query: WatsonRAGQuery,
+                                     timeouts: Optional[StageTimeouts] = None) -> WatsonRAGResponse:
+        """
+        Variante asíncrona de query_watson_rag: Discovery y Granite (streaming)
+        se llaman sobre el pool keep-alive compartido sin bloquear un hilo, así
+        que un proceso atiende cientos de consultas en vuelo.
+        
+        Cada etapa tiene su propio límite (`timeouts`, por defecto
+        self.stage_timeouts); si se excede, la respuesta reporta la etapa en
+        watson_metadata. Cancelar la tarea cancela la solicitud HTTP en curso
+        y su conexión se descarta del pool.
+        
+        Consultas idénticas concurrentes (mismos parámetros y límites) comparten
+        una sola ejecución; cancelar una no afecta a las demás.
+        """
+        timeouts = timeouts or self.stage_timeouts
+        start_time = time.time()
+        
+        key = query_cache_key(query, self.models_config["generation_model"]) + (("timeouts", timeouts),)
+        response, shared = await self.async_single_flight.do(
+            key, lambda: self._run_watson_query_async(query, timeouts)
+        )
+        return self._coalesced_response(response, start_time) if shared else response
+    
+    async def _run_watson_query_async(self, query: WatsonRAGQuery, timeouts: StageTimeouts) -> WatsonRAGResponse:
+        start_time = time.time()
+        deadline = None if timeouts.total is None else time.monotonic() + timeouts.total
+        stage = "discovery"
+        
+        def stage_limit(limit: Optional[float]) -> Optional[float]:
+            """Límite de la etapa acotado por lo que queda del límite total"""
+            if deadline is None:
+                return limit
+            remaining = max(0.0, deadline - time.monotonic())
+            return remaining if limit is None else min(limit, remaining)
+        
+        async def generate(prompt: str, parameters: Dict[str, Any]) -> Tuple[str, Optional[float]]:
+            parts, time_to_first_token = [], None
+            async for chunk in self.async_client.generate_stream(
+                    prompt, self.models_config["generation_model"], parameters):
+                if time_to_first_token is None:
+                    time_to_first_token = time.time() - start_time
+                parts.append(chunk)
+            return "".join(parts), time_to_first_token
+        
+        try:
+            # 1. Buscar documentos relevantes en Discovery
+            documents = await asyncio.wait_for(
+                self.async_client.search_discovery(query.question, query.collection_id, query.max_docs),
+                stage_limit(timeouts.discovery)
+            )
+            if not documents:
+                return self._no_documents_response(start_time)
             
-            return WatsonRAGResponse(
-                answer=answer,
-                source_documents=documents,
-                confidence_score=avg_confidence,
-                processing_time=processing_time,
-                watson_metadata={
-                    'template_used': template_key,
-                    'context_length': len(context),
-                    'model_used': self.models_config["generation_model"]
-                }
+            # 2-4. Contexto, plantilla y prompt
+            context, template_key, final_prompt = self._build_prompt(query, documents)
+            
+            # 5. Granite en streaming (registra el primer token)
+            stage = "generation"
+            answer, time_to_first_token = await asyncio.wait_for(
+                generate(final_prompt, {"temperature": query.temperature, "max_new_tokens": query.max_tokens,
+                                        "top_p": 0.9, "top_k": 50, "repetition_penalty": 1.1}),
+                stage_limit(timeouts.generation)
             )
             
-        except Exception as e:
-            self.logger.error(f"❌ Error en consulta RAG: {e}")
+            # 6. Calcular confidence score
+            return self._build_rag_response(answer.strip(), documents, context, template_key,
+                                            start_time, time_to_first_token)
+            
+        except asyncio.TimeoutError:
+            self.logger.warning(f"⏱️ Timeout en etapa '{stage}' tras {time.time() - start_time:.2f}s")
             return WatsonRAGResponse(
-                answer=f"Error procesando consulta: {str(e)}",
+                answer=f"La consulta excedió el tiempo límite en la etapa {stage}.",
                 source_documents=[],
                 confidence_score=0.0,
                 processing_time=time.time() - start_time,
-                watson_metadata={'error': str(e)}
+                watson_metadata={'error': 'timeout', 'stage': stage}
             )
+        except Exception as e:
+            return self._error_response(e, start_time)
+    
+    async def query_watson_rag_many(self, queries: List[WatsonRAGQuery],
+                                    timeouts: Optional[StageTimeouts] = None) -> List[WatsonRAGResponse]:
+        """Ejecuta varias consultas concurrentes en el mismo event loop (mismo orden que `queries`)"""
+        return list(await asyncio.gather(*(self.query_watson_rag_async(query, timeouts) for query in queries)))
     
     def get_available_collections(self) -> List[Dict]:
         """Obtiene colecciones disponibles en Discovery"""
         try:
-            response = self.discovery_client.list_collections(
+            response = self.rate_limiter.call("discovery_admin", lambda: self.discovery_client.list_collections(
                 project_id=self.watsonx_config["project_id"]
-            ).get_result()
+            ).get_result())
             
             return response.get('collections', [])
             
@@ -400,11 +660,17 @@ if __name__ == "__main__":
                     response = rag_system.query_watson_rag(query)
                     
                     print(f"✅ Procesado en {response.processing_time:.2f}s")
+                    if response.time_to_first_token is not None:
+                        print(f"⚡ Primer token: {response.time_to_first_token:.2f}s")
                     print(f"📊 Confianza: {response.confidence_score:.2f}")
                     print(f"📄 Documentos: {len(response.source_documents)}")
                     print(f"🤖 Modelo: {response.watson_metadata.get('model_used', 'N/A')}")
                     print(f"📝 Respuesta: {response.answer[:200]}...")
                     
+                metrics = rag_system.get_discovery_metrics()
+                print(f"\n🛡️ Discovery: breaker {metrics['breaker']['state']}, "
+                      f"hedging {metrics['hedge_rate']:.1%}, respaldos locales {metrics['fallbacks']}")
+                
                 print("\n🎯 Sistema RAG Watson completamente funcional!")
             else:
                 print("⚠️ No hay colecciones disponibles. Ejecuta 01_watsonx_setup_REAL.py primero.")
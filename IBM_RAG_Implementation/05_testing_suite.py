@@ -3,11 +3,54 @@
 
 import unittest
 import json
+import os
+import sys
+import tempfile
 import time
+import importlib.util
+from contextlib import redirect_stdout
+from io import StringIO
 from datetime import datetime
 from typing import Dict, List, Any
 from unittest.mock import Mock, patch, MagicMock
 
+import numpy as np
+
+from lexical_index import BM25Index, tokenize
+from vector_index import DenseVectorIndex, IVFIndex, evaluate_recall_at_k
+from quantized_index import QuantizedVectorIndex, StackedRows
+from hybrid_retrieval import HybridRetriever
+from metadata_filters import BitmapIndex
+from document_store import ColumnarDocumentStore, DocumentView
+from binary_corpus import compile_corpus, open_corpus, is_corpus_current, load_or_compile
+from index_snapshots import IndexSnapshotStore, dataset_fingerprint, instance_attributes, schema_fingerprint
+from result_cache import (QueryResultCache, SemanticAnswerCache, query_cache_key, normalize_question,
+                          SingleFlight, AsyncSingleFlight)
+from embedding_cache import EmbeddingCache
+from hashing_embeddings import HashingEmbedder
+from reranker import FeatureReranker, detect_metadata_mentions
+from context_packer import ContextPacker, estimate_tokens, truncate_to_tokens
+from query_intents import IntentMatcher, first_intent
+from query_preprocessing import QueryPreprocessor
+from streaming_generation import GenerationStream, GraniteStreamClient, text_chunks
+from fake_watson_server import FakeWatsonServer
+from async_watson_client import AsyncConnectionPool, AsyncWatsonClient
+from rate_limiting import ClientRateLimiter, EndpointLimits, RateLimitedError
+from discovery_resilience import CircuitBreaker, LatencyTracker, LocalFallbackIndex, ResilientCaller
+from incremental_index import SegmentedDocumentStore, SegmentedBitmapIndex, BackgroundMerger, compaction_map
+
+def load_pipeline_module(filename: str):
+    """Importa un módulo del pipeline cuyo archivo empieza con dígitos (p. ej. 03_core_rag_system.py)"""
+    name = "decode_ev_" + os.path.splitext(filename)[0].lstrip("0123456789_")
+    if name not in sys.modules:
+        spec = importlib.util.spec_from_file_location(name, os.path.join(os.path.dirname(os.path.abspath(__file__)), filename))
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[name] = module
+        with redirect_stdout(StringIO()):
+            spec.loader.exec_module(module)
+    return sys.modules[name]
+
+
 class TestDecodeEVRAGSystem(unittest.TestCase):
     """
     Tests para el sistema RAG DECODE-EV
@@ -324,6 +367,1663 @@ class TestDatasetIntegration(unittest.TestCase):
         
         return watsonx_docs
 
+class TestLexicalIndex(unittest.TestCase):
+    """
+    Tests para el índice invertido BM25
+    """
+    
+    def setUp(self):
+        """Configuración inicial"""
+        self.texts = [
+            "Evento en red CAN_CUSTOM_31: voltaje_carga_v estable en 36.00 v",
+            "Evento en red CAN_CUSTOM_31: corriente_carga_a redujo su valor",
+            "Documentación técnica del protocolo J1939 para tensión y corriente",
+            "Temperatura del cargador estable alrededor de 34.78 °C"
+        ]
+        self.index = BM25Index()
+        self.index.build(self.texts)
+    
+    def test_tokenize_folds_accents_and_splits_signals(self):
+        """Test analizador léxico"""
+        self.assertEqual(tokenize("Tensión voltaje_carga_v"), ["tension", "voltaje", "carga", "v"])
+    
+    def test_search_ranks_matching_documents(self):
+        """Test ranking BM25"""
+        results = self.index.search("corriente de carga", top_k=2)
+        
+        self.assertEqual(len(results), 2)
+        self.assertEqual(results[0][0], 1)
+        self.assertGreater(results[0][1], results[1][1])
+    
+    def test_search_only_scores_query_postings(self):
+        """Test que documentos sin términos de la consulta no aparecen"""
+        doc_ids = [doc_id for doc_id, _ in self.index.search("temperatura", top_k=10)]
+        self.assertEqual(doc_ids, [3])
+        self.assertEqual(self.index.search("inexistente", top_k=10), [])
+    
+    def test_search_respects_mask(self):
+        """Test restricción por máscara de candidatos"""
+        mask = [False, False, True, False]
+        doc_ids = [doc_id for doc_id, _ in self.index.search("corriente", top_k=10, mask=mask)]
+        self.assertEqual(doc_ids, [2])
+
+class TestVectorIndex(unittest.TestCase):
+    """
+    Tests para el índice vectorial denso
+    """
+    
+    def setUp(self):
+        """Configuración inicial"""
+        rng = np.random.default_rng(7)
+        self.embeddings = rng.normal(size=(200, 32)).astype(np.float32)
+        self.index = DenseVectorIndex(dimension=32)
+        self.index.build(self.embeddings)
+    
+    def test_rows_are_normalized_float32(self):
+        """Test matriz contigua float32 normalizada"""
+        self.assertEqual(self.index.matrix.dtype, np.float32)
+        self.assertTrue(self.index.matrix.flags['C_CONTIGUOUS'])
+        np.testing.assert_allclose(np.linalg.norm(self.index.matrix, axis=1), 1.0, rtol=1e-5)
+    
+    def test_search_matches_exhaustive_cosine(self):
+        """Test top-k idéntico a búsqueda exhaustiva"""
+        query = self.embeddings[10] + 0.01
+        ids, scores = self.index.search(query, top_k=5)
+        
+        normalized = self.embeddings / np.linalg.norm(self.embeddings, axis=1, keepdims=True)
+        expected = np.argsort(-(normalized @ (query / np.linalg.norm(query))))[:5]
+        
+        self.assertEqual(ids.tolist(), expected.tolist())
+        self.assertEqual(ids[0], 10)
+        self.assertTrue(np.all(np.diff(scores) <= 0))
+    
+    def test_search_restricted_to_candidates(self):
+        """Test búsqueda sobre subconjunto de filas"""
+        candidates = np.array([3, 50, 120])
+        ids, _ = self.index.search(self.embeddings[50], top_k=10, candidate_ids=candidates)
+        
+        self.assertEqual(len(ids), 3)
+        self.assertEqual(ids[0], 50)
+        self.assertTrue(set(ids.tolist()) <= set(candidates.tolist()))
+
+class TestIVFIndex(unittest.TestCase):
+    """
+    Tests para el índice aproximado IVF_FLAT
+    """
+    
+    def setUp(self):
+        """Configuración inicial con datos agrupados"""
+        rng = np.random.default_rng(3)
+        centers = rng.normal(size=(20, 32)).astype(np.float32)
+        self.embeddings = centers[rng.integers(0, 20, 2000)] + 0.3 * rng.normal(size=(2000, 32)).astype(np.float32)
+        self.queries = self.embeddings[:50] + 0.05
+        
+        self.exact = DenseVectorIndex(dimension=32)
+        self.exact.build(self.embeddings)
+        self.ivf = IVFIndex(dimension=32, nlist=20, nprobe=4)
+        self.ivf.build(self.embeddings)
+    
+    def test_inverted_lists_cover_corpus(self):
+        """Test que cada vector queda en exactamente una lista"""
+        self.assertEqual(len(self.ivf), 2000)
+        self.assertEqual(self.ivf.offsets[-1], 2000)
+        self.assertEqual(sorted(self.ivf.ids.tolist()), list(range(2000)))
+    
+    def test_recall_against_exact_search(self):
+        """Test recall@k frente a búsqueda exacta"""
+        result = evaluate_recall_at_k(self.ivf, self.exact, self.queries, top_k=10)
+        self.assertGreaterEqual(result["recall@10"], 0.9)
+        
+        full_probe = evaluate_recall_at_k(self.ivf, self.exact, self.queries, top_k=10, nprobe=20)
+        self.assertAlmostEqual(full_probe["recall@10"], 1.0)
+    
+    def test_add_assigns_new_vectors(self):
+        """Test inserción incremental"""
+        new_vector = self.embeddings[5:6] * 2
+        self.ivf.add(new_vector, np.array([2000]))
+        
+        ids, _ = self.ivf.search(new_vector[0], top_k=2)
+        self.assertIn(2000, ids.tolist())
+
+class TestQuantizedIndex(unittest.TestCase):
+    """
+    Tests para el almacenamiento cuantizado (int8 / PQ) con re-scoring exacto
+    """
+    
+    def setUp(self):
+        """Configuración inicial con datos agrupados"""
+        rng = np.random.default_rng(5)
+        centers = rng.normal(size=(20, 32)).astype(np.float32)
+        self.embeddings = centers[rng.integers(0, 20, 2000)] + 0.3 * rng.normal(size=(2000, 32)).astype(np.float32)
+        self.queries = self.embeddings[:50] + 0.05
+        
+        self.exact = DenseVectorIndex(dimension=32)
+        self.exact.build(self.embeddings)
+        self.exact_ids, self.exact_scores = self.exact.search_batch(self.queries, top_k=10)
+    
+    def _recall(self, ids: np.ndarray) -> float:
+        return float(np.mean([len(set(a) & set(b)) / 10 for a, b in zip(ids.tolist(), self.exact_ids.tolist())]))
+    
+    def test_int8_rescoring_matches_exact_search(self):
+        """Test recall y scores exactos con int8 (4x menos memoria)"""
+        index = QuantizedVectorIndex(dimension=32, method="int8", block_size=512)
+        index.build(self.embeddings)
+        ids, scores = index.search_batch(self.queries, top_k=10)
+        
+        self.assertEqual(index.codes.dtype, np.int8)
+        self.assertEqual(self._recall(ids), 1.0)
+        np.testing.assert_allclose(scores, self.exact_scores, atol=1e-5)
+    
+    def test_product_quantizer_recall(self):
+        """Test PQ con tablas ADC (consulta individual) y lote"""
+        index = QuantizedVectorIndex(dimension=32, method="pq", n_subvectors=8)
+        index.build(self.embeddings)
+        
+        ids, _ = index.search_batch(self.queries, top_k=10)
+        single_ids, _ = index.search(self.queries[0], top_k=10)
+        
+        self.assertEqual(index.codes.shape, (2000, 8))
+        self.assertGreaterEqual(self._recall(ids), 0.9)
+        np.testing.assert_array_equal(single_ids, ids[0])
+    
+    def test_candidate_ids_restrict_search(self):
+        """Test pre-filtrado con candidate_ids"""
+        index = QuantizedVectorIndex(dimension=32, method="int8")
+        index.build(self.embeddings)
+        candidates = np.arange(0, 2000, 3)
+        
+        ids, _ = index.search_batch(self.queries[:5], top_k=5, candidate_ids=candidates)
+        expected, _ = self.exact.search_batch(self.queries[:5], top_k=5, candidate_ids=candidates)
+        np.testing.assert_array_equal(ids, expected)
+    
+    def test_rescore_vectors_memory_mapped(self):
+        """Test vectores float32 en disco, pickling (snapshots) y liberación del archivo"""
+        import pickle
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            index = QuantizedVectorIndex(dimension=32, method="int8", rescore_dir=tmp_dir)
+            index.build(self.embeddings)
+            self.assertIsInstance(index.matrix, np.memmap)
+            self.assertEqual(index.memory_usage(), index.codes.nbytes)
+            
+            restored = pickle.loads(pickle.dumps(index))
+            np.testing.assert_array_equal(restored.search_batch(self.queries, 10)[0],
+                                          index.search_batch(self.queries, 10)[0])
+            
+            index.release()
+            restored.release()
+            self.assertEqual(os.listdir(tmp_dir), [])
+    
+    def test_rescore_vectors_default_to_temp_file(self):
+        """Test que sin rescore_dir los vectores float32 tampoco quedan en RAM"""
+        index = QuantizedVectorIndex(dimension=32, method="int8", block_size=512)
+        index.build(self.embeddings)
+        index.add(self.embeddings[:10])
+        
+        self.assertIsInstance(index.matrix, np.memmap)
+        self.assertEqual(index.matrix.shape, (2010, 32))
+        self.assertEqual(index.memory_usage(), index.codes.nbytes)
+        
+        temp_dir = index.vectors_path.parent
+        index.release()
+        self.assertFalse(temp_dir.exists())
+    
+    def test_build_from_stacked_rows(self):
+        """Test reconstrucción por bloques desde base mapeada + delta sin apilarlos"""
+        base = QuantizedVectorIndex(dimension=32, method="int8", block_size=256)
+        base.build(self.embeddings[:1500])
+        delta = DenseVectorIndex(dimension=32)
+        delta.build(self.embeddings[1500:])
+        positions = np.arange(0, 2000, 2)
+        
+        rebuilt = QuantizedVectorIndex(dimension=32, method="int8", block_size=256)
+        rebuilt.build(StackedRows([base.matrix, delta.matrix], positions))
+        reference = QuantizedVectorIndex(dimension=32, method="int8", block_size=256)
+        reference.build(np.vstack([base.matrix, delta.matrix])[positions])
+        
+        np.testing.assert_allclose(rebuilt.matrix, reference.matrix, atol=1e-6)
+        np.testing.assert_array_equal(rebuilt.codes, reference.codes)
+        for index in (base, rebuilt, reference):
+            index.release()
+
+class TestHybridRetrieval(unittest.TestCase):
+    """
+    Tests para la fusión léxica + semántica
+    """
+    
+    def setUp(self):
+        """Configuración inicial con búsquedas simuladas"""
+        self.lexical_hits = [(4, 9.0), (1, 5.0), (7, 1.0)]
+        self.dense_hits = (np.array([1, 2, 4]), np.array([0.9, 0.8, 0.3], dtype=np.float32))
+        
+        self.lexical_search = Mock(return_value=self.lexical_hits)
+        self.dense_search = Mock(return_value=self.dense_hits)
+    
+    def test_weighted_fusion_over_union(self):
+        """Test fusión ponderada con normalización min-max"""
+        retriever = HybridRetriever(self.lexical_search, self.dense_search, max_results=10)
+        results = dict(retriever.search("corriente", [0.1] * 4))
+        
+        self.assertEqual(set(results), {1, 2, 4, 7})
+        self.assertAlmostEqual(results[1], 0.7 + 0.3 * 0.5, places=5)
+        self.assertAlmostEqual(results[4], 0.3, places=5)
+        self.assertEqual(max(results, key=results.get), 1)
+    
+    def test_min_score_and_max_results_cutoff(self):
+        """Test corte por min_score y max_results"""
+        retriever = HybridRetriever(self.lexical_search, self.dense_search, min_score=0.5, max_results=2)
+        results = retriever.search("corriente", [0.1] * 4, top_k=5)
+        
+        self.assertEqual([doc_id for doc_id, _ in results], [1, 2])
+        self.lexical_search.assert_called_once_with("corriente", 6, None)
+    
+    def test_reciprocal_rank_fusion(self):
+        """Test fusión RRF"""
+        retriever = HybridRetriever(self.lexical_search, self.dense_search, fusion="rrf", rrf_k=60)
+        results = dict(retriever.search("corriente", [0.1] * 4))
+        
+        self.assertAlmostEqual(results[1], 0.3 / 62 + 0.7 / 61, places=6)
+        self.assertAlmostEqual(results[7], 0.3 / 63, places=6)
+    
+    def test_batch_search_matches_single_queries(self):
+        """Test que la búsqueda por lotes usa una sola llamada densa y fusiona igual"""
+        dense_search_batch = Mock(return_value=(
+            np.array([[1, 2, 4], [2, 4, -1]]),
+            np.array([[0.9, 0.8, 0.3], [0.6, 0.2, -np.inf]], dtype=np.float32)
+        ))
+        retriever = HybridRetriever(self.lexical_search, self.dense_search, dense_search_batch=dense_search_batch)
+        
+        results = retriever.search_batch(["corriente", "voltaje"], np.full((2, 4), 0.1), top_k=5)
+        
+        dense_search_batch.assert_called_once()
+        self.assertEqual(results[0], retriever.search("corriente", [0.1] * 4, top_k=5))
+        self.assertEqual({doc_id for doc_id, _ in results[1]}, {1, 2, 4, 7})
+
+class TestMetadataFilters(unittest.TestCase):
+    """
+    Tests para los índices bitmap de metadatos
+    """
+    
+    def setUp(self):
+        """Configuración inicial"""
+        self.documents = [
+            {"document_type": "evento_can", "metadata": {"red_can": "CAN_CUSTOM_31", "evento_vehiculo": "carga"}},
+            {"document_type": "evento_can", "metadata": {"red_can": "CAN_EV", "evento_vehiculo": "carga"}},
+            {"document_type": "evento_can", "metadata": {"red_can": "CAN_EV", "evento_vehiculo": "frenado"}},
+            {"document_type": "documentacion_tecnica", "metadata": {}}
+        ] * 3
+        self.index = BitmapIndex()
+        self.index.build(self.documents)
+    
+    def _ids(self, filters):
+        return np.flatnonzero(self.index.filter_mask(filters)).tolist()
+    
+    def test_equality_and_membership(self):
+        """Test igualdad, pertenencia y AND implícito"""
+        self.assertEqual(self._ids({"red_can": "CAN_CUSTOM_31"}), [0, 4, 8])
+        self.assertEqual(self._ids({"evento_vehiculo": ["frenado", "otro"]}), [2, 6, 10])
+        self.assertEqual(self._ids({"red_can": "CAN_EV", "evento_vehiculo": "carga"}), [1, 5, 9])
+    
+    def test_boolean_operators(self):
+        """Test $or y $not"""
+        self.assertEqual(
+            self._ids({"$or": [{"red_can": "CAN_CUSTOM_31"}, {"document_type": "documentacion_tecnica"}]}),
+            [0, 3, 4, 7, 8, 11]
+        )
+        self.assertEqual(self._ids({"$not": {"document_type": "evento_can"}}), [3, 7, 11])
+    
+    def test_empty_and_unknown_filters(self):
+        """Test sin filtros, valores inexistentes y campos no indexados"""
+        self.assertIsNone(self.index.filter_mask({}))
+        self.assertEqual(self._ids({"red_can": "CAN_CATL"}), [])
+        with self.assertRaises(ValueError):
+            self.index.filter_mask({"campo_inexistente": 1})
+
+class TestDocumentStore(unittest.TestCase):
+    """
+    Tests para el almacén columnar de documentos
+    """
+    
+    def setUp(self):
+        """Configuración inicial"""
+        self.documents = [
+            {
+                "id": "CAN_CUSTOM_31_evento_0",
+                "text": "Evento en red CAN_CUSTOM_31: tensión de 36.00 v",
+                "document_type": "evento_can",
+                "technical_density_score": 0.03,
+                "word_count": 95,
+                "metadata": {"red_can": "CAN_CUSTOM_31", "density_voltaje": 0.5, "meta_hora_dia": 0}
+            },
+            {
+                "id": "j1939_chunk_0",
+                "text": "Documentación técnica J1939",
+                "document_type": "documentacion_tecnica",
+                "technical_density_score": 0,
+                "word_count": 3,
+                "metadata": {"source": "j1939"}
+            }
+        ]
+        self.store = ColumnarDocumentStore.from_documents(self.documents)
+    
+    def test_views_match_original_documents(self):
+        """Test que las vistas reproducen los dicts originales"""
+        self.assertEqual(len(self.store), 2)
+        for view, original in zip(self.store, self.documents):
+            self.assertIsInstance(view, DocumentView)
+            self.assertEqual(view.to_dict(), original)
+            self.assertEqual(view.get('text'), original['text'])
+    
+    def test_missing_fields_use_defaults(self):
+        """Test campos ausentes en algunos documentos"""
+        doc = self.store[1]
+        self.assertEqual(doc.get('metadata', {}).get('red_can', 'N/A'), 'N/A')
+        self.assertNotIn('red_can', doc['metadata'])
+        np.testing.assert_array_equal(self.store.numeric('density_voltaje'), [0.5, 0.0])
+    
+    def test_columns_are_typed(self):
+        """Test tipos de columna y conteos categóricos"""
+        self.assertEqual(self.store.column('word_count').kind, "int")
+        self.assertEqual(self.store.column('technical_density_score').kind, "float")
+        self.assertEqual(self.store.column('red_can').kind, "category")
+        self.assertEqual(self.store.value_counts('red_can'), {"CAN_CUSTOM_31": 1, "unknown": 1})
+
+class TestBinaryCorpus(unittest.TestCase):
+    """
+    Tests para el corpus binario mapeado en memoria
+    """
+    
+    def setUp(self):
+        """Configuración inicial con un JSONL temporal"""
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.dataset_path = os.path.join(self.tmp_dir.name, "dataset.jsonl")
+        self.documents = [
+            {"id": f"evento_{i}", "text": f"Evento {i}: tensión {30 + i} v", "document_type": "evento_can",
+             "word_count": 4, "metadata": {"red_can": "CAN_EV" if i % 2 else "CAN_CATL", "density_voltaje": i / 10}}
+            for i in range(5)
+        ]
+        with open(self.dataset_path, "w", encoding="utf-8") as f:
+            for doc in self.documents:
+                f.write(json.dumps(doc, ensure_ascii=False) + "\n")
+    
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+    
+    def test_roundtrip_through_mmap(self):
+        """Test que el corpus mapeado reproduce los documentos"""
+        store = open_corpus(compile_corpus(self.dataset_path))
+        
+        self.assertEqual([doc.to_dict() for doc in store], self.documents)
+        self.assertIsInstance(store.column('word_count').values, np.ndarray)
+        np.testing.assert_allclose(store.numeric('density_voltaje'), [0.0, 0.1, 0.2, 0.3, 0.4])
+    
+    def test_recompiles_when_dataset_changes(self):
+        """Test detección de corpus desactualizado"""
+        corpus_path = compile_corpus(self.dataset_path)
+        self.assertTrue(is_corpus_current(corpus_path, self.dataset_path))
+        
+        with open(self.dataset_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"id": "nuevo", "text": "nuevo evento", "metadata": {}}) + "\n")
+        self.assertFalse(is_corpus_current(corpus_path, self.dataset_path))
+        
+        store = load_or_compile(self.dataset_path)
+        self.assertEqual(len(store), 6)
+        self.assertEqual(store[5].get('text'), "nuevo evento")
+
+class TestIndexSnapshots(unittest.TestCase):
+    """
+    Tests para los snapshots persistentes de índices
+    """
+    
+    def setUp(self):
+        """Configuración inicial con un JSONL temporal"""
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.dataset_path = os.path.join(self.tmp_dir.name, "dataset.jsonl")
+        with open(self.dataset_path, "w", encoding="utf-8") as f:
+            for i in range(4):
+                f.write(json.dumps({"id": f"evento_{i}", "text": f"corriente de carga {i} A"}) + "\n")
+        self.store = IndexSnapshotStore(os.path.join(self.tmp_dir.name, "snapshots"), name="dataset")
+    
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+    
+    def test_roundtrip_keyed_by_dataset_hash(self):
+        """Test que el snapshot solo se carga para el mismo contenido"""
+        index = BM25Index()
+        index.build(["corriente de carga", "tensión del pack"])
+        fingerprint = dataset_fingerprint(self.dataset_path)
+        self.store.save(fingerprint, {"lexical_index": index})
+        
+        restored = self.store.load(fingerprint)["lexical_index"]
+        self.assertEqual(restored.search("corriente"), index.search("corriente"))
+        
+        with open(self.dataset_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"id": "nuevo", "text": "nuevo evento"}) + "\n")
+        self.assertIsNone(self.store.load(dataset_fingerprint(self.dataset_path)))
+    
+    def test_corrupted_snapshot_is_rejected(self):
+        """Test validación de checksum del payload"""
+        fingerprint = dataset_fingerprint(self.dataset_path)
+        path = self.store.save(fingerprint, {"relevance_scores": np.arange(4.0)})
+        
+        with open(path, "r+b") as f:
+            f.seek(-1, os.SEEK_END)
+            last = f.read(1)
+            f.seek(-1, os.SEEK_END)
+            f.write(bytes([last[0] ^ 0xFF]))
+        
+        self.assertIsNone(self.store.load(fingerprint))
+    
+    def test_save_prunes_previous_snapshots(self):
+        """Test que solo queda el snapshot de la versión vigente"""
+        self.store.save("a" * 64, {"n_docs": 1})
+        self.store.save("b" * 64, {"n_docs": 2})
+        
+        snapshots = os.listdir(self.store.directory)
+        self.assertEqual(snapshots, [self.store.snapshot_path("b" * 64).name])
+
+    def test_schema_change_invalidates_snapshot(self):
+        """Test que cambiar los atributos de una clase persistida invalida el snapshot"""
+        class Index:
+            def __init__(self):
+                self.postings = {}
+
+        class IndexWithNorms:
+            def __init__(self):
+                self.postings = {}
+                self.norms = []
+
+        directory = os.path.join(self.tmp_dir.name, "snapshots")
+        fingerprint = dataset_fingerprint(self.dataset_path)
+        IndexSnapshotStore(directory, name="dataset", schema=[Index]).save(fingerprint, {"n_docs": 4})
+
+        self.assertEqual(instance_attributes(IndexWithNorms), ["norms", "postings"])
+        self.assertNotEqual(schema_fingerprint([Index]), schema_fingerprint([IndexWithNorms]))
+        self.assertEqual(IndexSnapshotStore(directory, name="dataset", schema=[Index]).load(fingerprint), {"n_docs": 4})
+        self.assertIsNone(IndexSnapshotStore(directory, name="dataset", schema=[IndexWithNorms]).load(fingerprint))
+
+class TestIncrementalIndex(unittest.TestCase):
+    """
+    Tests para el segmento delta, tombstones y merge de índices
+    """
+    
+    def setUp(self):
+        """Configuración inicial con un segmento base"""
+        base_documents = [
+            {"id": f"evento_{i}", "text": f"evento {i}", "red_can": "CAN_CUSTOM_31", "word_count": 10}
+            for i in range(3)
+        ]
+        self.store = SegmentedDocumentStore(ColumnarDocumentStore.from_documents(base_documents))
+        self.bitmaps = SegmentedBitmapIndex()
+        self.bitmaps.build(self.store)
+    
+    def test_append_to_delta_segment(self):
+        """Test que los documentos nuevos quedan en posiciones globales"""
+        positions = self.store.append([{"id": "nuevo", "text": "evento nuevo", "red_can": "CAN_EV", "word_count": 4}])
+        self.bitmaps.update_delta(self.store.delta_documents)
+        
+        self.assertEqual(positions.tolist(), [3])
+        self.assertEqual(self.store[3].get('text'), "evento nuevo")
+        self.assertEqual(self.store.numeric('word_count').tolist(), [10, 10, 10, 4])
+        self.assertEqual(self.bitmaps.filter_mask({"red_can": "CAN_EV"}).tolist(), [False, False, False, True])
+    
+    def test_tombstones_hide_documents(self):
+        """Test borrado lógico por id"""
+        self.store.delete(self.store.positions(["evento_1", "inexistente"]))
+        
+        self.assertEqual(self.store.live_count, 2)
+        self.assertEqual([doc.get('id') for doc in self.store], ["evento_0", "evento_2"])
+        self.assertEqual(self.store.value_counts('red_can'), {"CAN_CUSTOM_31": 2})
+        self.assertEqual(self.store.positions(["evento_1"]), [])
+    
+    def test_compaction_map(self):
+        """Test remapeo de posiciones tras el merge"""
+        live = np.array([True, False, True, True])
+        self.assertEqual(compaction_map(live).tolist(), [0, -1, 1, 2])
+    
+    def test_background_merger_runs_once_at_a_time(self):
+        """Test que el merge corre en segundo plano sin solaparse"""
+        calls = []
+        merger = BackgroundMerger(lambda: (time.sleep(0.05), calls.append(1)))
+        
+        self.assertTrue(merger.request())
+        self.assertFalse(merger.request())
+        merger.wait()
+        
+        self.assertEqual(calls, [1])
+        self.assertEqual(merger.merges_completed, 1)
+
+class TestResultCache(unittest.TestCase):
+    """
+    Tests para la caché LRU+TTL de resultados
+    """
+    
+    def setUp(self):
+        """Configuración inicial con reloj simulado"""
+        self.now = 0.0
+        self.cache = QueryResultCache(max_entries=2, ttl_seconds=10, clock=lambda: self.now)
+    
+    def test_lru_eviction(self):
+        """Test que se descarta la entrada menos usada"""
+        self.cache.put("a", 1)
+        self.cache.put("b", 2)
+        self.cache.get("a")
+        self.cache.put("c", 3)
+        
+        self.assertEqual(self.cache.get("a"), 1)
+        self.assertIsNone(self.cache.get("b"))
+        self.assertEqual(self.cache.stats()["evictions"], 1)
+    
+    def test_ttl_expiration(self):
+        """Test expiración por TTL y contadores de hits/misses"""
+        self.cache.put("a", 1)
+        self.now = 5.0
+        self.assertEqual(self.cache.get("a"), 1)
+        self.now = 16.0
+        self.assertIsNone(self.cache.get("a"))
+        
+        stats = self.cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["entries"]), (1, 1, 0))
+    
+    def test_query_key_normalization(self):
+        """Test clave: pregunta normalizada + parámetros + versión"""
+        from dataclasses import make_dataclass, field as dc_field
+        Query = make_dataclass("Query", [("question", str),
+                                         ("context_filters", dict, dc_field(default_factory=dict)),
+                                         ("max_retrieved_docs", int, 5)])
+        
+        self.assertEqual(normalize_question("  ¿Qué   eventos de CARGA? "), "que eventos de carga")
+        self.assertEqual(query_cache_key(Query("¿Qué eventos de carga?", {"a": 1, "b": 2}), 1),
+                         query_cache_key(Query("que  eventos de CARGA", {"b": 2, "a": 1}), 1))
+        self.assertNotEqual(query_cache_key(Query("carga"), 1), query_cache_key(Query("carga"), 2))
+        self.assertNotEqual(query_cache_key(Query("carga"), 1), query_cache_key(Query("carga", max_retrieved_docs=3), 1))
+
+class TestSemanticAnswerCache(unittest.TestCase):
+    """
+    Tests para la caché semántica de respuestas (preguntas parafraseadas)
+    """
+    
+    def setUp(self):
+        """Reloj simulado y embeddings sintéticos de dimensión 4"""
+        self.now = 0.0
+        self.cache = SemanticAnswerCache(dimension=4, max_entries=2, similarity_threshold=0.9,
+                                         ttl_seconds=10, clock=lambda: self.now)
+        self.scope = ('{"red_can": "CAN_CUSTOM_31"}', 5)
+    
+    def test_paraphrase_hit_reports_similarity(self):
+        """Test que una paráfrasis sobre el umbral reutiliza la respuesta y registra la similitud"""
+        self.cache.put([1.0, 0.0, 0.0, 0.0], self.scope, 1, "24.5 V", "voltaje del cargador")
+        
+        hit = self.cache.get([0.95, 0.2, 0.0, 0.0], self.scope, 1, "tensión en AUX_CHG")
+        self.assertEqual(hit[0], "24.5 V")
+        self.assertGreater(hit[1], 0.9)
+        self.assertIsNone(self.cache.get([0.5, 0.5, 0.5, 0.5], self.scope, 1))
+        
+        stats = self.cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 1))
+        self.assertAlmostEqual(stats["min_hit_similarity"], hit[1])
+        self.assertAlmostEqual(stats["best_miss_similarity"], 0.5)
+        self.assertEqual(stats["recent_hits"][0][:2], ("tensión en AUX_CHG", "voltaje del cargador"))
+    
+    def test_filters_and_version_must_match(self):
+        """Test que filtros distintos o una nueva versión del corpus no reutilizan respuestas"""
+        embedding = [0.0, 1.0, 0.0, 0.0]
+        self.cache.put(embedding, self.scope, 1, "respuesta")
+        
+        self.assertIsNone(self.cache.get(embedding, ('{"red_can": "CAN_CUSTOM_7"}', 5), 1))
+        self.assertIsNone(self.cache.get(embedding, self.scope, 2))
+        self.assertEqual(self.cache.get(embedding, self.scope, 1), ("respuesta", 1.0))
+    
+    def test_lru_replacement_and_ttl(self):
+        """Test que al llenarse se reemplaza la menos usada y que las entradas expiran"""
+        self.cache.put([1.0, 0.0, 0.0, 0.0], self.scope, 1, "a")
+        self.cache.put([0.0, 1.0, 0.0, 0.0], self.scope, 1, "b")
+        self.now = 1.0
+        self.cache.get([1.0, 0.0, 0.0, 0.0], self.scope, 1)
+        self.cache.put([0.0, 0.0, 1.0, 0.0], self.scope, 1, "c")
+        
+        self.assertIsNotNone(self.cache.get([1.0, 0.0, 0.0, 0.0], self.scope, 1))
+        self.assertIsNone(self.cache.get([0.0, 1.0, 0.0, 0.0], self.scope, 1))
+        
+        self.now = 12.0
+        self.assertIsNone(self.cache.get([0.0, 0.0, 1.0, 0.0], self.scope, 1))
+        self.cache.clear()
+        self.assertEqual(len(self.cache), 0)
+
+class TestEmbeddingCache(unittest.TestCase):
+    """
+    Tests para la caché persistente de embeddings
+    """
+    
+    def setUp(self):
+        """Configuración inicial con un modelo de embeddings simulado"""
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.embed = Mock(side_effect=lambda texts: [[float(len(t)), 1.0, 0.0] for t in texts])
+    
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+    
+    def test_only_misses_reach_the_model(self):
+        """Test que solo los textos nuevos (y sin repetir) se envían al modelo"""
+        cache = EmbeddingCache(self.tmp_dir.name, "ibm/slate-125m-english-rtrvr")
+        cache.get_or_compute(["carga", "tensión"], self.embed)
+        
+        vectors = cache.get_or_compute(["carga", "corriente", "corriente", "tensión  "], self.embed)
+        
+        self.assertEqual(self.embed.call_args_list[-1].args[0], ["corriente"])
+        np.testing.assert_allclose(vectors[:, 0], [5, 9, 9, 7])
+        self.assertEqual((cache.hits, cache.misses), (2, 3))
+    
+    def test_persists_across_instances(self):
+        """Test reapertura desde disco (memmap + índice hash -> fila)"""
+        EmbeddingCache(self.tmp_dir.name, "slate").get_or_compute(["carga", "frenado"], self.embed)
+        self.embed.reset_mock()
+        
+        reopened = EmbeddingCache(self.tmp_dir.name, "slate")
+        vectors = reopened.get_or_compute(["frenado"], self.embed)
+        
+        self.embed.assert_not_called()
+        self.assertEqual(len(reopened), 2)
+        np.testing.assert_allclose(vectors, [[7.0, 1.0, 0.0]])
+    
+    def test_model_id_is_part_of_the_key(self):
+        """Test que otro modelo no reutiliza embeddings"""
+        first = EmbeddingCache(self.tmp_dir.name, "slate-a")
+        second = EmbeddingCache(self.tmp_dir.name, "slate-b")
+        
+        self.assertNotEqual(first.key("carga"), second.key("carga"))
+        self.assertEqual(first.key("carga  de  batería"), first.key("carga de batería"))
+
+    def test_instances_sharing_directory_keep_each_others_rows(self):
+        """Test que dos instancias sobre el mismo directorio no se pisan las filas"""
+        first = EmbeddingCache(self.tmp_dir.name, "slate")
+        second = EmbeddingCache(self.tmp_dir.name, "slate")
+
+        first.get_or_compute(["carga"], self.embed)
+        np.testing.assert_allclose(second.get_or_compute(["frenado"], self.embed), [[7.0, 1.0, 0.0]])
+        self.embed.reset_mock()
+
+        # La segunda instancia incorporó la fila de la primera al escribir
+        np.testing.assert_allclose(second.get_or_compute(["carga"], self.embed), [[5.0, 1.0, 0.0]])
+        self.embed.assert_not_called()
+
+        reopened = EmbeddingCache(self.tmp_dir.name, "slate")
+        vectors = reopened.get_or_compute(["carga", "frenado"], self.embed)
+        self.embed.assert_not_called()
+        self.assertEqual(len(reopened), 2)
+        np.testing.assert_allclose(vectors[:, 0], [5.0, 7.0])
+
+class TestHashingEmbeddings(unittest.TestCase):
+    """
+    Tests para el backend local de embeddings (feature hashing)
+    """
+    
+    def setUp(self):
+        self.embedder = HashingEmbedder(dimension=768)
+    
+    def test_shape_and_normalization(self):
+        """Test dimensión, normas unitarias y texto vacío"""
+        vectors = self.embedder.embed(["Falla de carga en la batería", ""])
+        
+        self.assertEqual(vectors.shape, (2, 768))
+        self.assertEqual(vectors.dtype, np.float32)
+        self.assertAlmostEqual(float(np.linalg.norm(vectors[0])), 1.0, places=5)
+        self.assertEqual(float(np.linalg.norm(vectors[1])), 0.0)
+    
+    def test_deterministic_and_batch_independent(self):
+        """Test que el embedding no depende de la instancia ni del resto del lote"""
+        text = "Pérdida de comunicación CAN con el BMS"
+        single = HashingEmbedder().embed([text])[0]
+        batched = self.embedder.embed(["temperatura del motor", text, "frenado regenerativo"])[1]
+        
+        np.testing.assert_array_equal(single, batched)
+        self.assertEqual(self.embedder.calculate_embeddings([text])[0], single.tolist())
+    
+    def test_accent_folding(self):
+        """Test que tildes y mayúsculas no cambian el embedding"""
+        vectors = self.embedder.embed(["Batería y tensión", "bateria y TENSION"])
+        np.testing.assert_allclose(vectors[0], vectors[1], atol=1e-6)
+    
+    def test_similarity_ordering(self):
+        """Test que textos con vocabulario compartido quedan más cerca"""
+        query, related, unrelated = self.embedder.embed([
+            "falla de carga de la batería",
+            "la batería presenta fallas durante la carga",
+            "vibración en la suspensión delantera"
+        ])
+        self.assertGreater(float(query @ related), float(query @ unrelated) + 0.2)
+
+class TestFeatureReranker(unittest.TestCase):
+    """
+    Tests para el reranker de segunda etapa por características
+    """
+    
+    def setUp(self):
+        """Configuración inicial con candidatos del retrieval"""
+        self.documents = [
+            {"document_id": "frenado", "text": "Frenado de emergencia en la red CAN_EV", "score": 0.9,
+             "technical_density_score": 0.01,
+             "metadata": {"red_can": "CAN_EV", "evento_vehiculo": "frenado", "timestamp": "2024-01-01T00:00:00"}},
+            {"document_id": "carga_31", "text": "Voltaje de carga bajo en CAN_CUSTOM_31", "score": 0.6,
+             "technical_density_score": 0.03,
+             "metadata": {"red_can": "CAN_CUSTOM_31", "evento_vehiculo": "carga", "timestamp": "2024-01-10T00:00:00"}},
+            {"document_id": "carga_ev", "text": "Corriente de carga estable", "score": 0.7,
+             "technical_density_score": 0.05,
+             "metadata": {"red_can": "CAN_EV", "evento_vehiculo": "carga", "timestamp": "2024-01-15T10:30:45Z"}}
+        ]
+        self.known_values = {"red_can": ["CAN_EV", "CAN_CUSTOM_31"], "evento_vehiculo": ["carga", "frenado"]}
+    
+    def test_detect_metadata_mentions(self):
+        """Test detección de red CAN y evento como palabra completa"""
+        mentions = detect_metadata_mentions("¿Qué pasó con la CARGA en can_custom_31?", self.known_values)
+        self.assertEqual(mentions, {"red_can": ["CAN_CUSTOM_31"], "evento_vehiculo": ["carga"]})
+        self.assertEqual(detect_metadata_mentions("descargas del sistema", self.known_values), {})
+    
+    def test_feature_matrix(self):
+        """Test columnas de características en [0, 1]"""
+        reranker = FeatureReranker()
+        mentions = {"red_can": ["CAN_CUSTOM_31"], "evento_vehiculo": ["carga"]}
+        features = reranker.feature_matrix("voltaje de carga", self.documents, mentions)
+        
+        self.assertEqual(features.shape, (3, len(FeatureReranker.FEATURES)))
+        self.assertTrue(((features >= 0) & (features <= 1)).all())
+        np.testing.assert_allclose(features[:, 0], [0.0, 1.0, 0.5])    # solapamiento léxico
+        np.testing.assert_allclose(features[:, 1], [0.0, 1.0, 0.5])    # red CAN / evento
+        self.assertEqual(features[2, 2], 1.0)                          # el más reciente
+        np.testing.assert_allclose(features[:, 3], [0.2, 0.6, 1.0])    # densidad técnica
+    
+    def test_rerank_budget_and_threshold(self):
+        """Test que se conservan rerank_top_k candidatos sobre el umbral"""
+        mentions = detect_metadata_mentions("voltaje de carga en CAN_CUSTOM_31", self.known_values)
+        reranked = FeatureReranker(top_k=2, score_threshold=0.0).rerank(
+            "voltaje de carga en CAN_CUSTOM_31", self.documents, mentions)
+        
+        self.assertEqual([doc["document_id"] for doc in reranked], ["carga_31", "carga_ev"])
+        self.assertGreater(reranked[0]["rerank_score"], reranked[1]["rerank_score"])
+        
+        strict = FeatureReranker(top_k=3, score_threshold=0.99).rerank("voltaje", self.documents)
+        self.assertEqual(len(strict), 1)
+
+class TestContextPacker(unittest.TestCase):
+    """
+    Tests para el empaquetado de contexto con presupuesto de tokens
+    """
+    
+    def setUp(self):
+        """Configuración inicial con documentos de distinto tamaño"""
+        self.header_fn = Mock(side_effect=lambda doc: (f"Red CAN: {doc['metadata']['red_can']}\nContenido: ", "\n"))
+        self.packer = ContextPacker(self.header_fn, max_snippet_tokens=200, min_snippet_tokens=10)
+        self.documents = [
+            {"id": "largo", "text": "voltaje de carga " * 60, "metadata": {"red_can": "CAN_EV"}},
+            {"id": "corto_1", "text": "Frenado regenerativo activo", "metadata": {"red_can": "CAN_CATL"}},
+            {"id": "corto_2", "text": "Temperatura del cargador estable", "metadata": {"red_can": "CAN_CUSTOM_31"}}
+        ]
+    
+    def test_token_estimation(self):
+        """Test estimación y recorte por tokens"""
+        self.assertEqual(estimate_tokens("voltaje_carga_v: 36.00"), 8)
+        text, tokens = truncate_to_tokens("uno dos tres cuatro cinco", 5)
+        self.assertEqual(text, "uno dos...")
+        self.assertLessEqual(tokens, 5)
+        self.assertEqual(tokens, estimate_tokens(text))
+    
+    def test_budget_is_never_exceeded(self):
+        """Test que el contexto nunca supera el presupuesto"""
+        for budget in (0, 20, 45, 80, 150, 1000):
+            packed = self.packer.pack(self.documents, budget)
+            self.assertLessEqual(packed.tokens, budget)
+            self.assertLessEqual(estimate_tokens(packed.text), budget)
+            self.assertEqual(len(packed.documents) + packed.dropped, len(self.documents))
+    
+    def test_relevance_per_token_selection(self):
+        """Test knapsack greedy: con poco presupuesto ganan los fragmentos cortos"""
+        packed = self.packer.pack(self.documents, 80, relevance=[1.0, 0.5, 0.4])
+        self.assertEqual([doc["id"] for doc in packed.documents], ["largo", "corto_1", "corto_2"])
+        self.assertEqual(packed.truncated, [0])
+        self.assertTrue(packed.text.startswith("[Documento 1]\nRed CAN: CAN_EV"))
+        
+        full = self.packer.pack(self.documents, 1000, relevance=[1.0, 0.5, 0.4])
+        self.assertEqual((full.dropped, full.truncated), (0, []))
+    
+    def test_header_cache(self):
+        """Test que el encabezado de cada documento se formatea una sola vez"""
+        self.packer.pack(self.documents, 1000)
+        self.packer.pack(self.documents[::-1], 1000)
+        self.assertEqual(self.header_fn.call_count, 3)
+        
+        self.packer.clear()
+        self.packer.pack(self.documents, 1000)
+        self.assertEqual(self.header_fn.call_count, 6)
+
+class TestQueryIntents(unittest.TestCase):
+    """
+    Tests para el matcher compilado de intenciones de consulta
+    """
+    
+    def setUp(self):
+        self.matcher = IntentMatcher()
+    
+    def test_all_intents_in_one_pass(self):
+        """Test que una consulta retorna todas sus intenciones"""
+        intents = self.matcher.match("¿Qué  pasó con el voltaje de la BATERÍA? Diagnóstico de fallas")
+        self.assertEqual(intents, {"explicacion", "voltaje", "carga", "diagnostico"})
+        self.assertEqual(self.matcher.match("Análisis histórico J1939"), {"tendencias", "documentacion_tecnica"})
+    
+    def test_word_boundaries(self):
+        """Test que las palabras clave no coinciden dentro de otras palabras"""
+        self.assertEqual(self.matcher.match("vehículo detenido en descarga"), frozenset())
+        self.assertEqual(self.matcher.match("caída a 12 V"), {"voltaje"})
+        self.assertEqual(self.matcher.match("amperaje del cargador"), {"corriente", "carga"})
+    
+    def test_first_intent_priority(self):
+        """Test selección por prioridad con valor por defecto"""
+        intents = self.matcher.match("tendencia de la corriente con errores")
+        self.assertEqual(first_intent(intents, ("diagnostico", "explicacion", "tendencias"), "explicacion"), "diagnostico")
+        self.assertEqual(first_intent(frozenset(), ("voltaje", "corriente"), "general"), "general")
+
+class TestQueryPreprocessor(unittest.TestCase):
+    """
+    Tests para la expansión de abreviaciones en una pasada con memoización
+    """
+    
+    def setUp(self):
+        self.preprocessor = QueryPreprocessor(cache_size=4)
+    
+    def test_expands_whole_words_only(self):
+        """Test que solo se expanden abreviaciones como palabras completas"""
+        result = self.preprocessor.preprocess("Señal CAN_CUSTOM_31 y  SOC a 80km/h")
+        self.assertEqual(result.text, "Señal CAN_CUSTOM_31 y SOC (State of Charge) a 80km/h (kilómetros por hora)")
+        self.assertEqual(self.preprocessor.preprocess("SOCIAL RPMs").text, "SOCIAL RPMs")
+    
+    def test_expansion_is_idempotent(self):
+        """Test que reprocesar una consulta expandida no la modifica"""
+        once = self.preprocessor.preprocess("¿Qué es CAN?").text
+        self.assertEqual(once, "¿Qué es CAN (Controller Area Network)?")
+        self.assertEqual(self.preprocessor.preprocess(once).text, once)
+    
+    def test_memoized_terms(self):
+        """Test que los términos léxicos se reutilizan desde la caché acotada"""
+        result = self.preprocessor.preprocess("Revisar RPM")
+        self.assertEqual(result.terms, ("revisar", "rpm", "revoluciones", "minuto"))
+        
+        hits = self.preprocessor.cache.hits
+        self.assertIs(self.preprocessor.terms(result.text), result.terms)
+        self.assertEqual(self.preprocessor.cache.hits, hits + 1)
+        
+        for i in range(10):
+            self.preprocessor.preprocess(f"consulta {i}")
+        self.assertLessEqual(len(self.preprocessor.cache), 4)
+
+class TestStreamingGeneration(unittest.TestCase):
+    """
+    Tests para la generación en streaming contra un servidor de modelo local
+    """
+    
+    def setUp(self):
+        chunks = ["Voltaje", " estable", " en", " 24.5 V"]
+        self.server = FakeWatsonServer(lambda payload: chunks, chunk_delay=0.05, first_chunk_delay=0.1).start()
+        self.client = GraniteStreamClient(self.server.url, "fake-key", "proyecto", iam_url=self.server.iam_url)
+    
+    def tearDown(self):
+        self.server.stop()
+    
+    def test_chunks_arrive_incrementally(self):
+        """Test que los fragmentos llegan antes del final y se mide el primer token"""
+        stream = GenerationStream(self.client.stream("¿Voltaje?", {"max_new_tokens": 16}))
+        arrivals = [stream.elapsed for _ in stream]
+        
+        self.assertEqual(stream.text, "Voltaje estable en 24.5 V")
+        self.assertEqual(len(arrivals), 4)
+        self.assertGreaterEqual(stream.time_to_first_token, 0.1)
+        self.assertLess(arrivals[0], arrivals[-1] - 0.1)
+        self.assertEqual(self.server.requests[-1]["body"]["parameters"], {"max_new_tokens": 16})
+    
+    def test_async_iteration_reuses_token(self):
+        """Test consumo con async for y token IAM reutilizado entre solicitudes"""
+        import asyncio
+        
+        async def consume():
+            stream = GenerationStream(self.client.stream("consulta"))
+            return [chunk async for chunk in stream], stream
+        
+        GenerationStream(self.client.stream("primera")).read()
+        chunks, stream = asyncio.run(consume())
+        
+        self.assertEqual("".join(chunks), stream.text)
+        self.assertIsNotNone(stream.time_to_first_token)
+        paths = [request["path"] for request in self.server.requests]
+        self.assertEqual(paths.count("/identity/token"), 1)
+    
+    def test_generate_sends_one_prompt_per_request(self):
+        """Test generación completa: `input` es un solo prompt y se retorna su texto"""
+        answer = self.client.generate("¿Voltaje?", {"max_new_tokens": 16})
+        
+        self.assertEqual(answer, "Voltaje estable en 24.5 V")
+        body = self.server.requests[-1]["body"]
+        self.assertEqual(self.server.requests[-1]["path"], "/ml/v1/text/generation")
+        self.assertEqual((body["input"], body["parameters"]), ("¿Voltaje?", {"max_new_tokens": 16}))
+    
+    def test_finalize_and_text_chunks(self):
+        """Test que el resultado final se arma al agotar el flujo"""
+        text = "📊 Análisis de voltaje:\n- Red CAN_CUSTOM_31 con 3 eventos"
+        stream = GenerationStream(text_chunks(text, words_per_chunk=2), finalize=lambda s: s.text.upper())
+        
+        self.assertIsNone(stream.result)
+        self.assertEqual(stream.read(), text)
+        self.assertTrue(stream.done)
+        self.assertEqual(stream.result, text.upper())
+        with self.assertRaises(RuntimeError):
+            list(stream)
+
+class TestAsyncWatsonClient(unittest.TestCase):
+    """
+    Tests para el cliente asíncrono (pool keep-alive) contra el servidor local de Discovery/WML
+    """
+    
+    def setUp(self):
+        self.server = FakeWatsonServer(latency=0.05).start()
+        self.client = AsyncWatsonClient(self.server.url, "wml-key", "proyecto", self.server.url, "disc-key",
+                                        iam_url=self.server.iam_url,
+                                        pool=AsyncConnectionPool(max_connections_per_host=50))
+    
+    def tearDown(self):
+        self.server.stop()
+    
+    def _run(self, coroutine):
+        import asyncio
+        
+        async def run_and_close():
+            try:
+                return await coroutine
+            finally:
+                await self.client.close()
+        return asyncio.run(run_and_close())
+    
+    def test_keep_alive_reuses_connection(self):
+        """Test que las solicitudes secuenciales comparten una conexión"""
+        async def search_three_times():
+            return [await self.client.search_discovery("voltaje", "coleccion", 3) for _ in range(3)]
+        
+        results = self._run(search_three_times())
+        
+        self.assertEqual([len(docs) for docs in results], [3, 3, 3])
+        self.assertEqual(results[0][0]["document_id"], "decode_ev_000000")
+        self.assertIn("confidence", results[0][0])
+        self.assertEqual(self.server.connections, 1)
+    
+    def test_hundreds_of_concurrent_queries(self):
+        """Test cientos de consultas en vuelo acotadas por el pool"""
+        import asyncio
+        
+        async def search_many():
+            return await asyncio.gather(*(self.client.search_discovery(f"consulta {i}", "coleccion", 2)
+                                          for i in range(300)))
+        
+        start = time.time()
+        results = self._run(search_many())
+        
+        self.assertEqual(len(results), 300)
+        self.assertTrue(all(len(docs) == 2 for docs in results))
+        self.assertLess(time.time() - start, 300 * 0.05 / 10)
+        self.assertLessEqual(self.client.pool.connections_opened, 50)
+    
+    def test_timeout_discards_connection(self):
+        """Test que una solicitud cancelada no devuelve su conexión al pool"""
+        import asyncio
+        
+        async def timeout_then_search():
+            await self.client.search_discovery("calentar", "coleccion")
+            idle_before = self.client.pool.idle_connections()
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(self.client.search_discovery("lenta", "coleccion"), 0.01)
+            self.assertEqual(self.client.pool.idle_connections(), idle_before - 1)
+            return await self.client.search_discovery("después", "coleccion", 1)
+        
+        self.assertEqual(len(self._run(timeout_then_search())), 1)
+    
+    def test_generate_stream(self):
+        """Test generación en streaming sobre el pool"""
+        async def generate():
+            return [chunk async for chunk in self.client.generate_stream("¿Voltaje?", "ibm/granite-13b-chat-v2")]
+        
+        chunks = self._run(generate())
+        
+        self.assertEqual(len(chunks), 5)
+        self.assertIn("24.5 V", "".join(chunks))
+
+class TestSingleFlight(unittest.TestCase):
+    """
+    Tests para la coalescencia de consultas idénticas en vuelo
+    """
+    
+    def test_concurrent_calls_share_one_execution(self):
+        """Test que llamadas concurrentes con la misma clave ejecutan una sola vez"""
+        import threading
+        from concurrent.futures import ThreadPoolExecutor
+        
+        flight = SingleFlight()
+        calls = []
+        release = threading.Event()
+        
+        def slow_query():
+            calls.append(1)
+            release.wait(2)
+            return {"answer": "voltaje estable"}
+        
+        with ThreadPoolExecutor(max_workers=10) as executor:
+            futures = [executor.submit(flight.do, "misma_clave", slow_query) for _ in range(10)]
+            while flight.stats()["coalesced"] < 9:
+                time.sleep(0.01)
+            release.set()
+            results = [future.result() for future in futures]
+        
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sum(shared for _, shared in results), 9)
+        self.assertTrue(all(result is results[0][0] for result, _ in results))
+        self.assertEqual(flight.stats(), {"in_flight": 0, "executed": 1, "coalesced": 9})
+    
+    def test_key_released_after_completion(self):
+        """Test que errores se propagan y la clave se libera al terminar"""
+        flight = SingleFlight()
+        
+        def failing():
+            raise ValueError("Granite no disponible")
+        
+        with self.assertRaises(ValueError):
+            flight.do("clave", failing)
+        self.assertEqual(flight.do("clave", lambda: 42), (42, False))
+        self.assertEqual(flight.stats()["executed"], 2)
+    
+    def test_async_cancelling_one_waiter(self):
+        """Test que cancelar un solicitante no cancela el cómputo compartido"""
+        import asyncio
+        
+        flight = AsyncSingleFlight()
+        executions = []
+        
+        async def slow_query():
+            executions.append(1)
+            await asyncio.sleep(0.05)
+            return "respuesta"
+        
+        async def scenario():
+            first = asyncio.ensure_future(flight.do("clave", slow_query))
+            others = [asyncio.ensure_future(flight.do("clave", slow_query)) for _ in range(5)]
+            await asyncio.sleep(0.01)
+            first.cancel()
+            return await asyncio.gather(*others)
+        
+        results = asyncio.run(scenario())
+        
+        self.assertEqual(len(executions), 1)
+        self.assertEqual(results, [("respuesta", True)] * 5)
+        self.assertEqual(flight.stats()["in_flight"], 0)
+
+class TestRateLimiting(unittest.TestCase):
+    """
+    Tests para el limitador compartido (token bucket + concurrencia AIMD)
+    """
+    
+    class Http429(Exception):
+        code = 429
+        headers = {"Retry-After": "0.01"}
+    
+    def test_token_bucket_bounds_rate(self):
+        """Test que tras la ráfaga inicial las llamadas respetan la tasa sostenida"""
+        limiter = ClientRateLimiter({"discovery_query": EndpointLimits(rate_per_second=50, burst=5)})
+        
+        start = time.time()
+        for _ in range(15):
+            limiter.call("discovery_query", lambda: None)
+        elapsed = time.time() - start
+        
+        # 5 de ráfaga + 10 a 50/s ≈ 0.2 s
+        self.assertGreaterEqual(elapsed, 0.18)
+        self.assertLess(elapsed, 1.0)
+        self.assertEqual(limiter.stats()["discovery_query"]["admitted"], 15)
+    
+    def test_concurrency_limit_and_additive_increase(self):
+        """Test que nunca hay más llamadas en vuelo que el límite y que éste crece con respuestas rápidas"""
+        import threading
+        from concurrent.futures import ThreadPoolExecutor
+        
+        limiter = ClientRateLimiter({"generation": EndpointLimits(
+            rate_per_second=1000, burst=1000, initial_concurrency=2, max_concurrency=4, latency_target=1.0)})
+        lock, active, peak = threading.Lock(), [0], [0]
+        
+        def call():
+            with lock:
+                active[0] += 1
+                peak[0] = max(peak[0], active[0])
+            time.sleep(0.01)
+            with lock:
+                active[0] -= 1
+        
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            for future in [executor.submit(limiter.call, "generation", call) for _ in range(60)]:
+                future.result()
+        
+        stats = limiter.stats()["generation"]
+        self.assertLessEqual(peak[0], 4)
+        self.assertGreater(peak[0], 2)
+        self.assertEqual(stats["concurrency_limit"], 4.0)
+        self.assertEqual(stats["in_flight"], 0)
+    
+    def test_429_backs_off_and_retries(self):
+        """Test que un 429 reduce el límite a la mitad, respeta Retry-After y reintenta"""
+        limiter = ClientRateLimiter({"embeddings": EndpointLimits(
+            rate_per_second=1000, burst=1000, initial_concurrency=8)}, max_retries=2)
+        attempts = []
+        
+        def flaky():
+            attempts.append(time.time())
+            if len(attempts) < 3:
+                raise self.Http429("Too Many Requests")
+            return [0.1, 0.2]
+        
+        self.assertEqual(limiter.call("embeddings", flaky), [0.1, 0.2])
+        stats = limiter.stats()["embeddings"]
+        self.assertEqual(len(attempts), 3)
+        self.assertGreaterEqual(attempts[1] - attempts[0], 0.01)
+        self.assertEqual(stats["rate_limited"], 2)
+        self.assertLess(stats["concurrency_limit"], 4.0)
+        
+        def always_limited():
+            raise self.Http429("Too Many Requests")
+        
+        with self.assertRaises(RateLimitedError):
+            limiter.call("embeddings", always_limited)
+        with self.assertRaises(ValueError):
+            limiter.call("embeddings", lambda: int("no es número"))
+    
+    def test_async_client_shares_limits(self):
+        """Test que el cliente asíncrono respeta el límite de concurrencia contra el servidor local"""
+        import asyncio
+        
+        limiter = ClientRateLimiter({"discovery_query": EndpointLimits(
+            rate_per_second=1000, burst=1000, initial_concurrency=3, max_concurrency=3)})
+        
+        with FakeWatsonServer(latency=0.05) as server:
+            async def scenario():
+                client = AsyncWatsonClient(server.url, "k", "proyecto", server.url, "k",
+                                           iam_url=server.iam_url, rate_limiter=limiter)
+                try:
+                    return await asyncio.gather(*(client.search_discovery("voltaje", "c", 2) for _ in range(9)))
+                finally:
+                    await client.close()
+            
+            start = time.time()
+            results = asyncio.run(scenario())
+            elapsed = time.time() - start
+        
+        self.assertTrue(all(len(documents) == 2 for documents in results))
+        # 9 búsquedas de 50 ms con 3 en vuelo: al menos 3 rondas
+        self.assertGreaterEqual(elapsed, 0.15)
+        self.assertEqual(limiter.stats()["discovery_query"]["admitted"], 9)
+
+class TestDiscoveryResilience(unittest.TestCase):
+    """
+    Tests para hedging, circuit breaker y respaldo local de la búsqueda Discovery
+    """
+    
+    def _warm_tracker(self, latency: float = 0.02) -> LatencyTracker:
+        tracker = LatencyTracker(min_samples=5)
+        for _ in range(20):
+            tracker.observe(latency)
+        return tracker
+    
+    def test_slow_request_is_hedged(self):
+        """Test que tras el p95 se envía una segunda solicitud y gana la más rápida"""
+        caller = ResilientCaller(latency=self._warm_tracker(), timeout=2.0)
+        attempts = []
+        
+        def discovery():
+            attempts.append(1)
+            time.sleep(0.5 if len(attempts) == 1 else 0.01)
+            return [{"document_id": f"intento_{len(attempts)}"}]
+        
+        start = time.time()
+        result, source = caller.call(discovery, lambda: [])
+        elapsed = time.time() - start
+        
+        self.assertEqual((result, source), ([{"document_id": "intento_2"}], "primary"))
+        self.assertLess(elapsed, 0.3)
+        stats = caller.stats()
+        self.assertEqual((stats["hedged"], stats["hedge_wins"], stats["hedge_rate"]), (1, 1, 1.0))
+    
+    def test_fast_requests_are_not_hedged(self):
+        """Test que las respuestas dentro del p95 no duplican solicitudes"""
+        caller = ResilientCaller(latency=self._warm_tracker(0.05), timeout=2.0)
+        calls = []
+        
+        for _ in range(5):
+            caller.call(lambda: calls.append(1) or ["doc"], lambda: [])
+        
+        self.assertEqual(len(calls), 5)
+        self.assertEqual(caller.stats()["hedge_rate"], 0.0)
+    
+    def test_breaker_opens_and_recovers(self):
+        """Test que fallos seguidos abren el breaker (respaldo local) y una prueba exitosa lo cierra"""
+        caller = ResilientCaller(CircuitBreaker(failure_threshold=2, reset_timeout=0.1),
+                                 latency=self._warm_tracker(), timeout=0.2)
+        healthy = [False]
+        calls = []
+        
+        def discovery():
+            calls.append(1)
+            if not healthy[0]:
+                raise ConnectionError("Discovery caído")
+            return ["remoto"]
+        
+        sources = [caller.call(discovery, lambda: ["local"])[1] for _ in range(4)]
+        self.assertEqual(sources, ["fallback"] * 4)
+        self.assertEqual(caller.breaker.state, "open")
+        calls_while_open = len(calls)
+        caller.call(discovery, lambda: ["local"])
+        self.assertEqual(len(calls), calls_while_open)
+        
+        healthy[0] = True
+        time.sleep(0.15)
+        self.assertEqual(caller.call(discovery, lambda: ["local"]), (["remoto"], "primary"))
+        stats = caller.stats()
+        self.assertEqual(stats["breaker"]["state"], "closed")
+        self.assertEqual(stats["breaker"]["times_opened"], 1)
+        self.assertEqual(stats["fallbacks"], 5)
+    
+    def test_local_fallback_index(self):
+        """Test que el índice local responde en formato Discovery (léxico e híbrido)"""
+        documents = [
+            {"document_id": "d1", "title": "Voltaje", "text": "voltaje del paquete de baterías en carga", "metadata": {}},
+            {"document_id": "d2", "title": "Velocidad", "text": "velocidad del vehículo en autopista", "metadata": {}},
+            {"document_id": "d3", "title": "Temperatura", "text": "temperatura del motor eléctrico", "metadata": {}}
+        ]
+        lexical = LocalFallbackIndex()
+        self.assertEqual(lexical.add_documents(documents + documents[:1]), 3)
+        
+        results = lexical.search("voltaje baterías", max_docs=2)
+        self.assertEqual(results[0]["document_id"], "d1")
+        self.assertEqual(results[0]["confidence"], 1.0)
+        self.assertEqual(results[0]["metadata"]["retrieval_source"], "local_index")
+        
+        embeddings = np.eye(3, 8).tolist()
+        hybrid = LocalFallbackIndex(embed_query=lambda text: embeddings[2], dimension=8)
+        hybrid.add_documents(documents, embeddings)
+        self.assertEqual(hybrid.search("consulta sin términos comunes", max_docs=1)[0]["document_id"], "d3")
+
+class SynonymHashingEmbedder(HashingEmbedder):
+    """Feature hashing con sinónimos unificados: paráfrasis cercanas como con un modelo semántico"""
+    
+    def __init__(self, synonyms: Dict[str, str], dimension: int = 768):
+        super().__init__(dimension)
+        self.synonyms = synonyms
+    
+    def embed(self, texts):
+        return super().embed([" ".join(self.synonyms.get(token, token) for token in tokenize(text))
+                              for text in texts])
+
+class TestCoreRAGPipeline(unittest.TestCase):
+    """
+    Tests de integración de DecodeEVRAGSystem (pipeline de 7 pasos, modo simulación)
+    """
+    
+    def setUp(self):
+        """Sistema inicializado sobre un corpus pequeño con un documento J1939"""
+        self.core = load_pipeline_module("03_core_rag_system.py")
+        self.documents = [
+            {"id": "j1939_chunk_0", "text": "Resumen del protocolo J1939: los mensajes de diagnóstico de camiones "
+                                            "pesados usan identificadores extendidos de 29 bits sobre el bus del "
+                                            "tractor a 250 kbit/s con direcciones de origen por unidad de control",
+             "metadata": {"red_can": "CAN_J1939"}},
+            {"id": "proto_doc", "text": "protocolo de carga rápida", "metadata": {"red_can": "CAN_CUSTOM_31"}}
+        ] + [
+            {"id": f"evt_{i}", "text": f"Evento de frenado {i} con voltaje {20 + i} V",
+             "metadata": {"red_can": "CAN_CUSTOM_31"}}
+            for i in range(10)
+        ]
+        with redirect_stdout(StringIO()):
+            self.rag = self.core.DecodeEVRAGSystem()
+            self.assertTrue(self.rag.initialize_rag_pipeline())
+            self.assertTrue(self.rag.index_documents(self.documents))
+    
+    def _ids(self, response) -> List[str]:
+        return [doc["document_id"] for doc in response.retrieved_documents]
+    
+    def test_exact_keyword_query_returns_its_document(self):
+        """Test que un documento hallado solo por BM25 no se descarta con el umbral de coseno"""
+        response = self.rag.query_rag(self.core.RAGQuery("protocolo J1939"))
+        
+        self.assertNotIn("error", response.metadata)
+        self.assertIn("j1939_chunk_0", self._ids(response))
+
+    def test_invalid_filter_fails_only_its_batch_query(self):
+        """Test que un filtro inválido en un lote solo produce error en su propia consulta"""
+        invalid = self.core.RAGQuery("evento de frenado", context_filters={"bogus": "x"})
+        responses = self.rag.query_rag_batch([
+            self.core.RAGQuery("protocolo J1939"),
+            invalid,
+            self.core.RAGQuery("voltaje", context_filters={"red_can": "CAN_CUSTOM_31"})
+        ])
+
+        self.assertNotIn("error", responses[0].metadata)
+        self.assertIn("bogus", responses[1].metadata["error"])
+        self.assertNotIn("error", responses[2].metadata)
+        self.assertIn("bogus", self.rag.query_rag(invalid).metadata["error"])
+
+    def test_add_update_delete_visible_through_query_rag(self):
+        """Test que altas, cambios y bajas se reflejan en query_rag antes y después del merge"""
+        def top(question):
+            response = self.rag.query_rag(self.core.RAGQuery(question))
+            self.assertNotIn("error", response.metadata)
+            return [(doc["document_id"], doc["text"]) for doc in response.retrieved_documents]
+        
+        self.rag.add_documents([{"id": "evt_nuevo", "text": "Regeneración en pendiente con voltaje 48 V",
+                                 "metadata": {"red_can": "CAN_CUSTOM_31"}}])
+        self.assertEqual(top("regeneración en pendiente")[0][0], "evt_nuevo")
+        
+        self.rag.update_documents([{"id": "evt_nuevo", "text": "Climatización encendida con voltaje 48 V",
+                                    "metadata": {"red_can": "CAN_CUSTOM_31"}}])
+        self.assertEqual(top("climatización encendida")[0], ("evt_nuevo", "Climatización encendida con voltaje 48 V"))
+        self.assertNotIn("Regeneración en pendiente con voltaje 48 V",
+                         [text for _, text in top("regeneración en pendiente")])
+        
+        self.rag.delete_documents(["evt_nuevo", "evt_2"])
+        for merged in (False, True):
+            if merged:
+                self.rag._merge_segments()
+            with self.subTest(merged=merged):
+                ids = [doc_id for doc_id, _ in top("climatización encendida") + top("frenado 2")]
+                self.assertNotIn("evt_nuevo", ids)
+                self.assertNotIn("evt_2", ids)
+        self.assertEqual(len(self.rag.delta_index), 0)
+    
+    def test_mutation_invalidates_cached_answers(self):
+        """Test que una respuesta cacheada no sobrevive a un cambio del corpus y las métricas lo reflejan"""
+        query = self.core.RAGQuery("regeneración en pendiente")
+        first = self.rag.query_rag(query)
+        self.assertTrue(self.rag.query_rag(query).metadata.get("cache_hit"))
+        version = self.rag.index_version
+        
+        self.rag.add_documents([{"id": "evt_nuevo", "text": "Regeneración en pendiente con voltaje 48 V",
+                                 "metadata": {"red_can": "CAN_CUSTOM_31"}}])
+        after = self.rag.query_rag(query)
+        
+        self.assertNotIn("evt_nuevo", self._ids(first))
+        self.assertNotIn("cache_hit", after.metadata)
+        self.assertEqual(self._ids(after)[0], "evt_nuevo")
+        
+        metrics = self.rag.get_system_metrics()
+        self.assertEqual(metrics["index_version"], version + 1)
+        self.assertEqual(metrics["total_queries"], 3)
+        self.assertEqual((metrics["result_cache"]["hits"], metrics["result_cache"]["misses"]), (1, 2))
+        self.assertEqual(metrics["result_cache"]["entries"], 1)
+    
+    def test_semantic_cache_inactive_with_hashing_embeddings(self):
+        """Test que con feature hashing la caché semántica no se consulta ni se llena"""
+        self.rag.query_rag(self.core.RAGQuery("voltaje del evento 5"))
+        response = self.rag.query_rag(self.core.RAGQuery("tensión en el evento 5"))
+        
+        self.assertNotIn("semantic_cache_hit", response.metadata)
+        self.assertEqual(len(self.rag.semantic_cache), 0)
+        self.assertFalse(self.rag.get_system_metrics()["semantic_cache"]["active"])
+    
+    def test_semantic_cache_hit_for_paraphrase(self):
+        """Test que una paráfrasis reutiliza la respuesta en query_rag con embeddings semánticos"""
+        self.rag.rag_config["embedding_backend"] = "sinonimos"
+        self.rag.local_embedder = SynonymHashingEmbedder({"tension": "voltaje"})
+        with redirect_stdout(StringIO()):
+            self.assertTrue(self.rag.index_documents(self.documents))
+        
+        first = self.rag.query_rag(self.core.RAGQuery("voltaje del evento 5"))
+        second = self.rag.query_rag(self.core.RAGQuery("¿Tensión en el evento 5?"))
+        other_scope = self.rag.query_rag(self.core.RAGQuery("¿Tensión en el evento 5?", max_retrieved_docs=3))
+        
+        self.assertNotIn("error", first.metadata)
+        self.assertTrue(second.metadata.get("semantic_cache_hit"))
+        self.assertGreaterEqual(second.metadata["semantic_similarity"], self.rag.rag_config["semantic_cache_threshold"])
+        self.assertEqual(second.answer, first.answer)
+        self.assertNotIn("semantic_cache_hit", other_scope.metadata)
+        self.assertEqual(self.rag.semantic_cache.stats()["hits"], 1)
+    
+    def test_quantized_merge_keeps_vectors_on_disk(self):
+        """Test que el merge con cuantización reconstruye desde el archivo y no deja floats en RAM"""
+        self.rag.rag_config["vector_quantization"] = "int8"
+        with redirect_stdout(StringIO()):
+            self.assertTrue(self.rag.index_documents(self.documents))
+        self.rag.add_documents([{"id": "evt_nuevo", "text": "Evento de carga con voltaje 48 V",
+                                 "metadata": {"red_can": "CAN_CUSTOM_31"}}])
+        self.rag.delete_documents(["evt_3"])
+        self.rag._merge_segments()
+        
+        self.assertIsInstance(self.rag.dense_index.matrix, np.memmap)
+        self.assertEqual(len(self.rag.dense_index), len(self.documents))
+        self.assertEqual(len(self.rag.delta_index), 0)
+        self.assertEqual(self.rag.dense_index.memory_usage(), self.rag.dense_index.codes.nbytes)
+        ids = self._ids(self.rag.query_rag(self.core.RAGQuery("evento de carga voltaje 48")))
+        self.assertIn("evt_nuevo", ids)
+        self.assertNotIn("evt_3", ids)
+        self.rag.dense_index.release()
+
+class TestCompleteRAGSystem(unittest.TestCase):
+    """
+    Tests de sistema del pipeline del dashboard (03_core_rag_system_complete)
+    sobre un dataset JSONL temporal
+    """
+    
+    def setUp(self):
+        """Carga un dataset pequeño con dos redes CAN"""
+        self.complete = load_pipeline_module("03_core_rag_system_complete.py")
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        dataset_path = os.path.join(self.tmp_dir.name, "dataset.jsonl")
+        with open(dataset_path, "w", encoding="utf-8") as f:
+            for i in range(6):
+                f.write(json.dumps({
+                    "id": f"evento_{i}", "text": f"Evento de carga {i}: voltaje {350 + i} v en el cargador",
+                    "document_type": "evento_can", "technical_density_score": 1.0 + i / 10,
+                    "metadata": {"red_can": "CAN_EV" if i % 2 else "CAN_CUSTOM_31", "evento_vehiculo": "carga",
+                                 "density_voltaje": 0.5}
+                }, ensure_ascii=False) + "\n")
+        
+        self.rag = self.complete.DecodeEVRAGSystem()
+        self.assertTrue(self.rag.load_processed_dataset(dataset_path))
+    
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+    
+    def _ids(self, response) -> List[str]:
+        return [doc.get("id") for doc in response.retrieved_documents]
+    
+    def test_invalid_filter_is_reported_and_not_cached(self):
+        """Test que un filtro inválido se reporta como error (no como "sin documentos") y no se cachea"""
+        for filters in ({"campo_inexistente": "x"}, {"$or": {"red_can": "CAN_EV"}}, {"red_can": {"$gt": 1}}):
+            with self.subTest(filters=filters):
+                response = self.rag.query_rag(self.complete.RAGQuery("voltaje del cargador", context_filters=filters))
+                self.assertIn("error", response.metadata)
+        
+        streamed = self.rag.query_rag_stream(self.complete.RAGQuery("voltaje", context_filters={"campo": 1}))
+        streamed.read()
+        self.assertIn("error", streamed.result.metadata)
+        
+        self.assertEqual(len(self.rag.result_cache), 0)
+        valid = self.rag.query_rag(self.complete.RAGQuery("voltaje del cargador", context_filters={"red_can": "CAN_EV"}))
+        self.assertEqual(self._ids(valid), ["evento_1", "evento_3", "evento_5"])
+    
+    def test_stale_precomputed_mask_is_recomputed(self):
+        """Test que una máscara precalculada no se reutiliza tras un merge que deja el mismo tamaño"""
+        filters = {"red_can": "CAN_EV"}
+        stale = self.complete.PrecomputedFilterMask(self.rag.index_generation, self.rag._filter_mask(filters))
+        
+        self.rag.update_documents([{"id": "evento_1", "text": "Evento de carga 1: voltaje 351 v en el cargador",
+                                    "document_type": "evento_can",
+                                    "metadata": {"red_can": "CAN_CUSTOM_31", "evento_vehiculo": "carga"}}])
+        self.rag._merge_segments()
+        self.assertEqual(len(self.rag.documents), stale.mask.size)
+        
+        response = self.rag.query_rag(self.complete.RAGQuery("voltaje del cargador", context_filters=filters),
+                                      filter_mask=stale)
+        self.assertEqual(sorted(self._ids(response)), ["evento_3", "evento_5"])
+    
+    def test_incremental_route_rankings_match_full_rebuild(self):
+        """Test que altas, cambios y bajas actualizan las categorías sin reordenar el corpus completo"""
+        # Sin merge en segundo plano: se compara el estado incremental con una reconstrucción
+        self.rag.rag_config.update({"delta_merge_threshold": 1000, "tombstone_merge_ratio": 1.0})
+        with patch.object(self.rag, "_build_route_rankings", side_effect=AssertionError("reconstrucción completa")):
+            self.rag.add_documents([
+                {"id": f"nuevo_{i}", "text": f"Carga nueva {i}", "document_type": "evento_can",
+                 "technical_density_score": score, "metadata": {"evento_vehiculo": "carga", "density_voltaje": 0.5}}
+                for i, score in enumerate([1.25, 0.0, 1.5])
+            ])
+            self.rag.update_documents([{"id": "evento_2", "text": "Evento de carga 2 corregido",
+                                        "document_type": "evento_can", "technical_density_score": 2.0,
+                                        "metadata": {"evento_vehiculo": "frenado"}}])
+            self.rag.delete_documents(["evento_4", "nuevo_2"])
+
+        def live_rankings():
+            return {route: [int(i) for i in ranking if self.rag.route_masks[route][i]]
+                    for route, ranking in self.rag.route_rankings.items()}
+
+        incremental = (live_rankings(), {r: m.copy() for r, m in self.rag.route_masks.items()},
+                       self.rag.relevance_scores.copy())
+        self.rag._build_route_rankings()
+
+        self.assertEqual(incremental[0], live_rankings())
+        for route, mask in self.rag.route_masks.items():
+            np.testing.assert_array_equal(incremental[1][route], mask)
+        np.testing.assert_allclose(incremental[2], self.rag.relevance_scores)
+        self.assertEqual(live_rankings()["carga"][:3], [5, 3, 6])
+
+    def test_add_update_delete_visible_through_query_rag(self):
+        """Test que altas, cambios y bajas se reflejan en query_rag antes y después del merge"""
+        def ids(question, filters=None):
+            response = self.rag.query_rag(self.complete.RAGQuery(question, context_filters=filters or {}))
+            self.assertNotIn("error", response.metadata)
+            return self._ids(response)
+        
+        self.rag.add_documents([{"id": "evento_nuevo", "text": "Regeneración en pendiente: voltaje 380 v",
+                                 "document_type": "evento_can", "technical_density_score": 1.0,
+                                 "metadata": {"red_can": "CAN_EV", "evento_vehiculo": "frenado"}}])
+        self.assertEqual(ids("regeneración en pendiente")[0], "evento_nuevo")
+        self.assertIn("evento_nuevo", ids("voltaje", {"evento_vehiculo": "frenado"}))
+        
+        self.rag.update_documents([{"id": "evento_nuevo", "text": "Regeneración en pendiente: voltaje 380 v",
+                                    "document_type": "evento_can", "technical_density_score": 1.0,
+                                    "metadata": {"red_can": "CAN_EV", "evento_vehiculo": "regeneracion"}}])
+        self.assertEqual(ids("voltaje", {"evento_vehiculo": "frenado"}), [])
+        self.assertEqual(ids("voltaje", {"evento_vehiculo": "regeneracion"}), ["evento_nuevo"])
+        
+        self.rag.delete_documents(["evento_nuevo", "evento_3"])
+        for merged in (False, True):
+            if merged:
+                self.rag._merge_segments()
+            with self.subTest(merged=merged):
+                self.assertEqual(ids("voltaje", {"evento_vehiculo": "regeneracion"}), [])
+                self.assertEqual(ids("voltaje del cargador", {"red_can": "CAN_EV"}), ["evento_1", "evento_5"])
+    
+    def test_mutation_invalidates_cached_answers(self):
+        """Test que borrar un documento invalida la respuesta cacheada que lo citaba"""
+        query = self.complete.RAGQuery("voltaje del cargador", context_filters={"red_can": "CAN_EV"})
+        self.assertIn("evento_3", self._ids(self.rag.query_rag(query)))
+        self.assertTrue(self.rag.query_rag(query).metadata.get("cache_hit"))
+        
+        self.rag.delete_documents(["evento_3"])
+        after = self.rag.query_rag(query)
+        
+        self.assertNotIn("cache_hit", after.metadata)
+        self.assertEqual(self._ids(after), ["evento_1", "evento_5"])
+        stats = self.rag.get_system_statistics()
+        self.assertEqual((stats["result_cache"]["hits"], stats["result_cache"]["misses"]), (1, 2))
+        self.assertEqual(stats["result_cache"]["entries"], 1)
+    
+    def test_stream_reports_time_to_first_token(self):
+        """Test que query_rag_stream entrega fragmentos de Granite y reporta el time-to-first-token"""
+        chunks = ["El voltaje ", "del cargador ", "se mantuvo ", "estable."]
+        with FakeWatsonServer(lambda payload: chunks, chunk_delay=0.1, first_chunk_delay=0.2) as server:
+            self.rag.generation_client = GraniteStreamClient(server.url, "fake-key", "proyecto",
+                                                             iam_url=server.iam_url)
+            stream = self.rag.query_rag_stream(self.complete.RAGQuery("voltaje del cargador"))
+            received = list(stream)
+        
+        response = stream.result
+        self.assertEqual(received, chunks)
+        self.assertEqual(response.answer, "".join(chunks))
+        self.assertEqual(response.time_to_first_token, stream.time_to_first_token)
+        self.assertGreaterEqual(response.time_to_first_token, 0.2)
+        self.assertGreaterEqual(response.processing_time - response.time_to_first_token, 0.25)
+        self.assertTrue(response.retrieved_documents)
+    
+    def test_identical_concurrent_queries_coalesce(self):
+        """Test que consultas idénticas simultáneas en query_rag comparten una sola generación"""
+        from concurrent.futures import ThreadPoolExecutor
+        
+        with FakeWatsonServer(chunk_delay=0.01, first_chunk_delay=0.3) as server:
+            self.rag.generation_client = GraniteStreamClient(server.url, "fake-key", "proyecto",
+                                                             iam_url=server.iam_url)
+            query = self.complete.RAGQuery("voltaje del cargador")
+            with ThreadPoolExecutor(max_workers=5) as executor:
+                responses = list(executor.map(lambda _: self.rag.query_rag(query), range(5)))
+            generations = [r for r in server.requests if r["path"] == "/ml/v1/text/generation_stream"]
+        
+        self.assertEqual(len(generations), 1)
+        self.assertEqual(len({response.answer for response in responses}), 1)
+        self.assertEqual(sum(bool(response.metadata.get("coalesced")) for response in responses), 4)
+        self.assertEqual(self.rag.single_flight.stats(), {"in_flight": 0, "executed": 1, "coalesced": 4})
+    
+    def test_abandoned_stream_leader_releases_followers(self):
+        """Test que un flujo líder abandonado a mitad libera a los seguidores que lo esperaban"""
+        from concurrent.futures import ThreadPoolExecutor
+        
+        self.rag.rag_config["single_flight_timeout"] = 5
+        query = self.complete.RAGQuery("voltaje del cargador")
+        chunks = iter(self.rag.query_rag_stream(query))
+        next(chunks)
+        
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            follower = executor.submit(self.rag.query_rag, query)
+            while self.rag.single_flight.stats()["coalesced"] == 0:
+                time.sleep(0.01)
+            start = time.time()
+            chunks.close()
+            response = follower.result(timeout=5)
+        
+        self.assertLess(time.time() - start, 1.0)
+        self.assertNotIn("error", response.metadata)
+        self.assertTrue(response.answer)
+        self.assertEqual(self.rag.single_flight.stats()["in_flight"], 0)
+    
+    def test_follower_timeout_runs_query_once(self):
+        """Test que un seguidor cuyo líder no termina consulta por su cuenta tras un solo timeout"""
+        from concurrent.futures import ThreadPoolExecutor
+
+        self.rag.rag_config["single_flight_timeout"] = 0.2
+        query = self.complete.RAGQuery("voltaje del cargador")
+        cache_key = self.complete.query_cache_key(query, self.rag.index_version)
+        call, _ = self.rag.single_flight.begin(cache_key)
+
+        try:
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                follower = executor.submit(self.rag.query_rag, query)
+                stream_follower = executor.submit(lambda: self.rag.query_rag_stream(query).read())
+                response = follower.result(timeout=3)
+                self.assertTrue(stream_follower.result(timeout=3))
+        finally:
+            self.rag.single_flight.finish(cache_key, call, error=RuntimeError("líder de prueba"))
+
+        self.assertNotIn("error", response.metadata)
+        self.assertNotIn("coalesced", response.metadata)
+        self.assertEqual(self.rag.single_flight.stats()["coalesced"], 2)
+
+    def test_unconsumed_stream_leader_releases_key(self):
+        """Test que un flujo líder descartado sin iterarlo no deja la consulta en vuelo"""
+        import gc
+        
+        query = self.complete.RAGQuery("voltaje del cargador")
+        stream = self.rag.query_rag_stream(query)
+        self.assertEqual(self.rag.single_flight.stats()["in_flight"], 1)
+        del stream
+        gc.collect()
+        
+        self.assertEqual(self.rag.single_flight.stats()["in_flight"], 0)
+        response = self.rag.query_rag(query)
+        self.assertNotIn("coalesced", response.metadata)
+
 class TestPerformance(unittest.TestCase):
     """
     Tests de rendimiento y carga
@@ -413,6 +2113,31 @@ class RAGTestRunner:
         # Agregar test cases
         suite.addTests(loader.loadTestsFromTestCase(TestDecodeEVRAGSystem))
         suite.addTests(loader.loadTestsFromTestCase(TestDatasetIntegration))
+        suite.addTests(loader.loadTestsFromTestCase(TestLexicalIndex))
+        suite.addTests(loader.loadTestsFromTestCase(TestVectorIndex))
+        suite.addTests(loader.loadTestsFromTestCase(TestIVFIndex))
+        suite.addTests(loader.loadTestsFromTestCase(TestQuantizedIndex))
+        suite.addTests(loader.loadTestsFromTestCase(TestHybridRetrieval))
+        suite.addTests(loader.loadTestsFromTestCase(TestMetadataFilters))
+        suite.addTests(loader.loadTestsFromTestCase(TestDocumentStore))
+        suite.addTests(loader.loadTestsFromTestCase(TestBinaryCorpus))
+        suite.addTests(loader.loadTestsFromTestCase(TestIndexSnapshots))
+        suite.addTests(loader.loadTestsFromTestCase(TestIncrementalIndex))
+        suite.addTests(loader.loadTestsFromTestCase(TestResultCache))
+        suite.addTests(loader.loadTestsFromTestCase(TestSemanticAnswerCache))
+        suite.addTests(loader.loadTestsFromTestCase(TestEmbeddingCache))
+        suite.addTests(loader.loadTestsFromTestCase(TestHashingEmbeddings))
+        suite.addTests(loader.loadTestsFromTestCase(TestFeatureReranker))
+        suite.addTests(loader.loadTestsFromTestCase(TestContextPacker))
+        suite.addTests(loader.loadTestsFromTestCase(TestQueryIntents))
+        suite.addTests(loader.loadTestsFromTestCase(TestQueryPreprocessor))
+        suite.addTests(loader.loadTestsFromTestCase(TestStreamingGeneration))
+        suite.addTests(loader.loadTestsFromTestCase(TestAsyncWatsonClient))
+        suite.addTests(loader.loadTestsFromTestCase(TestSingleFlight))
+        suite.addTests(loader.loadTestsFromTestCase(TestRateLimiting))
+        suite.addTests(loader.loadTestsFromTestCase(TestDiscoveryResilience))
+        suite.addTests(loader.loadTestsFromTestCase(TestCoreRAGPipeline))
+        suite.addTests(loader.loadTestsFromTestCase(TestCompleteRAGSystem))
         suite.addTests(loader.loadTestsFromTestCase(TestPerformance))
         
         # Ejecutar tests
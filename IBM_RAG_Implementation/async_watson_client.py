@@ -0,0 +1,411 @@
+# Cliente asíncrono de servicios IBM para DECODE-EV RAG
+# Pool HTTP/1.1 keep-alive sobre asyncio, tokens IAM compartidos y llamadas a Discovery / watsonx.ai
+
+import ssl
+import json
+import time
+import asyncio
+import urllib.parse
+from collections import deque
+from contextlib import nullcontext
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Deque, Dict, List, Optional, Tuple
+
+from rate_limiting import ClientRateLimiter
+from streaming_generation import IAM_URL, GENERATION_API_VERSION
+
+DISCOVERY_RETURN_FIELDS = ['document_id', 'title', 'text', 'metadata']
+
+
+@dataclass(frozen=True)
+class StageTimeouts:
+    """Límites en segundos por etapa del pipeline asíncrono (None = sin límite)"""
+    discovery: Optional[float] = 10.0
+    generation: Optional[float] = 60.0
+    total: Optional[float] = 90.0
+
+
+class HTTPStatusError(RuntimeError):
+    """Respuesta HTTP con código de error (conserva código y cabeceras, p. ej. Retry-After en 429)"""
+
+    def __init__(self, status: int, headers: Dict[str, str], message: str):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers
+
+
+@dataclass
+class HTTPResponse:
+    status: int
+    headers: Dict[str, str]
+    body: bytes
+
+    def json(self) -> Any:
+        return json.loads(self.body.decode("utf-8") or "null")
+
+    def raise_for_status(self) -> None:
+        if self.status >= 400:
+            raise HTTPStatusError(self.status, self.headers,
+                                  f"HTTP {self.status}: {self.body[:200].decode('utf-8', 'replace')}")
+
+
+def discovery_result_to_document(result: Dict) -> Dict:
+    """Documento recuperado en el formato del pipeline RAG a partir de un resultado de Discovery"""
+    return {
+        'document_id': result.get('document_id'),
+        'title': result.get('title', ''),
+        'text': result.get('text', ''),
+        'metadata': result.get('metadata', {}),
+        'confidence': result.get('result_metadata', {}).get('confidence', 0),
+        'highlights': result.get('highlight', {})
+    }
+
+
+class _Connection:
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+        self.requests = 0
+
+    @property
+    def usable(self) -> bool:
+        return not self.writer.is_closing() and not self.reader.at_eof()
+
+    def close(self) -> None:
+        try:
+            self.writer.close()
+        except RuntimeError:
+            # Conexión de un event loop ya cerrado
+            pass
+
+
+class AsyncConnectionPool:
+    """
+    Pool de conexiones HTTP/1.1 keep-alive por (esquema, host, puerto).
+
+    Cada solicitud toma una conexión ociosa (o abre una nueva) y la devuelve
+    al terminar de leer la respuesta; a lo sumo `max_connections_per_host`
+    solicitudes usan el mismo host a la vez y las demás esperan turno. Si la
+    solicitud se cancela o falla a mitad de camino la conexión se cierra en
+    vez de volver al pool, así que nunca se reutiliza una conexión con una
+    respuesta a medio leer. Una conexión reutilizada que el servidor ya cerró
+    se reintenta una vez con una conexión nueva.
+
+    El pool pertenece a un event loop; si se usa desde otro loop (p. ej.
+    varios `asyncio.run`) descarta las conexiones del anterior.
+    """
+
+    def __init__(self, max_connections_per_host: int = 100, connect_timeout: float = 10.0,
+                 ssl_context: Optional[ssl.SSLContext] = None):
+        self.max_connections_per_host = max_connections_per_host
+        self.connect_timeout = connect_timeout
+        self.ssl_context = ssl_context or ssl.create_default_context()
+        self.connections_opened = 0
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._idle: Dict[Tuple[str, str, int], Deque[_Connection]] = {}
+        self._slots: Dict[Tuple[str, str, int], asyncio.Semaphore] = {}
+
+    def idle_connections(self) -> int:
+        return sum(len(idle) for idle in self._idle.values())
+
+    async def request(self, method: str, url: str, headers: Optional[Dict[str, str]] = None,
+                      body: bytes = b"") -> HTTPResponse:
+        """Solicitud completa: retorna status, encabezados y cuerpo"""
+        parts = []
+        async with self._exchange(method, url, headers, body) as (status, response_headers, chunks):
+            async for chunk in chunks:
+                parts.append(chunk)
+        return HTTPResponse(status, response_headers, b"".join(parts))
+
+    async def stream_lines(self, method: str, url: str, headers: Optional[Dict[str, str]] = None,
+                           body: bytes = b"") -> AsyncIterator[str]:
+        """Líneas del cuerpo a medida que llegan (Server-Sent Events)"""
+        async with self._exchange(method, url, headers, body) as (status, response_headers, chunks):
+            if status >= 400:
+                error = b"".join([chunk async for chunk in chunks])
+                HTTPResponse(status, response_headers, error).raise_for_status()
+
+            buffer = b""
+            async for chunk in chunks:
+                buffer += chunk
+                *lines, buffer = buffer.split(b"\n")
+                for line in lines:
+                    yield line.decode("utf-8").rstrip("\r")
+            if buffer:
+                yield buffer.decode("utf-8").rstrip("\r")
+
+    async def close(self) -> None:
+        for idle in self._idle.values():
+            while idle:
+                idle.popleft().close()
+
+    def _exchange(self, method: str, url: str, headers: Optional[Dict[str, str]], body: bytes):
+        return _Exchange(self, method, url, headers or {}, body)
+
+    def _check_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            for idle in self._idle.values():
+                for connection in idle:
+                    connection.close()
+            self._idle, self._slots, self._loop = {}, {}, loop
+
+    def _slot(self, key: Tuple[str, str, int]) -> asyncio.Semaphore:
+        if key not in self._slots:
+            self._slots[key] = asyncio.Semaphore(self.max_connections_per_host)
+            self._idle[key] = deque()
+        return self._slots[key]
+
+    async def _acquire(self, key: Tuple[str, str, int]) -> Tuple[_Connection, bool]:
+        """(conexión, reutilizada)"""
+        idle = self._idle[key]
+        while idle:
+            connection = idle.pop()
+            if connection.usable:
+                return connection, True
+            connection.close()
+
+        scheme, host, port = key
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(host, port, ssl=self.ssl_context if scheme == "https" else None),
+            self.connect_timeout
+        )
+        self.connections_opened += 1
+        return _Connection(reader, writer), False
+
+    def _release(self, key: Tuple[str, str, int], connection: _Connection, reusable: bool) -> None:
+        if reusable and connection.usable:
+            self._idle[key].append(connection)
+        else:
+            connection.close()
+
+
+class _Exchange:
+    """Una solicitud/respuesta sobre una conexión del pool (context manager asíncrono)"""
+
+    def __init__(self, pool: AsyncConnectionPool, method: str, url: str, headers: Dict[str, str], body: bytes):
+        self.pool = pool
+        self.method = method
+        self.headers = headers
+        self.body = body
+
+        parsed = urllib.parse.urlsplit(url)
+        port = parsed.port or (443 if parsed.scheme == "https" else 80)
+        self.key = (parsed.scheme, parsed.hostname, port)
+        self.host_header = parsed.netloc
+        self.target = (parsed.path or "/") + (f"?{parsed.query}" if parsed.query else "")
+
+        self._connection: Optional[_Connection] = None
+        self._reusable = False
+        self._keep_alive = False
+        self._slot: Optional[asyncio.Semaphore] = None
+
+    async def __aenter__(self):
+        self.pool._check_loop()
+        self._slot = self.pool._slot(self.key)
+        await self._slot.acquire()
+        try:
+            status, headers = await self._send()
+        except BaseException:
+            self._finish()
+            raise
+        return status, headers, self._body_chunks(headers)
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        self._finish()
+
+    def _finish(self) -> None:
+        if self._connection is not None:
+            self.pool._release(self.key, self._connection, self._reusable)
+            self._connection = None
+        if self._slot is not None:
+            self._slot.release()
+            self._slot = None
+
+    async def _send(self) -> Tuple[int, Dict[str, str]]:
+        for attempt in range(2):
+            self._connection, reused = await self.pool._acquire(self.key)
+            try:
+                return await self._send_on(self._connection)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                # Conexión keep-alive cerrada por el servidor mientras estaba ociosa
+                self._connection.close()
+                self._connection = None
+                if not reused or attempt == 1:
+                    raise
+        raise ConnectionError("Sin conexión disponible")
+
+    async def _send_on(self, connection: _Connection) -> Tuple[int, Dict[str, str]]:
+        lines = [f"{self.method} {self.target} HTTP/1.1", f"Host: {self.host_header}",
+                 "Connection: keep-alive", f"Content-Length: {len(self.body)}"]
+        lines += [f"{name}: {value}" for name, value in self.headers.items()]
+        connection.writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + self.body)
+        await connection.writer.drain()
+
+        status_line = await connection.reader.readline()
+        if not status_line:
+            raise ConnectionResetError("El servidor cerró la conexión")
+        version, status = status_line.decode("latin-1").split(" ", 2)[:2]
+
+        headers = {}
+        while True:
+            line = (await connection.reader.readline()).decode("latin-1").rstrip("\r\n")
+            if not line:
+                break
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        connection.requests += 1
+        self._keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+        return int(status), headers
+
+    async def _body_chunks(self, headers: Dict[str, str]) -> AsyncIterator[bytes]:
+        reader = self._connection.reader
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            while True:
+                size = int((await reader.readline()).split(b";")[0].strip(), 16)
+                if size == 0:
+                    while (await reader.readline()).strip():
+                        pass
+                    break
+                yield await reader.readexactly(size)
+                await reader.readexactly(2)
+        elif "content-length" in headers:
+            length = int(headers["content-length"])
+            if length:
+                yield await reader.readexactly(length)
+        else:
+            # Sin longitud: el cuerpo termina al cerrar la conexión
+            self._keep_alive = False
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    break
+                yield data
+
+        # Respuesta leída por completo: la conexión puede volver al pool
+        self._reusable = self._keep_alive
+
+
+class AsyncIAMToken:
+    """Token IAM de una API key, compartido entre corrutinas (una sola renovación a la vez)"""
+
+    def __init__(self, pool: AsyncConnectionPool, api_key: str, iam_url: str = IAM_URL):
+        self.pool = pool
+        self.api_key = api_key
+        self.iam_url = iam_url
+        self._token: Optional[str] = None
+        self._expiration = 0.0
+        self._refresh: Optional[asyncio.Task] = None
+
+    async def get(self) -> str:
+        if self._token is not None and time.time() < self._expiration - 60:
+            return self._token
+
+        loop = asyncio.get_running_loop()
+        if self._refresh is None or self._refresh.done() or self._refresh.get_loop() is not loop:
+            self._refresh = loop.create_task(self._fetch())
+        # shield: cancelar una consulta no cancela la renovación que esperan las demás
+        return await asyncio.shield(self._refresh)
+
+    async def _fetch(self) -> str:
+        body = urllib.parse.urlencode({
+            "grant_type": "urn:ibm:params:oauth:grant-type:apikey",
+            "apikey": self.api_key
+        }).encode("utf-8")
+        response = await self.pool.request("POST", self.iam_url, {
+            "Content-Type": "application/x-www-form-urlencoded",
+            "Accept": "application/json"
+        }, body)
+        response.raise_for_status()
+
+        token = response.json()
+        self._token = token["access_token"]
+        self._expiration = float(token.get("expiration", time.time() + token.get("expires_in", 3600)))
+        return self._token
+
+
+class AsyncWatsonClient:
+    """
+    Llamadas REST asíncronas a Watson Discovery (v2 query) y watsonx.ai
+    (text/generation_stream) sobre un pool keep-alive compartido. Con
+    `rate_limiter` cada llamada pasa por su token bucket y límite adaptativo.
+    """
+
+    def __init__(self, watsonx_url: str, watsonx_api_key: str, project_id: str,
+                 discovery_url: str, discovery_api_key: str, discovery_version: str = "2023-03-31",
+                 iam_url: str = IAM_URL, generation_version: str = GENERATION_API_VERSION,
+                 pool: Optional[AsyncConnectionPool] = None,
+                 rate_limiter: Optional[ClientRateLimiter] = None):
+        self.watsonx_url = watsonx_url.rstrip("/")
+        self.discovery_url = discovery_url.rstrip("/")
+        self.project_id = project_id
+        self.discovery_version = discovery_version
+        self.generation_version = generation_version
+
+        self.pool = pool or AsyncConnectionPool()
+        self.watsonx_token = AsyncIAMToken(self.pool, watsonx_api_key, iam_url)
+        self.discovery_token = AsyncIAMToken(self.pool, discovery_api_key, iam_url)
+        self.rate_limiter = rate_limiter
+
+    async def search_discovery(self, query: str, collection_id: str, max_docs: int = 5) -> List[Dict]:
+        """Documentos de Discovery en el mismo formato que search_watson_discovery"""
+        if self.rate_limiter is not None:
+            return await self.rate_limiter.call_async(
+                "discovery_query", lambda: self._search_discovery(query, collection_id, max_docs)
+            )
+        return await self._search_discovery(query, collection_id, max_docs)
+
+    async def _search_discovery(self, query: str, collection_id: str, max_docs: int) -> List[Dict]:
+        body = json.dumps({
+            "collection_ids": [collection_id],
+            "query": query,
+            "count": max_docs,
+            "return": DISCOVERY_RETURN_FIELDS,
+            "highlight": True
+        }).encode("utf-8")
+        response = await self.pool.request(
+            "POST",
+            f"{self.discovery_url}/v2/projects/{self.project_id}/query?version={self.discovery_version}",
+            await self._headers(self.discovery_token), body
+        )
+        response.raise_for_status()
+        return [discovery_result_to_document(result) for result in response.json().get('results', [])]
+
+    async def generate_stream(self, prompt: str, model_id: str,
+                              parameters: Optional[Dict[str, Any]] = None) -> AsyncIterator[str]:
+        """Fragmentos de `generated_text` a medida que llegan"""
+        body = json.dumps({
+            "model_id": model_id,
+            "input": prompt,
+            "parameters": parameters or {},
+            "project_id": self.project_id
+        }).encode("utf-8")
+        headers = {**await self._headers(self.watsonx_token), "Accept": "text/event-stream"}
+
+        # El lugar se ocupa durante todo el flujo: la concurrencia del modelo es el recurso limitado
+        slot = self.rate_limiter.slot_async("generation") if self.rate_limiter is not None else nullcontext()
+        async with slot:
+            event = "message"
+            async for line in self.pool.stream_lines(
+                    "POST", f"{self.watsonx_url}/ml/v1/text/generation_stream?version={self.generation_version}",
+                    headers, body):
+                if line.startswith("event:"):
+                    event = line[6:].strip()
+                elif line.startswith("data:"):
+                    payload = json.loads(line[5:].strip() or "{}")
+                    if event == "error" or "errors" in payload:
+                        raise RuntimeError(f"Error en generation_stream: {payload}")
+                    for result in payload.get("results", []):
+                        if result.get("generated_text"):
+                            yield result["generated_text"]
+                elif not line:
+                    event = "message"
+
+    async def close(self) -> None:
+        await self.pool.close()
+
+    @staticmethod
+    async def _headers(token: AsyncIAMToken) -> Dict[str, str]:
+        return {"Authorization": f"Bearer {await token.get()}", "Content-Type": "application/json"}
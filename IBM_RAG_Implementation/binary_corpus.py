@@ -0,0 +1,199 @@
+# Corpus binario mapeado en memoria para DECODE-EV RAG
+# Compila el JSONL procesado a un archivo con columnas de ancho fijo + heap de texto (mmap)
+
+import os
+import sys
+import json
+import mmap
+import struct
+import jsonlines
+import numpy as np
+from pathlib import Path
+from typing import Any, Dict, Optional, Union
+
+from document_store import Column, ColumnarDocumentStore
+
+CORPUS_MAGIC = b"DECODEEV"
+CORPUS_VERSION = 1
+CORPUS_SUFFIX = ".corpus"
+
+# magic (8s) | versión (I) | reservado (I) | longitud del header JSON (Q)
+_PREAMBLE = struct.Struct("<8sIIQ")
+_ALIGNMENT = 64
+
+_DTYPES = {"int": "<i8", "float": "<f8", "bool": "|b1", "category": "<i4"}
+
+
+def corpus_path_for(dataset_path: Union[str, Path]) -> Path:
+    """Ruta del corpus compilado junto al JSONL (dataset.jsonl -> dataset.corpus)"""
+    return Path(dataset_path).with_suffix(CORPUS_SUFFIX)
+
+
+def _source_signature(dataset_path: Union[str, Path]) -> Dict[str, int]:
+    stat = os.stat(dataset_path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def _pad(offset: int) -> int:
+    return (-offset) % _ALIGNMENT
+
+
+def write_corpus(store: ColumnarDocumentStore, output_path: Union[str, Path],
+                 source: Optional[Dict[str, Any]] = None) -> Path:
+    """
+    Escribe el almacén columnar en formato binario:
+    preámbulo | header JSON | columnas de ancho fijo | tabla de offsets | heap de texto
+    Cada bloque queda alineado a 64 bytes para poder mapearlo con np.frombuffer.
+    """
+    output_path = Path(output_path)
+    blocks = []
+
+    def add_block(array: np.ndarray) -> Dict[str, Any]:
+        data = np.ascontiguousarray(array).tobytes()
+        blocks.append(data)
+        return {"block": len(blocks) - 1, "nbytes": len(data)}
+
+    columns = []
+    for column in store.columns.values():
+        descriptor = {"name": column.name, "scope": column.scope, "kind": column.kind}
+        if column.kind == "object":
+            # Columnas heterogéneas (poco frecuentes) viajan en el header
+            descriptor["values"] = column.values
+        else:
+            descriptor["dtype"] = _DTYPES[column.kind]
+            descriptor["data"] = add_block(column.values.astype(_DTYPES[column.kind]))
+        if column.categories is not None:
+            descriptor["categories"] = column.categories
+        if column.present is not None:
+            descriptor["present"] = add_block(column.present.astype(np.bool_))
+        columns.append(descriptor)
+
+    header = {
+        "n_docs": len(store),
+        "source": source or {},
+        "columns": columns,
+        "text_offsets": add_block(store.text_offsets.astype("<i8")),
+        "text_heap": add_block(np.frombuffer(bytes(store.text_blob), dtype=np.uint8))
+    }
+
+    # Los offsets absolutos dependen del tamaño del header: se itera hasta que sean estables
+    header["block_offsets"] = []
+    while True:
+        header_bytes = json.dumps(header, ensure_ascii=False).encode("utf-8")
+        offset = _PREAMBLE.size + len(header_bytes)
+        offset += _pad(offset)
+        block_offsets = []
+        for data in blocks:
+            block_offsets.append(offset)
+            offset += len(data) + _pad(len(data))
+        if block_offsets == header["block_offsets"]:
+            break
+        header["block_offsets"] = block_offsets
+
+    tmp_path = output_path.with_name(output_path.name + f".tmp{os.getpid()}")
+    with open(tmp_path, "wb") as f:
+        f.write(_PREAMBLE.pack(CORPUS_MAGIC, CORPUS_VERSION, 0, len(header_bytes)))
+        f.write(header_bytes)
+        f.write(b"\0" * _pad(f.tell()))
+        for data in blocks:
+            f.write(data)
+            f.write(b"\0" * _pad(len(data)))
+
+    # Reemplazo atómico: otros workers nunca ven un archivo a medio escribir
+    os.replace(tmp_path, output_path)
+    return output_path
+
+
+def compile_corpus(dataset_path: Union[str, Path], output_path: Optional[Union[str, Path]] = None) -> Path:
+    """Compila el JSONL procesado al formato binario"""
+    output_path = Path(output_path) if output_path else corpus_path_for(dataset_path)
+    with jsonlines.open(dataset_path) as reader:
+        store = ColumnarDocumentStore.from_documents(reader)
+    return write_corpus(store, output_path, source=_source_signature(dataset_path))
+
+
+def open_corpus(corpus_path: Union[str, Path]) -> ColumnarDocumentStore:
+    """
+    Mapea el corpus binario en memoria (solo lectura).
+    Las columnas son vistas np.frombuffer sobre el mmap y el texto solo se
+    decodifica al acceder a un documento, por lo que las páginas se comparten
+    entre procesos a través del page cache.
+    """
+    with open(corpus_path, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    magic, version, _, header_len = _PREAMBLE.unpack_from(mapped, 0)
+    if magic != CORPUS_MAGIC or version != CORPUS_VERSION:
+        raise ValueError(f"Formato de corpus no soportado: {corpus_path}")
+
+    header = json.loads(bytes(mapped[_PREAMBLE.size:_PREAMBLE.size + header_len]).decode("utf-8"))
+    block_offsets = header["block_offsets"]
+
+    def block(ref: Dict[str, Any], dtype: str) -> np.ndarray:
+        item_size = np.dtype(dtype).itemsize
+        return np.frombuffer(mapped, dtype=dtype, count=ref["nbytes"] // item_size,
+                             offset=block_offsets[ref["block"]])
+
+    columns = {}
+    for descriptor in header["columns"]:
+        if descriptor["kind"] == "object":
+            values = descriptor["values"]
+        else:
+            values = block(descriptor["data"], descriptor["dtype"])
+        present = block(descriptor["present"], "|b1") if "present" in descriptor else None
+        column = Column(descriptor["name"], descriptor["scope"], descriptor["kind"], values,
+                        descriptor.get("categories"), present)
+        columns[(column.scope, column.name)] = column
+
+    heap = header["text_heap"]
+    heap_offset = block_offsets[heap["block"]]
+    text_blob = memoryview(mapped)[heap_offset:heap_offset + heap["nbytes"]]
+
+    return ColumnarDocumentStore(columns, text_blob, block(header["text_offsets"], "<i8"), header["n_docs"])
+
+
+def is_corpus_current(corpus_path: Union[str, Path], dataset_path: Union[str, Path]) -> bool:
+    """Verifica que el corpus compilado corresponda a la versión actual del JSONL"""
+    corpus_path = Path(corpus_path)
+    if not corpus_path.exists():
+        return False
+    try:
+        with open(corpus_path, "rb") as f:
+            magic, version, _, header_len = _PREAMBLE.unpack(f.read(_PREAMBLE.size))
+            if magic != CORPUS_MAGIC or version != CORPUS_VERSION:
+                return False
+            header = json.loads(f.read(header_len).decode("utf-8"))
+        return header.get("source") == _source_signature(dataset_path)
+    except (OSError, ValueError, struct.error):
+        return False
+
+
+def load_or_compile(dataset_path: Union[str, Path]) -> ColumnarDocumentStore:
+    """
+    Abre el corpus compilado del dataset, compilándolo si no existe o está
+    desactualizado. Si no se puede escribir junto al dataset, carga en memoria.
+    """
+    dataset_path = Path(dataset_path)
+    if dataset_path.suffix == CORPUS_SUFFIX:
+        return open_corpus(dataset_path)
+
+    corpus_path = corpus_path_for(dataset_path)
+    if not is_corpus_current(corpus_path, dataset_path):
+        try:
+            compile_corpus(dataset_path, corpus_path)
+        except OSError:
+            with jsonlines.open(dataset_path) as reader:
+                return ColumnarDocumentStore.from_documents(reader)
+
+    return open_corpus(corpus_path)
+
+
+# Paso de compilación: python binary_corpus.py dataset_processed_watsonx.jsonl [salida.corpus]
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Uso: python binary_corpus.py <dataset.jsonl> [salida.corpus]")
+        sys.exit(1)
+
+    output = compile_corpus(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else None)
+    store = open_corpus(output)
+    print(f"✅ Corpus compilado: {output} ({len(store)} documentos, {output.stat().st_size} bytes)")
@@ -0,0 +1,155 @@
+# Empaquetado de contexto con presupuesto de tokens para DECODE-EV RAG
+# Selección greedy (knapsack) de fragmentos por relevancia/token con encabezados en caché
+
+import re
+import math
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Hashable, List, Mapping, Optional, Sequence, Tuple
+
+# Palabras y signos: aproximación conservadora a los tokenizadores BPE (~4 caracteres por token)
+_PIECE_PATTERN = re.compile(r"\w+|[^\w\s]")
+_CHARS_PER_TOKEN = 4
+
+# Formato de un documento: (texto antes del contenido, texto después del contenido)
+HeaderFunction = Callable[[Mapping[str, Any]], Tuple[str, str]]
+
+
+def estimate_tokens(text: str) -> int:
+    """Tokens estimados de `text` (cada palabra cuenta 1 token por cada 4 caracteres)"""
+    return sum(math.ceil(len(piece) / _CHARS_PER_TOKEN) for piece in _PIECE_PATTERN.findall(text))
+
+
+_ELLIPSIS = "..."
+_ELLIPSIS_TOKENS = estimate_tokens(_ELLIPSIS)
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> Tuple[str, int]:
+    """
+    Prefijo de `text` que no supera `max_tokens` (incluido el "..." final
+    si se recorta), cortado al final de una palabra
+    """
+    if estimate_tokens(text) <= max_tokens:
+        return text, estimate_tokens(text)
+
+    limit = max_tokens - _ELLIPSIS_TOKENS
+    used, end = 0, 0
+    for match in _PIECE_PATTERN.finditer(text):
+        cost = math.ceil(len(match.group()) / _CHARS_PER_TOKEN)
+        if used + cost > limit:
+            break
+        used += cost
+        end = match.end()
+    return text[:end] + _ELLIPSIS, used + _ELLIPSIS_TOKENS
+
+
+@dataclass
+class PackedContext:
+    """Contexto empaquetado y su costo en tokens"""
+    text: str
+    documents: List[Mapping[str, Any]]
+    tokens: int
+    budget: int
+    dropped: int = 0
+    truncated: List[int] = field(default_factory=list)
+
+
+class ContextPacker:
+    """
+    Arma el contexto del prompt sin exceder `budget_tokens`.
+
+    Cada documento aporta un bloque: etiqueta numerada + encabezado +
+    contenido (acotado a `max_snippet_tokens`) + pie. El costo en tokens de
+    cada bloque se mide y los bloques se eligen en orden de relevancia por
+    token mientras quepan (knapsack greedy). Si el siguiente bloque no cabe
+    y quedan al menos `min_snippet_tokens`, su contenido se recorta al espacio
+    restante. Los bloques elegidos se presentan en orden de relevancia.
+
+    El encabezado formateado y el contenido medido de cada documento se
+    guardan en una caché LRU por id de documento; `clear()` la invalida
+    cuando cambia el corpus.
+    """
+
+    def __init__(self, header_fn: HeaderFunction, label: str = "[Documento {n}]\n",
+                 separator: str = "\n", max_snippet_tokens: int = 512,
+                 min_snippet_tokens: int = 32, cache_size: int = 4096):
+        self.header_fn = header_fn
+        self.label = label
+        self.separator = separator
+        self.max_snippet_tokens = max_snippet_tokens
+        self.min_snippet_tokens = min_snippet_tokens
+        self.cache_size = cache_size
+
+        self._label_tokens = estimate_tokens(label.format(n=999))
+        self._separator_tokens = estimate_tokens(separator)
+        self._blocks: "OrderedDict[Hashable, Tuple[str, str, int, str, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._blocks.clear()
+
+    def pack(self, documents: Sequence[Mapping[str, Any]], budget_tokens: int,
+             relevance: Optional[Sequence[float]] = None) -> PackedContext:
+        """
+        Selecciona y formatea los documentos dentro del presupuesto.
+        `relevance` por defecto decrece con la posición (1, 1/2, 1/3, ...).
+        """
+        if relevance is None:
+            relevance = [1.0 / (rank + 1) for rank in range(len(documents))]
+
+        blocks = [self._block(doc) for doc in documents]
+        overhead = self._label_tokens + self._separator_tokens
+        costs = [frame + body_tokens + overhead for _, _, frame, _, body_tokens in blocks]
+
+        order = sorted(range(len(documents)), key=lambda i: (-relevance[i] / max(costs[i], 1), i))
+
+        selected: Dict[int, Tuple[str, int]] = {}
+        truncated = []
+        remaining = budget_tokens
+        for i in order:
+            prefix, suffix, frame, body, body_tokens = blocks[i]
+            if costs[i] <= remaining:
+                selected[i] = (body, costs[i])
+                remaining -= costs[i]
+            elif remaining - frame - overhead >= self.min_snippet_tokens:
+                # Relleno fraccional: el contenido se recorta al espacio restante
+                short_body, short_tokens = truncate_to_tokens(body, remaining - frame - overhead)
+                selected[i] = (short_body, frame + short_tokens + overhead)
+                remaining -= selected[i][1]
+                truncated.append(i)
+
+        ranked = sorted(selected, key=lambda i: (-relevance[i], i))
+        parts = [f"{self.label.format(n=n)}{blocks[i][0]}{selected[i][0]}{blocks[i][1]}"
+                 for n, i in enumerate(ranked, 1)]
+
+        return PackedContext(
+            text=self.separator.join(parts),
+            documents=[documents[i] for i in ranked],
+            tokens=budget_tokens - remaining,
+            budget=budget_tokens,
+            dropped=len(documents) - len(selected),
+            truncated=[ranked.index(i) for i in truncated]
+        )
+
+    def _block(self, doc: Mapping[str, Any]) -> Tuple[str, str, int, str, int]:
+        """(encabezado, pie, tokens de ambos, contenido acotado, tokens del contenido)"""
+        key = doc.get('id', doc.get('document_id'))
+        if key is not None:
+            with self._lock:
+                block = self._blocks.get(key)
+                if block is not None:
+                    self._blocks.move_to_end(key)
+                    return block
+
+        prefix, suffix = self.header_fn(doc)
+        body, body_tokens = truncate_to_tokens(doc.get('text', ''), self.max_snippet_tokens)
+        block = (prefix, suffix, estimate_tokens(prefix) + estimate_tokens(suffix), body, body_tokens)
+
+        if key is not None:
+            with self._lock:
+                self._blocks[key] = block
+                while len(self._blocks) > self.cache_size:
+                    self._blocks.popitem(last=False)
+        return block
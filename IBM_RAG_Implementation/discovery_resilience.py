@@ -0,0 +1,262 @@
+# Resiliencia de la búsqueda remota para DECODE-EV RAG
+# Solicitudes "hedged" tras el p95, circuit breaker y respaldo en un índice local léxico/vectorial
+
+import time
+import threading
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Deque, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from hybrid_retrieval import HybridRetriever
+from lexical_index import BM25Index
+from vector_index import DenseVectorIndex
+
+
+class LatencyTracker:
+    """Ventana deslizante de latencias exitosas; `percentile()` usa `default` hasta reunir `min_samples`"""
+
+    def __init__(self, window: int = 200, min_samples: int = 20, default: float = 1.0):
+        self.min_samples = min_samples
+        self.default = default
+        self._samples: Deque[float] = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def observe(self, latency: float) -> None:
+        with self._lock:
+            self._samples.append(latency)
+
+    def percentile(self, q: float = 95.0) -> float:
+        with self._lock:
+            if len(self._samples) < self.min_samples:
+                return self.default
+            return float(np.percentile(np.fromiter(self._samples, dtype=np.float64), q))
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker clásico de tres estados.
+
+    - closed: todas las llamadas pasan; `failure_threshold` fallos seguidos lo abren
+    - open: ninguna pasa hasta que transcurre `reset_timeout`
+    - half_open: deja pasar una sola llamada de prueba; si funciona se
+      cierra, si falla vuelve a abrirse
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.times_opened = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = self.CLOSED
+            self.consecutive_failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.consecutive_failures += 1
+            self._probe_in_flight = False
+            if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    self.times_opened += 1
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"state": self.state, "consecutive_failures": self.consecutive_failures,
+                    "times_opened": self.times_opened}
+
+
+class ResilientCaller:
+    """
+    Ejecuta una llamada remota con hedging, tiempo límite y circuit breaker.
+
+    Si la primera solicitud no respondió al cumplirse el p95 de las
+    latencias observadas, se envía una segunda idéntica y se usa la que
+    llegue primero (si una falla, se espera a la otra). Las solicitudes
+    síncronas del SDK no se pueden cancelar: la perdedora termina en segundo
+    plano y solo aporta su latencia a la ventana.
+
+    Cuando no hay respuesta válida dentro de `timeout`, o el breaker está
+    abierto, se responde con `fallback()`.
+    """
+
+    def __init__(self, breaker: Optional[CircuitBreaker] = None, latency: Optional[LatencyTracker] = None,
+                 timeout: Optional[float] = 10.0, hedge_percentile: float = 95.0,
+                 min_hedge_delay: float = 0.01, max_workers: int = 32, name: str = "discovery"):
+        self.breaker = breaker or CircuitBreaker()
+        self.latency = latency or LatencyTracker()
+        self.timeout = timeout
+        self.hedge_percentile = hedge_percentile
+        self.min_hedge_delay = min_hedge_delay
+
+        self.calls = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.fallbacks = 0
+        self.failures = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+
+    def call(self, primary: Callable[[], Any], fallback: Callable[[], Any]) -> Tuple[Any, str]:
+        """Resultado y su origen ("primary" o "fallback")"""
+        if not self.breaker.allow():
+            return self._fallback(fallback)
+
+        try:
+            result = self._hedged(primary)
+        except Exception:
+            self.breaker.record_failure()
+            with self._lock:
+                self.failures += 1
+            return self._fallback(fallback)
+
+        self.breaker.record_success()
+        return result, "primary"
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            calls = self.calls
+            stats = {
+                "calls": calls,
+                "hedged": self.hedged,
+                "hedge_rate": self.hedged / calls if calls else 0.0,
+                "hedge_wins": self.hedge_wins,
+                "failures": self.failures,
+                "fallbacks": self.fallbacks
+            }
+        stats["hedge_delay"] = max(self.min_hedge_delay, self.latency.percentile(self.hedge_percentile))
+        stats["breaker"] = self.breaker.stats()
+        return stats
+
+    def _fallback(self, fallback: Callable[[], Any]) -> Tuple[Any, str]:
+        with self._lock:
+            self.fallbacks += 1
+        return fallback(), "fallback"
+
+    def _attempt(self, primary: Callable[[], Any]) -> Future:
+        started = time.monotonic()
+        future = self._executor.submit(primary)
+
+        def observe(done: Future) -> None:
+            if not done.cancelled() and done.exception() is None:
+                self.latency.observe(time.monotonic() - started)
+
+        future.add_done_callback(observe)
+        return future
+
+    def _hedged(self, primary: Callable[[], Any]) -> Any:
+        with self._lock:
+            self.calls += 1
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        hedge_delay = max(self.min_hedge_delay, self.latency.percentile(self.hedge_percentile))
+
+        first = self._attempt(primary)
+        done, _ = wait([first], timeout=hedge_delay if deadline is None else min(hedge_delay, self.timeout))
+        if first in done and first.exception() is None:
+            return first.result()
+
+        # Sin respuesta (o con error) al cumplirse el p95: segunda solicitud
+        with self._lock:
+            self.hedged += 1
+        pending = {first, self._attempt(primary)} - done
+        error: Optional[BaseException] = first.exception() if first in done else None
+        while pending:
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                break
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is not first:
+                        with self._lock:
+                            self.hedge_wins += 1
+                    return future.result()
+                error = future.exception()
+
+        raise error or TimeoutError(f"Sin respuesta tras {self.timeout}s")
+
+
+class LocalFallbackIndex:
+    """
+    Índice local de documentos en formato Discovery para responder cuando
+    el servicio remoto no está disponible.
+
+    Siempre mantiene BM25 sobre `text`; si todos los documentos traen
+    embedding y hay `embed_query`, la búsqueda es híbrida (HybridRetriever).
+    Los documentos se deduplican por `document_id`.
+    """
+
+    def __init__(self, embed_query: Optional[Callable[[str], Sequence[float]]] = None,
+                 dimension: int = 768, semantic_weight: float = 0.7, keyword_weight: float = 0.3):
+        self.embed_query = embed_query
+        self.documents: List[Dict] = []
+        self.lexical_index = BM25Index()
+        self.dense_index = DenseVectorIndex(dimension)
+        self.retriever = HybridRetriever(self.lexical_index.search, self.dense_index.search,
+                                         semantic_weight=semantic_weight, keyword_weight=keyword_weight)
+        self._ids = set()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+    def add_documents(self, documents: List[Dict], embeddings: Optional[Sequence[Sequence[float]]] = None) -> int:
+        """Agrega documentos nuevos (y sus embeddings, alineados); retorna cuántos se agregaron"""
+        added = 0
+        with self._lock:
+            for i, doc in enumerate(documents):
+                if doc.get('document_id') in self._ids:
+                    continue
+                self._ids.add(doc.get('document_id'))
+                self.documents.append(dict(doc))
+                self.lexical_index.add_document(doc.get('text', ''))
+                if embeddings is not None and len(self.dense_index) == len(self.documents) - 1:
+                    self.dense_index.add([embeddings[i]])
+                added += 1
+        return added
+
+    def search(self, query: str, max_docs: int = 5) -> List[Dict]:
+        """Top documentos locales; `confidence` es el score relativo al mejor resultado"""
+        embedding = None
+        if self.embed_query is not None and len(self.dense_index) == len(self.documents) > 0:
+            embedding = self.embed_query(query)
+
+        with self._lock:
+            if embedding is not None and len(embedding) == self.dense_index.dimension \
+                    and len(self.dense_index) == len(self.documents):
+                self.retriever.max_results = max_docs
+                hits = self.retriever.search(query, embedding, top_k=max_docs)
+            else:
+                hits = self.lexical_index.search(query, top_k=max_docs)
+
+            best = hits[0][1] if hits and hits[0][1] > 0 else 1.0
+            results = []
+            for doc_id, score in hits:
+                doc = dict(self.documents[doc_id])
+                doc['confidence'] = float(score) / best
+                doc['metadata'] = {**doc.get('metadata', {}), 'retrieval_source': 'local_index'}
+                results.append(doc)
+            return results
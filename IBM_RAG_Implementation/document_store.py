@@ -0,0 +1,318 @@
+# Almacén columnar de documentos para DECODE-EV RAG
+# Struct-of-arrays: columnas NumPy, categóricas codificadas por diccionario y texto en un blob
+
+import numpy as np
+from typing import Any, Dict, Iterable, Iterator, List, Mapping, Optional, Tuple
+
+# Ámbitos de un campo: nivel documento o dentro de `metadata`
+DOC_SCOPE = "doc"
+METADATA_SCOPE = "metadata"
+
+_MISSING = object()
+
+
+class Column:
+    """
+    Columna tipada del almacén.
+    kind: "int" | "float" | "bool" | "category" | "object"
+    Para "category", `values` son códigos int32 y `categories` el diccionario.
+    `present` es None si todos los documentos tienen el campo.
+    """
+
+    __slots__ = ("name", "scope", "kind", "values", "categories", "present")
+
+    def __init__(self, name: str, scope: str, kind: str, values: Any,
+                 categories: Optional[List[Any]] = None, present: Optional[np.ndarray] = None):
+        self.name = name
+        self.scope = scope
+        self.kind = kind
+        self.values = values
+        self.categories = categories
+        self.present = present
+
+    def has(self, i: int) -> bool:
+        return self.present is None or bool(self.present[i])
+
+    def value(self, i: int) -> Any:
+        if self.kind == "category":
+            return self.categories[self.values[i]]
+        if self.kind == "object":
+            return self.values[i]
+        return self.values[i].item()
+
+
+def _infer_kind(values: List[Any]) -> str:
+    """Tipo de columna más compacto que representa todos los valores"""
+    if all(isinstance(v, bool) for v in values):
+        return "bool"
+    if all(isinstance(v, int) and not isinstance(v, bool) for v in values):
+        return "int"
+    if all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in values):
+        return "float"
+    if all(isinstance(v, str) for v in values):
+        return "category"
+    return "object"
+
+
+def _build_column(name: str, scope: str, raw: List[Any]) -> Column:
+    present_list = [v is not _MISSING for v in raw]
+    present = None if all(present_list) else np.array(present_list, dtype=bool)
+    values = [v for v in raw if v is not _MISSING]
+    kind = _infer_kind(values)
+
+    if kind == "category":
+        dictionary: Dict[str, int] = {}
+        codes = np.fromiter(
+            (dictionary.setdefault(v, len(dictionary)) if v is not _MISSING else 0 for v in raw),
+            dtype=np.int32, count=len(raw)
+        )
+        return Column(name, scope, kind, codes, list(dictionary), present)
+
+    if kind == "object":
+        return Column(name, scope, kind, [None if v is _MISSING else v for v in raw], None, present)
+
+    dtype = {"bool": np.bool_, "int": np.int64, "float": np.float64}[kind]
+    fill = dtype(0)
+    return Column(name, scope, kind, np.array([fill if v is _MISSING else v for v in raw], dtype=dtype),
+                  None, present)
+
+
+class ColumnarDocumentStore:
+    """
+    Almacén de documentos en formato columnar (struct-of-arrays).
+
+    - Campos numéricos (technical_density_score, complexity_score, word_count,
+      density_*, ...) como arreglos NumPy
+    - Campos de texto corto (red_can, evento_vehiculo, ...) codificados por
+      diccionario (códigos int32 + lista de categorías)
+    - El texto completo en un único blob UTF-8 con tabla de offsets
+
+    Se comporta como una secuencia de documentos: `store[i]` retorna un
+    DocumentView con la misma interfaz `.get()` que los dicts del JSONL.
+    """
+
+    def __init__(self, columns: Dict[Tuple[str, str], Column], text_blob: Any,
+                 text_offsets: np.ndarray, size: int):
+        self.columns = columns
+        self.text_blob = text_blob
+        self.text_offsets = text_offsets
+        self.size = size
+
+        # Orden de campos para reconstruir documentos
+        self.doc_fields = [name for (scope, name) in columns if scope == DOC_SCOPE]
+        self.metadata_fields = [name for (scope, name) in columns if scope == METADATA_SCOPE]
+
+    @classmethod
+    def from_documents(cls, documents: Iterable[Mapping[str, Any]]) -> "ColumnarDocumentStore":
+        """Construye el almacén desde documentos tipo dict (p. ej. líneas del JSONL)"""
+        raw: Dict[Tuple[str, str], List[Any]] = {}
+        texts: List[bytes] = []
+
+        for i, doc in enumerate(documents):
+            fields = [(DOC_SCOPE, k, v) for k, v in doc.items() if k not in ('text', 'metadata')]
+            fields += [(METADATA_SCOPE, k, v) for k, v in doc.get('metadata', {}).items()]
+
+            seen = set()
+            for scope, name, value in fields:
+                key = (scope, name)
+                seen.add(key)
+                if key not in raw:
+                    raw[key] = [_MISSING] * i
+                raw[key].append(value)
+            for key, column in raw.items():
+                if key not in seen:
+                    column.append(_MISSING)
+
+            texts.append(doc.get('text', '').encode('utf-8'))
+
+        offsets = np.zeros(len(texts) + 1, dtype=np.int64)
+        np.cumsum([len(t) for t in texts], out=offsets[1:])
+
+        columns = {key: _build_column(key[1], key[0], values) for key, values in raw.items()}
+        return cls(columns, b"".join(texts), offsets, len(texts))
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __getitem__(self, i: int) -> "DocumentView":
+        if i < 0:
+            i += self.size
+        if not 0 <= i < self.size:
+            raise IndexError(i)
+        return DocumentView(self, i)
+
+    def __iter__(self) -> Iterator["DocumentView"]:
+        for i in range(self.size):
+            yield DocumentView(self, i)
+
+    def text(self, i: int) -> str:
+        """Decodifica el texto del documento i desde el blob"""
+        start, end = self.text_offsets[i], self.text_offsets[i + 1]
+        return bytes(self.text_blob[start:end]).decode('utf-8')
+
+    def column(self, name: str, scope: Optional[str] = None) -> Optional[Column]:
+        """Columna por nombre (busca primero a nivel documento y luego en metadata)"""
+        scopes = (scope,) if scope else (DOC_SCOPE, METADATA_SCOPE)
+        for candidate in scopes:
+            column = self.columns.get((candidate, name))
+            if column is not None:
+                return column
+        return None
+
+    def numeric(self, name: str, default: float = 0.0) -> np.ndarray:
+        """Columna numérica como float64, con `default` donde falta el campo"""
+        column = self.column(name)
+        if column is None or column.kind not in ("int", "float", "bool"):
+            return np.full(self.size, default, dtype=np.float64)
+
+        values = column.values.astype(np.float64)
+        if column.present is not None:
+            values[~column.present] = default
+        return values
+
+    def value_counts(self, name: str, missing: Any = 'unknown',
+                     mask: Optional[np.ndarray] = None) -> Dict[Any, int]:
+        """Conteo por valor de una columna categórica (opcionalmente solo en `mask`)"""
+        selected = np.ones(self.size, dtype=bool) if mask is None else np.asarray(mask, dtype=bool)
+        column = self.column(name)
+        if column is None:
+            n_selected = int(selected.sum())
+            return {missing: n_selected} if n_selected else {}
+
+        present = selected if column.present is None else selected & column.present
+        if column.kind == "category":
+            counts = np.bincount(column.values[present], minlength=len(column.categories))
+            result = {category: int(count) for category, count in zip(column.categories, counts) if count}
+        else:
+            result = {}
+            for i in np.flatnonzero(present).tolist():
+                value = column.value(i)
+                result[value] = result.get(value, 0) + 1
+
+        n_missing = int((selected & ~present).sum())
+        if n_missing:
+            result[missing] = result.get(missing, 0) + n_missing
+        return result
+
+    def field(self, i: int, name: str, scope: str, default: Any = None) -> Any:
+        column = self.columns.get((scope, name))
+        if column is None or not column.has(i):
+            return default
+        return column.value(i)
+
+    def to_dict(self, i: int) -> Dict[str, Any]:
+        """Reconstruye el documento i como dict (mismo formato que el JSONL)"""
+        return DocumentView(self, i).to_dict()
+
+    def memory_usage(self) -> int:
+        """Bytes aproximados ocupados por columnas, diccionarios y texto"""
+        total = len(self.text_blob) + self.text_offsets.nbytes
+        for column in self.columns.values():
+            if isinstance(column.values, np.ndarray):
+                total += column.values.nbytes
+            if column.present is not None:
+                total += column.present.nbytes
+            if column.categories is not None:
+                total += sum(len(str(c)) + 49 for c in column.categories)
+        return total
+
+
+class MetadataView:
+    """Vista de solo lectura sobre la metadata de un documento del almacén"""
+
+    __slots__ = ("_store", "_index")
+
+    def __init__(self, store: ColumnarDocumentStore, index: int):
+        self._store = store
+        self._index = index
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self._store.field(self._index, key, METADATA_SCOPE, default)
+
+    def __getitem__(self, key: str) -> Any:
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key: str) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def keys(self) -> List[str]:
+        return [name for name in self._store.metadata_fields if name in self]
+
+    def items(self) -> List[Tuple[str, Any]]:
+        return [(name, self[name]) for name in self.keys()]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.keys())
+
+    def __len__(self) -> int:
+        return len(self.keys())
+
+    def __bool__(self) -> bool:
+        return len(self) > 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return dict(self.items())
+
+
+class DocumentView:
+    """
+    Vista liviana (__slots__) sobre un documento del almacén columnar.
+    Expone la misma interfaz de lectura que el dict original del JSONL.
+    """
+
+    __slots__ = ("_store", "_index")
+
+    def __init__(self, store: ColumnarDocumentStore, index: int):
+        self._store = store
+        self._index = index
+
+    @property
+    def index(self) -> int:
+        return self._index
+
+    def get(self, key: str, default: Any = None) -> Any:
+        if key == 'text':
+            return self._store.text(self._index)
+        if key == 'metadata':
+            return MetadataView(self._store, self._index)
+        return self._store.field(self._index, key, DOC_SCOPE, default)
+
+    def __getitem__(self, key: str) -> Any:
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key: str) -> bool:
+        return key in ('text', 'metadata') or self.get(key, _MISSING) is not _MISSING
+
+    def keys(self) -> List[str]:
+        return [name for name in self._store.doc_fields if name in self] + ['text', 'metadata']
+
+    def items(self) -> List[Tuple[str, Any]]:
+        return [(name, self[name]) for name in self.keys()]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.keys())
+
+    def __len__(self) -> int:
+        return len(self.keys())
+
+    def to_dict(self) -> Dict[str, Any]:
+        doc = {name: self[name] for name in self._store.doc_fields if name in self}
+        doc['text'] = self.get('text')
+        doc['metadata'] = self.get('metadata').to_dict()
+        return doc
+
+    def __eq__(self, other: Any) -> bool:
+        if isinstance(other, DocumentView):
+            return self._store is other._store and self._index == other._index
+        if isinstance(other, Mapping):
+            return self.to_dict() == dict(other)
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f"DocumentView({self.get('id', self._index)!r})"
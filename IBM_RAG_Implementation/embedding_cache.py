@@ -0,0 +1,222 @@
+# Caché persistente de embeddings para DECODE-EV RAG
+# Direccionada por contenido: hash(model_id, texto normalizado) -> fila de una matriz float32 mapeada en memoria
+
+import os
+import re
+import json
+import hashlib
+import logging
+import threading
+import unicodedata
+import contextlib
+import numpy as np
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Union
+
+# Bloqueo entre procesos (POSIX); sin fcntl solo se serializan los hilos del proceso
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+DIGEST_SIZE = hashlib.sha256().digest_size
+
+# Función que calcula embeddings para una lista de textos (p. ej. llamada a Slate)
+EmbedFunction = Callable[[List[str]], Sequence[Sequence[float]]]
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_text(text: str) -> str:
+    """Normalización previa al hash: Unicode NFC y espacios colapsados"""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+class EmbeddingCache:
+    """
+    Caché de embeddings en disco, un juego de archivos por modelo:
+
+    - `<modelo>.f32`:  matriz float32 (filas x dimensión), solo se agregan filas
+    - `<modelo>.keys`: digest SHA-256 de cada fila, en el mismo orden
+    - `<modelo>.json`: modelo y dimensión
+    - `<modelo>.lock`: bloqueo de escritura compartido entre procesos
+
+    La matriz se lee con np.memmap y el índice hash -> fila se reconstruye
+    desde `.keys` al abrir. Varias instancias (y procesos) pueden compartir
+    el directorio: cada escritura toma el bloqueo, incorpora las filas que
+    otros agregaron y escribe al final real de los archivos. Si un proceso
+    se interrumpe a mitad de una escritura, las filas incompletas se descartan.
+    """
+
+    def __init__(self, directory: Union[str, Path], model_id: str):
+        self.directory = Path(directory)
+        self.model_id = model_id
+
+        slug = re.sub(r"[^A-Za-z0-9._-]+", "_", model_id)
+        self.vectors_path = self.directory / f"{slug}.f32"
+        self.keys_path = self.directory / f"{slug}.keys"
+        self.meta_path = self.directory / f"{slug}.json"
+        self.lock_path = self.directory / f"{slug}.lock"
+
+        self.dimension: Optional[int] = None
+        self.hits = 0
+        self.misses = 0
+        self._index: Dict[bytes, int] = {}
+        self._rows = 0
+        self._matrix: Optional[np.ndarray] = None
+        self._lock = threading.Lock()
+        self._load()
+
+    def __len__(self) -> int:
+        return self._rows
+
+    def key(self, text: str) -> bytes:
+        """Clave direccionada por contenido del texto para este modelo"""
+        return hashlib.sha256(f"{self.model_id}\0{normalize_text(text)}".encode("utf-8")).digest()
+
+    def get_or_compute(self, texts: Sequence[str], embed: EmbedFunction) -> np.ndarray:
+        """
+        Retorna la matriz de embeddings (len(texts) x dimensión).
+        Consulta la caché para todo el lote y solo envía a `embed` los textos
+        ausentes (una vez cada uno, aunque se repitan en el lote).
+        """
+        digests = [self.key(text) for text in texts]
+
+        with self._lock:
+            rows = np.fromiter((self._index.get(d, -1) for d in digests), dtype=np.int64, count=len(digests))
+
+        missing: Dict[bytes, int] = {}
+        for i in np.flatnonzero(rows < 0).tolist():
+            missing.setdefault(digests[i], i)
+
+        self.hits += len(digests) - int(np.count_nonzero(rows < 0))
+        self.misses += len(missing)
+
+        new_vectors = None
+        if missing:
+            new_vectors = np.asarray(embed([texts[i] for i in missing.values()]), dtype=np.float32)
+            if new_vectors.ndim != 2 or new_vectors.shape[0] != len(missing):
+                raise ValueError(f"Se esperaban {len(missing)} embeddings, se recibieron {len(new_vectors)}")
+            self._store(list(missing), new_vectors)
+
+        dimension = new_vectors.shape[1] if new_vectors is not None else self.dimension or 0
+        result = np.empty((len(digests), dimension), dtype=np.float32)
+
+        cached = np.flatnonzero(rows >= 0)
+        if cached.size:
+            result[cached] = self._matrix[rows[cached]]
+        if missing:
+            new_rows = {digest: row for row, digest in enumerate(missing)}
+            uncached = np.flatnonzero(rows < 0)
+            result[uncached] = new_vectors[[new_rows[digests[i]] for i in uncached.tolist()]]
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "model_id": self.model_id,
+            "entries": self._rows,
+            "dimension": self.dimension,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0
+        }
+
+    def _load(self) -> None:
+        if not self.meta_path.exists():
+            return
+        try:
+            meta = json.loads(self.meta_path.read_text(encoding="utf-8"))
+            if meta.get("model_id") != self.model_id:
+                return
+
+            self.dimension = int(meta["dimension"])
+            n_keys = self.keys_path.stat().st_size // DIGEST_SIZE if self.keys_path.exists() else 0
+            n_vectors = self.vectors_path.stat().st_size // (4 * self.dimension) if self.vectors_path.exists() else 0
+            self._rows = min(n_keys, n_vectors)
+
+            with open(self.keys_path, "rb") as f:
+                keys = f.read(self._rows * DIGEST_SIZE)
+            self._index = {keys[i * DIGEST_SIZE:(i + 1) * DIGEST_SIZE]: i for i in range(self._rows)}
+            self._remap()
+
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"⚠️ Caché de embeddings ilegible, se ignora: {e}")
+            self.dimension, self._index, self._rows, self._matrix = None, {}, 0, None
+
+    def _remap(self) -> None:
+        self._matrix = (np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(self._rows, self.dimension))
+                        if self._rows else None)
+
+    @contextlib.contextmanager
+    def _file_lock(self) -> Iterator[None]:
+        """Bloqueo exclusivo del juego de archivos del modelo (entre procesos)"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with open(self.lock_path, "a+b") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def _sync_from_disk(self) -> None:
+        """
+        Incorpora las filas que otros escritores agregaron y descarta filas
+        incompletas (llamar con el bloqueo de archivo tomado)
+        """
+        n_keys = self.keys_path.stat().st_size // DIGEST_SIZE if self.keys_path.exists() else 0
+        n_vectors = self.vectors_path.stat().st_size // (4 * self.dimension) if self.vectors_path.exists() else 0
+        rows = min(n_keys, n_vectors)
+
+        for path, size in ((self.vectors_path, rows * self.dimension * 4), (self.keys_path, rows * DIGEST_SIZE)):
+            if path.exists() and path.stat().st_size != size:
+                os.truncate(path, size)
+
+        if rows < self._rows:
+            # Los archivos fueron reemplazados: reconstruir el índice completo
+            self._index, self._rows = {}, 0
+        if rows > self._rows:
+            with open(self.keys_path, "rb") as f:
+                f.seek(self._rows * DIGEST_SIZE)
+                keys = f.read((rows - self._rows) * DIGEST_SIZE)
+            for i in range(rows - self._rows):
+                self._index.setdefault(keys[i * DIGEST_SIZE:(i + 1) * DIGEST_SIZE], self._rows + i)
+        self._rows = rows
+
+    def _store(self, digests: List[bytes], vectors: np.ndarray) -> None:
+        """Agrega filas a la caché; si el disco no es escribible solo se registra una advertencia"""
+        with self._lock:
+            try:
+                with self._file_lock():
+                    if self.meta_path.exists():
+                        meta = json.loads(self.meta_path.read_text(encoding="utf-8"))
+                        self.dimension = int(meta["dimension"])
+                    else:
+                        self.dimension = int(vectors.shape[1])
+                        tmp_path = self.meta_path.with_name(self.meta_path.name + f".tmp{os.getpid()}")
+                        tmp_path.write_text(json.dumps({"model_id": self.model_id, "dimension": self.dimension}),
+                                            encoding="utf-8")
+                        os.replace(tmp_path, self.meta_path)
+
+                    if vectors.shape[1] != self.dimension:
+                        raise ValueError(f"Dimensión {vectors.shape[1]} distinta a la de la caché ({self.dimension})")
+
+                    self._sync_from_disk()
+
+                    # Solo las filas que ningún otro escritor agregó entretanto
+                    new = [i for i, digest in enumerate(digests) if digest not in self._index]
+                    if new:
+                        with open(self.vectors_path, "ab") as f:
+                            f.write(np.ascontiguousarray(vectors[new], dtype=np.float32).tobytes())
+                        with open(self.keys_path, "ab") as f:
+                            f.write(b"".join(digests[i] for i in new))
+
+                        for i in new:
+                            self._index[digests[i]] = self._rows
+                            self._rows += 1
+                    self._remap()
+
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning(f"⚠️ No se pudo guardar en la caché de embeddings: {e}")
@@ -0,0 +1,170 @@
+# Servidor local que imita los endpoints de IBM usados por DECODE-EV RAG
+# Permite probar los clientes HTTP (IAM, Discovery y watsonx.ai) sin credenciales ni red
+
+import sys
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional
+from urllib.parse import urlparse
+
+# Respuesta por defecto: fragmentos fijos de una respuesta técnica corta
+DEFAULT_CHUNKS = ["📊 Análisis", " de voltaje:", " la red CAN_CUSTOM_31", " reporta 24.5 V", " en carga."]
+
+# Resultados de Discovery por defecto (formato v2 query)
+DEFAULT_DISCOVERY_RESULTS = [
+    {
+        "document_id": f"decode_ev_{i:06d}",
+        "title": f"Evento CAN {i}",
+        "text": f"Voltaje del paquete de baterías en {24 + i * 0.5:.1f} V durante la carga en red CAN_CUSTOM_31.",
+        "metadata": {"red_can": "CAN_CUSTOM_31", "document_type": "evento_can"},
+        "result_metadata": {"confidence": 0.9 - i * 0.1},
+        "highlight": {"text": [f"<em>Voltaje</em> en {24 + i * 0.5:.1f} V"]}
+    }
+    for i in range(5)
+]
+
+
+class _StubHTTPServer(ThreadingHTTPServer):
+    # Cola de conexiones amplia: las pruebas abren cientos de conexiones a la vez
+    request_queue_size = 512
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clientes que cancelan a mitad de respuesta (timeouts de las pruebas)
+        if not isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            super().handle_error(request, client_address)
+
+
+class FakeWatsonServer:
+    """
+    Servidor HTTP/1.1 en 127.0.0.1 (puerto libre) con:
+    - POST /identity/token: token IAM ficticio
+    - POST /ml/v1/text/generation: respuesta completa
+    - POST /ml/v1/text/generation_stream: Server-Sent Events, un evento por
+      fragmento con `chunk_delay` segundos entre eventos (chunked encoding)
+    - POST /v2/projects/{id}/query: búsqueda de Watson Discovery, retorna los
+      primeros `count` de `discovery_results`
+
+    `responder(payload)` decide los fragmentos a partir del cuerpo JSON de la
+    solicitud; `latency` retrasa cada respuesta de Discovery y de generación.
+    Cada solicitud queda registrada en `requests` (ruta, cuerpo) y cada
+    conexión TCP aceptada suma uno a `connections` (keep-alive reutiliza la
+    misma). Se usa como context manager.
+    """
+
+    def __init__(self, responder: Optional[Callable[[Dict], List[str]]] = None,
+                 chunk_delay: float = 0.0, first_chunk_delay: Optional[float] = None,
+                 discovery_results: Optional[List[Dict]] = None, latency: float = 0.0):
+        self.responder = responder or (lambda payload: list(DEFAULT_CHUNKS))
+        self.chunk_delay = chunk_delay
+        self.first_chunk_delay = chunk_delay if first_chunk_delay is None else first_chunk_delay
+        self.discovery_results = DEFAULT_DISCOVERY_RESULTS if discovery_results is None else discovery_results
+        self.latency = latency
+        self.requests: List[Dict] = []
+        self.connections = 0
+        self._lock = threading.Lock()
+        self._server = _StubHTTPServer(("127.0.0.1", 0), self._handler_class())
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def iam_url(self) -> str:
+        return f"{self.url}/identity/token"
+
+    def start(self) -> "FakeWatsonServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake_watson", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "FakeWatsonServer":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    def _record(self, path: str, body) -> None:
+        with self._lock:
+            self.requests.append({"path": path, "body": body})
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def setup(self):
+                super().setup()
+                with server._lock:
+                    server.connections += 1
+
+            def do_POST(self):
+                path = urlparse(self.path).path
+                raw = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+                if path == "/identity/token":
+                    server._record(path, raw.decode("utf-8"))
+                    self._send_json({"access_token": "fake-token", "token_type": "Bearer",
+                                     "expires_in": 3600, "expiration": int(time.time()) + 3600})
+                    return
+
+                payload = json.loads(raw or b"{}")
+                server._record(path, payload)
+                if self.headers.get("Authorization") != "Bearer fake-token":
+                    self._send_json({"errors": [{"code": "authentication_token_not_valid"}]}, status=401)
+                    return
+
+                time.sleep(server.latency)
+                if path.startswith("/v2/projects/") and path.endswith("/query"):
+                    results = server.discovery_results[:payload.get("count", 10)]
+                    self._send_json({"matching_results": len(results), "results": results})
+                elif path == "/ml/v1/text/generation":
+                    text = "".join(server.responder(payload))
+                    self._send_json({"model_id": payload.get("model_id"),
+                                     "results": [{"generated_text": text, "stop_reason": "eos_token"}]})
+                elif path == "/ml/v1/text/generation_stream":
+                    self._send_stream(payload)
+                else:
+                    self._send_json({"errors": [{"code": "not_found"}]}, status=404)
+
+            def _send_json(self, body: Dict, status: int = 200):
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _send_stream(self, payload: Dict):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+
+                chunks = server.responder(payload)
+                for i, chunk in enumerate(chunks, 1):
+                    time.sleep(server.first_chunk_delay if i == 1 else server.chunk_delay)
+                    result = {"generated_text": chunk,
+                              "stop_reason": "eos_token" if i == len(chunks) else "not_finished"}
+                    event = (f"id: {i}\nevent: message\ndata: "
+                             f"{json.dumps({'model_id': payload.get('model_id'), 'results': [result]})}\n\n")
+                    self._write_chunk(event.encode("utf-8"))
+                self._write_chunk(b"")
+
+            def _write_chunk(self, data: bytes):
+                self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+                self.wfile.flush()
+
+        return Handler
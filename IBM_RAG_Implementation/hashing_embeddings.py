@@ -0,0 +1,130 @@
+# Backend local de embeddings para DECODE-EV RAG
+# Feature hashing determinista de n-gramas de palabras y caracteres (sin acceso a watsonx)
+
+import zlib
+import numpy as np
+from typing import List, Sequence, Tuple
+
+from lexical_index import tokenize
+
+_PRIME = np.uint64(1099511628211)
+_MIX_1 = np.uint64(0xFF51AFD7ED558CCD)
+_MIX_2 = np.uint64(0xC4CEB9FE1A85EC53)
+_SHIFT = np.uint64(33)
+_SIGN_SHIFT = np.uint64(63)
+_WORD_SALT = np.uint64(0x9E3779B97F4A7C15)
+
+
+def _mix(hashes: np.ndarray) -> np.ndarray:
+    """Finalizador tipo murmur3 para repartir los bits del hash"""
+    hashes = hashes ^ (hashes >> _SHIFT)
+    hashes = hashes * _MIX_1
+    hashes = hashes ^ (hashes >> _SHIFT)
+    hashes = hashes * _MIX_2
+    return hashes ^ (hashes >> _SHIFT)
+
+
+class HashingEmbedder:
+    """
+    Embeddings deterministas por feature hashing (hashing trick).
+
+    Cada texto se pliega (minúsculas, sin tildes, sin stopwords) y se
+    representa con:
+    - n-gramas de palabras (unigramas y bigramas)
+    - n-gramas de caracteres sobre las palabras con bordes (" carga ")
+
+    Cada n-grama cae en una de `dimension` posiciones con signo ±1 según su
+    hash. Los hashes de caracteres se calculan para todo el lote a la vez
+    (hash polinomial con NumPy) y la matriz densa se arma con np.bincount.
+    El resultado está normalizado L2, por lo que el coseno es un producto punto.
+    """
+
+    def __init__(self, dimension: int = 768, word_ngrams: Tuple[int, ...] = (1, 2),
+                 char_ngrams: Tuple[int, ...] = (3, 4, 5), word_weight: float = 0.6,
+                 char_weight: float = 0.4, batch_size: int = 1024):
+        self.dimension = dimension
+        self.word_ngrams = word_ngrams
+        self.char_ngrams = char_ngrams
+        self.word_weight = word_weight
+        self.char_weight = char_weight
+        self.batch_size = batch_size
+
+    @property
+    def model_id(self) -> str:
+        return f"local/hashing-{self.dimension}"
+
+    def calculate_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """Misma interfaz que DecodeEVWatsonRAG.calculate_embeddings"""
+        return self.embed(texts).tolist()
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        """Matriz float32 (len(texts) x dimension) con filas normalizadas L2"""
+        blocks = [self._embed_block(texts[start:start + self.batch_size])
+                  for start in range(0, len(texts), self.batch_size)]
+        if not blocks:
+            return np.empty((0, self.dimension), dtype=np.float32)
+        return np.vstack(blocks)
+
+    def _embed_block(self, texts: Sequence[str]) -> np.ndarray:
+        token_lists = [tokenize(text) for text in texts]
+
+        word_rows, word_hashes = self._word_features(token_lists)
+        char_rows, char_hashes = self._char_features(token_lists)
+
+        embeddings = (self.word_weight * self._densify(len(texts), word_rows, word_hashes) +
+                      self.char_weight * self._densify(len(texts), char_rows, char_hashes))
+        return self._normalize(embeddings).astype(np.float32)
+
+    def _word_features(self, token_lists: List[List[str]]) -> Tuple[np.ndarray, np.ndarray]:
+        rows, hashes = [], []
+        for row, tokens in enumerate(token_lists):
+            for n in self.word_ngrams:
+                for i in range(len(tokens) - n + 1):
+                    rows.append(row)
+                    hashes.append(zlib.crc32(" ".join(tokens[i:i + n]).encode("utf-8")))
+
+        hashes = np.asarray(hashes, dtype=np.uint64) ^ _WORD_SALT
+        return np.asarray(rows, dtype=np.int64), _mix(hashes)
+
+    def _char_features(self, token_lists: List[List[str]]) -> Tuple[np.ndarray, np.ndarray]:
+        # Todo el lote en un único buffer de bytes; los n-gramas que cruzan
+        # el límite entre dos textos se descartan
+        encoded = [f" {' '.join(tokens)} ".encode("utf-8") if tokens else b"" for tokens in token_lists]
+        lengths = np.fromiter((len(e) for e in encoded), dtype=np.int64, count=len(encoded))
+        codes = np.frombuffer(b"".join(encoded), dtype=np.uint8).astype(np.uint64)
+        row_of = np.repeat(np.arange(len(encoded)), lengths)
+        ends = np.cumsum(lengths)
+
+        rows, hashes = [], []
+        for n in self.char_ngrams:
+            count = codes.size - n + 1
+            if count <= 0:
+                continue
+
+            ngram_hashes = np.full(count, n, dtype=np.uint64)
+            for j in range(n):
+                ngram_hashes = ngram_hashes * _PRIME + codes[j:j + count]
+
+            ngram_rows = row_of[:count]
+            valid = np.arange(count) + n <= ends[ngram_rows]
+            rows.append(ngram_rows[valid])
+            hashes.append(ngram_hashes[valid])
+
+        if not rows:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.uint64)
+        return np.concatenate(rows), _mix(np.concatenate(hashes))
+
+    def _densify(self, n_rows: int, rows: np.ndarray, hashes: np.ndarray) -> np.ndarray:
+        """Acumula (fila, hash) en una matriz densa normalizada por fila"""
+        buckets = (hashes % np.uint64(self.dimension)).astype(np.int64)
+        signs = np.where((hashes >> _SIGN_SHIFT) == 1, -1.0, 1.0)
+
+        dense = np.bincount(rows * self.dimension + buckets, weights=signs,
+                            minlength=n_rows * self.dimension).reshape(n_rows, self.dimension)
+        return self._normalize(dense)
+
+    @staticmethod
+    def _normalize(matrix: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
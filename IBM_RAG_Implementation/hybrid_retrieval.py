@@ -0,0 +1,130 @@
+# Retrieval híbrido (léxico + semántico) para DECODE-EV RAG
+# Fusión vectorizada de BM25 y búsqueda densa según semantic_weight/keyword_weight
+
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Sequence, Tuple
+
+from vector_index import top_k_indices
+
+# Firmas de las búsquedas que se fusionan: (consulta, top_k, máscara de candidatos)
+LexicalSearch = Callable[[str, int, Optional[np.ndarray]], List[Tuple[int, float]]]
+DenseSearch = Callable[[Sequence[float], int, Optional[np.ndarray]], Tuple[np.ndarray, np.ndarray]]
+DenseSearchBatch = Callable[[np.ndarray, int, Optional[np.ndarray]], Tuple[np.ndarray, np.ndarray]]
+
+
+def min_max_normalize(scores: np.ndarray) -> np.ndarray:
+    """Escala scores a [0, 1]; si todos son iguales (y positivos) valen 1"""
+    if scores.size == 0:
+        return scores
+    low, high = scores.min(), scores.max()
+    if high > low:
+        return (scores - low) / (high - low)
+    return np.full_like(scores, 1.0 if high > 0 else 0.0)
+
+
+class HybridRetriever:
+    """
+    Ejecuta la búsqueda léxica y la densa en paralelo y fusiona sus
+    resultados sobre la unión de candidatos con operaciones NumPy.
+
+    Fusiones disponibles:
+    - "weighted": normalización min-max por fuente y suma ponderada
+    - "rrf": reciprocal rank fusion ponderada (w / (rrf_k + rank))
+    """
+
+    def __init__(self, lexical_search: LexicalSearch, dense_search: DenseSearch,
+                 semantic_weight: float = 0.7, keyword_weight: float = 0.3,
+                 min_score: float = 0.0, max_results: int = 10,
+                 fusion: str = "weighted", rrf_k: int = 60, candidate_multiplier: int = 3,
+                 dense_search_batch: Optional[DenseSearchBatch] = None):
+        if fusion not in ("weighted", "rrf"):
+            raise ValueError(f"Fusión no soportada: {fusion}")
+
+        self.lexical_search = lexical_search
+        self.dense_search = dense_search
+        self.dense_search_batch = dense_search_batch
+        self.semantic_weight = semantic_weight
+        self.keyword_weight = keyword_weight
+        self.min_score = min_score
+        self.max_results = max_results
+        self.fusion = fusion
+        self.rrf_k = rrf_k
+        self.candidate_multiplier = candidate_multiplier
+
+        # BLAS libera el GIL, por lo que ambas búsquedas se solapan
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="hybrid_retrieval")
+
+    def search(self, query_text: str, query_embedding: Sequence[float],
+               top_k: Optional[int] = None, mask: Optional[np.ndarray] = None) -> List[Tuple[int, float]]:
+        """
+        Retorna hasta min(top_k, max_results) pares (doc_id, score fusionado)
+        con score >= min_score, ordenados de mayor a menor.
+        Si se entrega `mask`, ambas búsquedas solo puntúan esos documentos.
+        """
+        limit = min(top_k or self.max_results, self.max_results)
+        depth = limit * self.candidate_multiplier
+
+        lexical_future = self._executor.submit(self.lexical_search, query_text, depth, mask)
+        dense_ids, dense_scores = self.dense_search(query_embedding, depth, mask)
+        lexical_hits = lexical_future.result()
+
+        return self.fuse(*self._hits_to_arrays(lexical_hits),
+                         np.asarray(dense_ids, dtype=np.int64), np.asarray(dense_scores, dtype=np.float32),
+                         limit)
+
+    def search_batch(self, query_texts: Sequence[str], query_embeddings: np.ndarray,
+                     top_k: Optional[int] = None, mask: Optional[np.ndarray] = None) -> List[List[Tuple[int, float]]]:
+        """
+        Variante por lotes de `search` (mismos filtros para todas las consultas).
+        Las búsquedas léxicas corren en el pool mientras la parte densa se
+        resuelve con una sola multiplicación matricial (`dense_search_batch`).
+        """
+        limit = min(top_k or self.max_results, self.max_results)
+        depth = limit * self.candidate_multiplier
+
+        lexical_futures = [self._executor.submit(self.lexical_search, text, depth, mask) for text in query_texts]
+        if self.dense_search_batch is not None:
+            dense_ids, dense_scores = self.dense_search_batch(np.asarray(query_embeddings, dtype=np.float32), depth, mask)
+        else:
+            rows = [self.dense_search(embedding, depth, mask) for embedding in query_embeddings]
+            dense_ids, dense_scores = [row[0] for row in rows], [row[1] for row in rows]
+
+        results = []
+        for row, future in enumerate(lexical_futures):
+            ids = np.asarray(dense_ids[row], dtype=np.int64)
+            scores = np.asarray(dense_scores[row], dtype=np.float32)
+            # Los índices aproximados rellenan con -1 cuando hay menos de `depth` resultados
+            valid = ids >= 0
+            results.append(self.fuse(*self._hits_to_arrays(future.result()), ids[valid], scores[valid], limit))
+        return results
+
+    @staticmethod
+    def _hits_to_arrays(hits: List[Tuple[int, float]]) -> Tuple[np.ndarray, np.ndarray]:
+        ids = np.fromiter((doc_id for doc_id, _ in hits), dtype=np.int64, count=len(hits))
+        scores = np.fromiter((score for _, score in hits), dtype=np.float32, count=len(hits))
+        return ids, scores
+
+    def fuse(self, lexical_ids: np.ndarray, lexical_scores: np.ndarray,
+             dense_ids: np.ndarray, dense_scores: np.ndarray, limit: int) -> List[Tuple[int, float]]:
+        """Fusiona dos listas de resultados (ordenadas por score) sobre la unión de ids"""
+        union = np.union1d(lexical_ids, dense_ids)
+        if union.size == 0:
+            return []
+
+        if self.fusion == "rrf":
+            lexical_part = self.keyword_weight / (self.rrf_k + 1.0 + np.arange(lexical_ids.size))
+            dense_part = self.semantic_weight / (self.rrf_k + 1.0 + np.arange(dense_ids.size))
+        else:
+            lexical_part = self.keyword_weight * min_max_normalize(lexical_scores)
+            dense_part = self.semantic_weight * min_max_normalize(dense_scores)
+
+        fused = np.zeros(union.size, dtype=np.float32)
+        fused[np.searchsorted(union, lexical_ids)] += lexical_part
+        fused[np.searchsorted(union, dense_ids)] += dense_part
+
+        top = top_k_indices(fused, limit)
+        if self.fusion == "weighted":
+            # min_score está en la escala [0, 1] de la fusión ponderada
+            top = top[fused[top] >= self.min_score]
+        return [(int(union[i]), float(fused[i])) for i in top]
@@ -0,0 +1,228 @@
+# Actualización incremental de índices para DECODE-EV RAG
+# Segmento base inmutable + segmento delta + tombstones, con merge en segundo plano
+
+import threading
+import numpy as np
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Mapping, Optional, Sequence
+
+from document_store import ColumnarDocumentStore, DocumentView
+from metadata_filters import BitmapIndex
+
+
+def document_key(doc: Mapping[str, Any]) -> Optional[str]:
+    """Identificador estable de un documento (`id` o `document_id`)"""
+    return doc.get('id', doc.get('document_id'))
+
+
+def _as_dict(doc: Mapping[str, Any]) -> Dict[str, Any]:
+    return doc.to_dict() if hasattr(doc, "to_dict") else dict(doc)
+
+
+def compaction_map(live: np.ndarray) -> np.ndarray:
+    """Posición anterior -> posición tras el merge (-1 si el documento no sobrevive)"""
+    mapping = np.full(live.size, -1, dtype=np.int64)
+    mapping[live] = np.arange(int(live.sum()))
+    return mapping
+
+
+def should_merge(n_delta: int, n_total: int, n_deleted: int,
+                 max_delta: int = 1000, max_tombstone_ratio: float = 0.2) -> bool:
+    """Política de merge: delta demasiado grande o demasiados tombstones"""
+    if n_delta >= max_delta:
+        return True
+    return n_total > 0 and n_deleted / n_total >= max_tombstone_ratio
+
+
+class SegmentedDocumentStore:
+    """
+    Vista única sobre el almacén base (columnar, posiblemente mapeado en
+    memoria) y un segmento delta con los documentos agregados después.
+
+    Las posiciones son globales: [0, base_size) en la base y el resto en el
+    delta. Borrar o reemplazar un documento solo marca un tombstone hasta el
+    siguiente merge; `len()` cuenta todas las posiciones y la iteración
+    omite los documentos borrados.
+    """
+
+    def __init__(self, base: Optional[ColumnarDocumentStore] = None):
+        self.base = base if base is not None else ColumnarDocumentStore.from_documents([])
+        self.delta_documents: List[Dict[str, Any]] = []
+        self.delta = ColumnarDocumentStore.from_documents([])
+        self.deleted = np.zeros(len(self.base), dtype=bool)
+        self._positions: Optional[Dict[Any, int]] = None
+
+    @property
+    def base_size(self) -> int:
+        return len(self.base)
+
+    @property
+    def live_mask(self) -> np.ndarray:
+        return ~self.deleted
+
+    @property
+    def live_count(self) -> int:
+        return int(self.deleted.size - np.count_nonzero(self.deleted))
+
+    def __len__(self) -> int:
+        return self.deleted.size
+
+    def __getitem__(self, i: int) -> DocumentView:
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        if i < self.base_size:
+            return self.base[i]
+        return self.delta[i - self.base_size]
+
+    def __iter__(self) -> Iterator[DocumentView]:
+        for i in np.flatnonzero(~self.deleted):
+            yield self[int(i)]
+
+    def text(self, i: int) -> str:
+        if i < self.base_size:
+            return self.base.text(i)
+        return self.delta.text(i - self.base_size)
+
+    def to_dict(self, i: int) -> Dict[str, Any]:
+        return self[i].to_dict()
+
+    def numeric(self, name: str, default: float = 0.0) -> np.ndarray:
+        """Columna numérica sobre todas las posiciones (base + delta)"""
+        return np.concatenate([self.base.numeric(name, default), self.delta.numeric(name, default)])
+
+    def value_counts(self, name: str, missing: Any = 'unknown') -> Dict[Any, int]:
+        """Conteo por valor de los documentos vigentes"""
+        live = self.live_mask
+        counts = self.base.value_counts(name, missing, mask=live[:self.base_size])
+        for value, count in self.delta.value_counts(name, missing, mask=live[self.base_size:]).items():
+            counts[value] = counts.get(value, 0) + count
+        return counts
+
+    def memory_usage(self) -> int:
+        return self.base.memory_usage() + self.delta.memory_usage() + self.deleted.nbytes
+
+    def append(self, documents: Iterable[Mapping[str, Any]]) -> np.ndarray:
+        """Agrega documentos al segmento delta y retorna sus posiciones"""
+        documents = [_as_dict(doc) for doc in documents]
+        positions = self._index_positions()
+        start = len(self)
+
+        self.delta_documents.extend(documents)
+        # El delta es pequeño (lo acota la política de merge): reconstruirlo es barato
+        self.delta = ColumnarDocumentStore.from_documents(self.delta_documents)
+        self.deleted = np.concatenate([self.deleted, np.zeros(len(documents), dtype=bool)])
+
+        for offset, doc in enumerate(documents):
+            key = document_key(doc)
+            if key is not None:
+                positions[key] = start + offset
+        return np.arange(start, start + len(documents))
+
+    def delete(self, positions: Sequence[int]) -> None:
+        """Marca tombstones en las posiciones indicadas"""
+        positions = np.asarray(positions, dtype=np.int64)
+        if positions.size == 0:
+            return
+
+        self.deleted[positions] = True
+        if self._positions is not None:
+            for i in positions.tolist():
+                key = document_key(self[i])
+                if self._positions.get(key) == i:
+                    del self._positions[key]
+
+    def positions(self, keys: Iterable[Any]) -> List[int]:
+        """Posiciones vigentes de los documentos con esos ids (se omiten los desconocidos)"""
+        index = self._index_positions()
+        return [index[key] for key in keys if key in index]
+
+    def _index_positions(self) -> Dict[Any, int]:
+        # Mapa id -> posición, construido una sola vez al primer cambio incremental
+        if self._positions is None:
+            self._positions = {}
+            for i in np.flatnonzero(~self.deleted).tolist():
+                key = document_key(self[i])
+                if key is not None:
+                    self._positions[key] = i
+        return self._positions
+
+
+class SegmentedBitmapIndex:
+    """
+    BitmapIndex del segmento base + BitmapIndex del segmento delta.
+    Las máscaras de ambos segmentos se concatenan, por lo que comparten el
+    espacio de posiciones de SegmentedDocumentStore.
+    """
+
+    def __init__(self, base: Optional[BitmapIndex] = None):
+        self.base = base if base is not None else BitmapIndex()
+        self.delta = BitmapIndex(self.base.fields)
+
+    @property
+    def fields(self):
+        return self.base.fields
+
+    @property
+    def size(self) -> int:
+        return self.base.size + self.delta.size
+
+    def values(self, field: str) -> List[Any]:
+        """Valores distintos de `field` en ambos segmentos"""
+        return list(dict.fromkeys(self.base.values(field) + self.delta.values(field)))
+
+    def build(self, documents: Iterable[Mapping[str, Any]]) -> None:
+        """Reconstruye el segmento base y vacía el delta"""
+        base = BitmapIndex(self.fields)
+        base.build(documents)
+        self.base, self.delta = base, BitmapIndex(self.fields)
+
+    def update_delta(self, delta_documents: Iterable[Mapping[str, Any]]) -> None:
+        """Reconstruye los bitmaps del segmento delta"""
+        delta = BitmapIndex(self.fields)
+        delta.build(delta_documents)
+        self.delta = delta
+
+    def filter_mask(self, filters: Optional[Mapping[str, Any]]) -> Optional[np.ndarray]:
+        """Máscara booleana (base + delta) para `filters`, o None si no hay filtros"""
+        if not filters:
+            return None
+        return np.concatenate([self.base.filter_mask(filters), self.delta.filter_mask(filters)])
+
+
+class BackgroundMerger:
+    """
+    Ejecuta el merge de segmentos en un hilo daemon.
+    Solo corre un merge a la vez: las solicitudes que llegan durante un merge
+    se descartan y la política se vuelve a evaluar en el siguiente cambio.
+    """
+
+    def __init__(self, merge_fn: Callable[[], Any], name: str = "segment_merge"):
+        self.merge_fn = merge_fn
+        self.name = name
+        self.merges_completed = 0
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def request(self) -> bool:
+        """Inicia un merge si no hay otro en curso"""
+        with self._lock:
+            if self.running:
+                return False
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+            return True
+
+    def _run(self) -> None:
+        self.merge_fn()
+        self.merges_completed += 1
+
+    def wait(self, timeout: Optional[float] = None) -> None:
+        """Espera a que termine el merge en curso (si lo hay)"""
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
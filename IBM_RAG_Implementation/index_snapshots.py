@@ -0,0 +1,163 @@
+# Snapshots persistentes de índices para DECODE-EV RAG
+# Evita reconstruir BM25, bitmaps e índices vectoriales en cada arranque
+
+import os
+import io
+import ast
+import json
+import pickle
+import inspect
+import hashlib
+import logging
+import textwrap
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Union
+
+# Incrementar al cambiar el formato del archivo; los cambios de atributos de
+# las clases persistidas ya quedan cubiertos por `schema_fingerprint`
+SNAPSHOT_FORMAT_VERSION = 2
+SNAPSHOT_SUFFIX = ".snapshot"
+
+_CHUNK_SIZE = 1 << 20
+
+logger = logging.getLogger(__name__)
+
+
+def dataset_fingerprint(dataset_path: Union[str, Path]) -> str:
+    """Hash SHA-256 del contenido del dataset"""
+    digest = hashlib.sha256()
+    with open(dataset_path, "rb") as f:
+        for chunk in iter(lambda: f.read(_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def documents_fingerprint(documents: Iterable[Mapping[str, Any]], extra: str = "") -> str:
+    """Hash SHA-256 del contenido de una colección de documentos (más un contexto opcional)"""
+    digest = hashlib.sha256(extra.encode("utf-8"))
+    for doc in documents:
+        payload = doc.to_dict() if hasattr(doc, "to_dict") else dict(doc)
+        digest.update(json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8"))
+        digest.update(b"\n")
+    return digest.hexdigest()
+
+
+def instance_attributes(cls: type) -> List[str]:
+    """
+    Atributos de instancia de una clase: los asignados como `self.<nombre>`
+    en su código fuente más las anotaciones de clase (dataclasses)
+    """
+    names = set(getattr(cls, "__annotations__", {}))
+    try:
+        tree = ast.parse(textwrap.dedent(inspect.getsource(cls)))
+    except (OSError, TypeError):
+        return sorted(names)
+
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Assign):
+            targets = node.targets
+        elif isinstance(node, (ast.AnnAssign, ast.AugAssign)):
+            targets = [node.target]
+        else:
+            continue
+        for target in targets:
+            for item in ast.walk(target):
+                if isinstance(item, ast.Attribute) and isinstance(item.value, ast.Name) and item.value.id == "self":
+                    names.add(item.attr)
+    return sorted(names)
+
+
+def schema_fingerprint(classes: Iterable[type]) -> str:
+    """Hash de los nombres y atributos de las clases persistidas (cambia si cambia su estructura)"""
+    schema = sorted((f"{cls.__module__}.{cls.__qualname__}", instance_attributes(cls)) for cls in classes)
+    return hashlib.sha256(json.dumps(schema).encode("utf-8")).hexdigest()
+
+
+class IndexSnapshotStore:
+    """
+    Directorio de snapshots versionados.
+
+    Cada snapshot es un archivo `<nombre>.<hash>.v<versión>.<esquema>.snapshot`
+    con una línea de manifiesto JSON (versión, hash del dataset, huella del
+    esquema, checksum del payload) seguida del payload pickle con los índices.
+    La huella del esquema (`schema`: clases de los índices persistidos) hace
+    que un cambio de atributos invalide los snapshots sin tener que
+    incrementar SNAPSHOT_FORMAT_VERSION a mano.
+
+    Seguridad: cargar un snapshot ejecuta pickle, es decir, código arbitrario.
+    Solo deben cargarse archivos locales escritos por esta misma aplicación,
+    en un directorio que nadie más pueda modificar; nunca snapshots
+    descargados o compartidos. El checksum detecta corrupción, no manipulación.
+    """
+
+    def __init__(self, directory: Union[str, Path], name: str = "indexes", schema: Iterable[type] = ()):
+        self.directory = Path(directory)
+        self.name = name
+        self.schema = schema_fingerprint(schema)
+
+    def snapshot_path(self, fingerprint: str) -> Path:
+        return self.directory / (f"{self.name}.{fingerprint[:16]}.v{SNAPSHOT_FORMAT_VERSION}."
+                                 f"{self.schema[:12]}{SNAPSHOT_SUFFIX}")
+
+    def save(self, fingerprint: str, indexes: Dict[str, Any]) -> Optional[Path]:
+        """Guarda los índices para `fingerprint` y elimina snapshots anteriores"""
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            payload = pickle.dumps(indexes, protocol=pickle.HIGHEST_PROTOCOL)
+            manifest = {
+                "format_version": SNAPSHOT_FORMAT_VERSION,
+                "fingerprint": fingerprint,
+                "schema": self.schema,
+                "checksum": hashlib.sha256(payload).hexdigest(),
+                "indexes": sorted(indexes)
+            }
+
+            path = self.snapshot_path(fingerprint)
+            tmp_path = path.with_name(path.name + f".tmp{os.getpid()}")
+            with open(tmp_path, "wb") as f:
+                f.write(json.dumps(manifest).encode("utf-8") + b"\n")
+                f.write(payload)
+            os.replace(tmp_path, path)
+
+            self._prune(keep=path)
+            return path
+
+        except OSError as e:
+            logger.warning(f"⚠️ No se pudo guardar snapshot de índices: {e}")
+            return None
+
+    def load(self, fingerprint: str) -> Optional[Dict[str, Any]]:
+        """
+        Carga los índices para `fingerprint` (solo archivos de confianza: ver la clase).
+        Retorna None si no hay snapshot, es de otra versión o esquema, o el checksum no coincide.
+        """
+        path = self.snapshot_path(fingerprint)
+        if not path.exists():
+            return None
+
+        try:
+            with open(path, "rb") as f:
+                manifest = json.loads(f.readline().decode("utf-8"))
+                payload = f.read()
+
+            if manifest.get("format_version") != SNAPSHOT_FORMAT_VERSION:
+                return None
+            if manifest.get("fingerprint") != fingerprint or manifest.get("schema") != self.schema:
+                return None
+            if hashlib.sha256(payload).hexdigest() != manifest.get("checksum"):
+                logger.warning(f"⚠️ Snapshot corrupto, se reconstruirán los índices: {path}")
+                return None
+
+            return pickle.load(io.BytesIO(payload))
+
+        except (OSError, ValueError, pickle.UnpicklingError, EOFError) as e:
+            logger.warning(f"⚠️ Snapshot ilegible, se reconstruirán los índices: {e}")
+            return None
+
+    def _prune(self, keep: Path) -> None:
+        for path in self.directory.glob(f"{self.name}.*{SNAPSHOT_SUFFIX}"):
+            if path != keep:
+                try:
+                    path.unlink()
+                except OSError:
+                    pass
@@ -0,0 +1,117 @@
+# Índice léxico BM25 para DECODE-EV RAG
+# Índice invertido con scoring BM25 sobre los documentos procesados
+
+import re
+import math
+import heapq
+import unicodedata
+from collections import Counter
+from typing import Dict, List, Iterable, Optional, Sequence, Tuple
+
+# Palabras vacías frecuentes en las descripciones CAN (español/inglés)
+STOPWORDS = frozenset({
+    "a", "al", "con", "de", "del", "el", "en", "es", "la", "las", "lo", "los",
+    "o", "para", "por", "que", "se", "su", "un", "una", "y", "sobre", "tienes",
+    "the", "of", "and", "in", "on", "to", "is", "for"
+})
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+def fold_accents(text: str) -> str:
+    """Convierte a minúsculas y elimina tildes (tensión -> tension)"""
+    normalized = unicodedata.normalize("NFKD", text.lower())
+    return "".join(ch for ch in normalized if not unicodedata.combining(ch))
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Analizador léxico compartido por indexación y consulta.
+    Separa por caracteres no alfanuméricos, por lo que 'voltaje_carga_v'
+    produce ['voltaje', 'carga', 'v'].
+    """
+    return [tok for tok in _TOKEN_PATTERN.findall(fold_accents(text)) if tok not in STOPWORDS]
+
+
+class BM25Index:
+    """
+    Índice invertido con scoring BM25.
+    Las consultas solo recorren los postings de sus propios términos y
+    el top-k se obtiene con un heap, sin recorrer todo el corpus.
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+
+        # término -> lista de (doc_id, frecuencia del término)
+        self.postings: Dict[str, List[Tuple[int, int]]] = {}
+        self.doc_lengths: List[int] = []
+        self.total_length = 0
+
+    def __len__(self) -> int:
+        return len(self.doc_lengths)
+
+    @property
+    def average_length(self) -> float:
+        return self.total_length / len(self.doc_lengths) if self.doc_lengths else 0.0
+
+    def build(self, texts: Iterable[str]) -> None:
+        """Construye el índice desde cero; el doc_id es la posición del texto"""
+        self.postings = {}
+        self.doc_lengths = []
+        self.total_length = 0
+
+        for text in texts:
+            self.add_document(text)
+
+    def add_document(self, text: str) -> int:
+        """Agrega un documento al final del índice y retorna su doc_id"""
+        doc_id = len(self.doc_lengths)
+        tokens = tokenize(text)
+
+        for term, tf in Counter(tokens).items():
+            self.postings.setdefault(term, []).append((doc_id, tf))
+
+        self.doc_lengths.append(len(tokens))
+        self.total_length += len(tokens)
+        return doc_id
+
+    def idf(self, term: str) -> float:
+        """IDF de BM25 (variante no negativa)"""
+        df = len(self.postings.get(term, ()))
+        n_docs = len(self.doc_lengths)
+        return math.log(1.0 + (n_docs - df + 0.5) / (df + 0.5))
+
+    def search(self, query: str, top_k: int = 10,
+               mask: Optional[Sequence[bool]] = None) -> List[Tuple[int, float]]:
+        """
+        Retorna los top-k (doc_id, score) para la consulta.
+        Si se entrega `mask`, solo se puntúan los doc_id con mask[doc_id] verdadero.
+        """
+        return self.search_terms(tokenize(query), top_k=top_k, mask=mask)
+
+    def search_terms(self, terms: Iterable[str], top_k: int = 10,
+                     mask: Optional[Sequence[bool]] = None) -> List[Tuple[int, float]]:
+        """Igual que `search`, con la consulta ya tokenizada"""
+        if top_k <= 0 or not self.doc_lengths:
+            return []
+
+        k1, b = self.k1, self.b
+        avgdl = self.average_length or 1.0
+        doc_lengths = self.doc_lengths
+        scores: Dict[int, float] = {}
+
+        for term in set(terms):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+
+            idf = self.idf(term)
+            for doc_id, tf in postings:
+                if mask is not None and not mask[doc_id]:
+                    continue
+                norm = k1 * (1.0 - b + b * doc_lengths[doc_id] / avgdl)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (k1 + 1.0) / (tf + norm)
+
+        return heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
@@ -0,0 +1,169 @@
+# Índices bitmap de metadatos para DECODE-EV RAG
+# Filtros booleanos sobre red_can, evento_vehiculo, intensidad, etc. con operaciones bit a bit
+
+import json
+import numpy as np
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Sequence
+
+# Campos indexados por defecto (nivel documento o dentro de `metadata`)
+DEFAULT_FILTER_FIELDS = (
+    "document_type",
+    "red_can",
+    "evento_vehiculo",
+    "intensidad",
+    "contexto_operativo",
+    "vehicle_id"
+)
+
+
+def get_field_value(doc: Mapping[str, Any], field: str) -> Any:
+    """Obtiene un campo del documento o, si no existe, de su metadata"""
+    value = doc.get(field)
+    if value is None:
+        value = doc.get('metadata', {}).get(field)
+    return value
+
+
+def filters_key(filters: Optional[Mapping[str, Any]]) -> str:
+    """Forma canónica de una expresión de filtro (para agrupar consultas o como clave de caché)"""
+    return json.dumps(filters or {}, sort_keys=True, ensure_ascii=False, default=str)
+
+
+def validate_filters(filters: Optional[Mapping[str, Any]], fields: Sequence[str]) -> None:
+    """
+    Verifica una expresión de filtro antes de evaluarla: campos indexados,
+    operadores con la forma esperada y valores escalares. ValueError si no es válida
+    """
+    if not filters:
+        return
+    if not isinstance(filters, Mapping):
+        raise ValueError(f"Expresión de filtro inválida: {filters!r}")
+
+    for key, condition in filters.items():
+        if key in ("$and", "$or"):
+            if not isinstance(condition, (list, tuple)):
+                raise ValueError(f"'{key}' requiere una lista de expresiones")
+            for sub_expression in condition:
+                if not isinstance(sub_expression, Mapping):
+                    raise ValueError(f"Expresión de filtro inválida en '{key}': {sub_expression!r}")
+                validate_filters(sub_expression, fields)
+        elif key == "$not":
+            if not isinstance(condition, Mapping):
+                raise ValueError(f"'$not' requiere una expresión: {condition!r}")
+            validate_filters(condition, fields)
+        elif key not in fields:
+            raise ValueError(f"Campo de filtro no indexado: {key}")
+        else:
+            values = condition if isinstance(condition, (list, tuple, set)) else [condition]
+            if any(isinstance(value, (Mapping, list, tuple, set)) for value in values):
+                raise ValueError(f"Valor de filtro inválido para '{key}': {condition!r}")
+
+
+class BitmapIndex:
+    """
+    Un bitmap empaquetado (1 bit por documento, np.packbits) por cada
+    valor de cada campo indexado.
+
+    Expresiones de filtro soportadas (formato de RAGQuery.context_filters):
+    - {"red_can": "CAN_CUSTOM_31"}                 igualdad
+    - {"evento_vehiculo": ["carga", "frenado"]}    pertenencia (OR)
+    - {"$and": [...]}, {"$or": [...]}, {"$not": {...}}
+    Varias claves en un mismo diccionario se combinan con AND.
+    """
+
+    def __init__(self, fields: Sequence[str] = DEFAULT_FILTER_FIELDS):
+        self.fields = tuple(fields)
+        self.size = 0
+        self.bitmaps: Dict[str, Dict[Any, np.ndarray]] = {name: {} for name in self.fields}
+
+    @property
+    def n_bytes(self) -> int:
+        return (self.size + 7) // 8
+
+    def build(self, documents: Iterable[Mapping[str, Any]]) -> None:
+        """Construye los bitmaps; el bit i corresponde al documento i"""
+        values: Dict[str, List[Any]] = {name: [] for name in self.fields}
+        self.size = 0
+        for doc in documents:
+            for name in self.fields:
+                values[name].append(get_field_value(doc, name))
+            self.size += 1
+
+        self.bitmaps = {name: self._build_field(column) for name, column in values.items()}
+
+    def _build_field(self, column: List[Any]) -> Dict[Any, np.ndarray]:
+        """Codifica la columna por diccionario y genera un bitmap por valor"""
+        dictionary: Dict[Any, int] = {}
+        codes = np.fromiter(
+            (-1 if value is None else dictionary.setdefault(value, len(dictionary)) for value in column),
+            dtype=np.int64, count=len(column)
+        )
+
+        order = np.argsort(codes, kind="stable")
+        bounds = np.searchsorted(codes[order], np.arange(len(dictionary) + 1))
+
+        bitmaps = {}
+        for value, code in dictionary.items():
+            bits = np.zeros(self.size, dtype=bool)
+            bits[order[bounds[code]:bounds[code + 1]]] = True
+            bitmaps[value] = np.packbits(bits)
+        return bitmaps
+
+    def values(self, field: str) -> List[Any]:
+        """Valores distintos indexados para `field`"""
+        return list(self.bitmaps.get(field, {}))
+
+    def all(self) -> np.ndarray:
+        """Bitmap con todos los documentos"""
+        return np.packbits(np.ones(self.size, dtype=bool))
+
+    def none(self) -> np.ndarray:
+        """Bitmap vacío"""
+        return np.zeros(self.n_bytes, dtype=np.uint8)
+
+    def evaluate(self, expression: Mapping[str, Any]) -> np.ndarray:
+        """Evalúa una expresión de filtro y retorna el bitmap resultante"""
+        result = self.all()
+
+        for key, condition in expression.items():
+            if key == "$and":
+                bitmap = self.all()
+                for sub_expression in condition:
+                    bitmap &= self.evaluate(sub_expression)
+            elif key == "$or":
+                bitmap = self.none()
+                for sub_expression in condition:
+                    bitmap |= self.evaluate(sub_expression)
+            elif key == "$not":
+                bitmap = ~self.evaluate(condition) & self.all()
+            else:
+                bitmap = self._field_bitmap(key, condition)
+            result &= bitmap
+
+        return result
+
+    def _field_bitmap(self, field: str, condition: Any) -> np.ndarray:
+        if field not in self.bitmaps:
+            raise ValueError(f"Campo de filtro no indexado: {field}")
+
+        values = condition if isinstance(condition, (list, tuple, set)) else [condition]
+        bitmap = self.none()
+        for value in values:
+            value_bitmap = self.bitmaps[field].get(value)
+            if value_bitmap is not None:
+                bitmap |= value_bitmap
+        return bitmap
+
+    def to_mask(self, bitmap: np.ndarray) -> np.ndarray:
+        """Convierte un bitmap empaquetado a máscara booleana por documento"""
+        return np.unpackbits(bitmap, count=self.size).astype(bool)
+
+    def filter_mask(self, filters: Optional[Mapping[str, Any]]) -> Optional[np.ndarray]:
+        """Máscara booleana para `filters`, o None si no hay filtros"""
+        if not filters:
+            return None
+        return self.to_mask(self.evaluate(filters))
+
+    def count(self, bitmap: np.ndarray) -> int:
+        """Cantidad de documentos en el bitmap"""
+        return int(np.unpackbits(bitmap, count=self.size).sum())
@@ -0,0 +1,387 @@
+# Almacenamiento cuantizado de embeddings para DECODE-EV RAG
+# Int8 escalar por dimensión y Product Quantization (ADC), con re-scoring exacto en float32
+
+import os
+import uuid
+import shutil
+import logging
+import tempfile
+import weakref
+import numpy as np
+from itertools import chain
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+from vector_index import normalize_rows, top_k_indices
+
+logger = logging.getLogger(__name__)
+
+
+def _nearest(data: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Centroide más cercano de cada fila: argmin ||x - c||² = argmax (x·c - ||c||²/2)"""
+    # El sesgo -||c||²/2 va como columna extra para resolverlo en una sola multiplicación
+    augmented = np.hstack([data, np.ones((data.shape[0], 1), dtype=data.dtype)])
+    biased = np.hstack([centroids, -0.5 * np.sum(centroids ** 2, axis=1, keepdims=True)])
+    return np.argmax(augmented @ biased.T, axis=1)
+
+
+def _kmeans(data: np.ndarray, k: int, n_iter: int, rng: np.random.Generator) -> np.ndarray:
+    """k-means euclidiano (centroides k x dimensión)"""
+    centroids = data[rng.choice(data.shape[0], k, replace=data.shape[0] < k)].copy()
+    for _ in range(n_iter):
+        assignment = _nearest(data, centroids)
+
+        counts = np.bincount(assignment, minlength=k)
+        order = np.argsort(assignment, kind="stable")
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+
+        non_empty = counts > 0
+        sums = np.zeros_like(centroids)
+        sums[non_empty] = np.add.reduceat(data[order], starts[non_empty], axis=0)
+        centroids[non_empty] = sums[non_empty] / counts[non_empty, None]
+
+        # Reinicializar clusters vacíos con puntos aleatorios
+        empty = ~non_empty
+        if empty.any():
+            centroids[empty] = data[rng.choice(data.shape[0], int(empty.sum()))]
+    return centroids
+
+
+class ScalarQuantizer:
+    """
+    Cuantización int8 simétrica con una escala por dimensión:
+    código = round(x / escala), escala = max|x| / 127 de cada dimensión.
+    El producto punto se calcula contra los códigos con la escala plegada en la consulta.
+    """
+
+    def __init__(self, dimension: int = 768):
+        self.dimension = dimension
+        self.scale = np.ones(dimension, dtype=np.float32)
+
+    @property
+    def code_size(self) -> int:
+        return self.dimension
+
+    def train(self, vectors: np.ndarray, block_size: int = 65536) -> None:
+        # Por bloques: `vectors` puede estar mapeado desde disco
+        max_abs = np.zeros(self.dimension, dtype=np.float32)
+        for start in range(0, vectors.shape[0], block_size):
+            np.maximum(max_abs, np.max(np.abs(vectors[start:start + block_size]), axis=0), out=max_abs)
+        self.scale = np.maximum(max_abs / 127.0, 1e-8).astype(np.float32)
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        return np.clip(np.rint(vectors / self.scale), -127, 127).astype(np.int8)
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        return codes.astype(np.float32) * self.scale
+
+    def prepare(self, queries: np.ndarray) -> np.ndarray:
+        return queries * self.scale
+
+    def score(self, prepared: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        """Scores aproximados (n_consultas x n_códigos)"""
+        return prepared @ codes.astype(np.float32).T
+
+
+class ProductQuantizer:
+    """
+    Product Quantization: el vector se divide en `n_subvectors` bloques y
+    cada bloque se reemplaza por el índice (uint8) de su centroide más
+    cercano entre 256. Con 768 dimensiones y 96 bloques, un vector ocupa 96
+    bytes en lugar de 3 KB.
+
+    La búsqueda usa distancias asimétricas (ADC): la consulta queda en
+    float32 y se precalcula una tabla consulta·centroide por bloque; el score
+    de cada código es la suma de `n_subvectors` entradas de esa tabla.
+    """
+
+    def __init__(self, dimension: int = 768, n_subvectors: int = 96, n_centroids: int = 256,
+                 n_iter: int = 10, max_training_points: int = 32, seed: int = 0):
+        if dimension % n_subvectors:
+            raise ValueError(f"La dimensión {dimension} no es divisible en {n_subvectors} subvectores")
+        if n_centroids > 256:
+            raise ValueError("Los códigos PQ son uint8: máximo 256 centroides por subvector")
+
+        self.dimension = dimension
+        self.n_subvectors = n_subvectors
+        self.n_centroids = n_centroids
+        self.n_iter = n_iter
+        self.max_training_points = max_training_points
+        self.seed = seed
+        self.sub_dimension = dimension // n_subvectors
+        self.codebooks = np.empty((n_subvectors, 0, self.sub_dimension), dtype=np.float32)
+
+    @property
+    def code_size(self) -> int:
+        return self.n_subvectors
+
+    def _split(self, vectors: np.ndarray) -> np.ndarray:
+        return vectors.reshape(-1, self.n_subvectors, self.sub_dimension)
+
+    def train(self, vectors: np.ndarray) -> None:
+        """Entrena un codebook por subvector con k-means"""
+        rng = np.random.default_rng(self.seed)
+        n_centroids = max(1, min(self.n_centroids, vectors.shape[0]))
+        sample_size = min(vectors.shape[0], n_centroids * self.max_training_points)
+        sample = self._split(vectors[np.sort(rng.choice(vectors.shape[0], sample_size, replace=False))])
+
+        self.codebooks = np.stack([
+            _kmeans(np.ascontiguousarray(sample[:, j]), n_centroids, self.n_iter, rng)
+            for j in range(self.n_subvectors)
+        ]).astype(np.float32)
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        parts = self._split(vectors)
+        codes = np.empty((parts.shape[0], self.n_subvectors), dtype=np.uint8)
+        for j, codebook in enumerate(self.codebooks):
+            codes[:, j] = _nearest(parts[:, j], codebook)
+        return codes
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        subvectors = self.codebooks[np.arange(self.n_subvectors), codes]
+        return subvectors.reshape(codes.shape[0], self.dimension)
+
+    def prepare(self, queries: np.ndarray) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        """
+        Consultas + tablas ADC aplanadas (n_consultas x n_subvectores·n_centroides).
+        Para lotes grandes no se construyen tablas: reconstruir los códigos una
+        vez y multiplicar contra todas las consultas resulta más barato.
+        """
+        if queries.shape[0] * self.n_subvectors > 2 * self.dimension:
+            return queries, None
+        tables = np.einsum("qjd,jcd->qjc", self._split(queries), self.codebooks)
+        return queries, tables.reshape(queries.shape[0], -1)
+
+    def score(self, prepared: Tuple[np.ndarray, Optional[np.ndarray]], codes: np.ndarray) -> np.ndarray:
+        """Scores aproximados (n_consultas x n_códigos)"""
+        queries, tables = prepared
+        if tables is None:
+            return queries @ self.decode(codes).T
+
+        # Cada código suma una entrada de la tabla por subvector
+        flat_codes = codes.astype(np.int32) + np.arange(self.n_subvectors, dtype=np.int32) * self.codebooks.shape[1]
+        return np.stack([table[flat_codes].sum(axis=1) for table in tables])
+
+
+class StackedRows:
+    """
+    Filas `positions` del apilado vertical de varias matrices, sin
+    materializarlo: solo se leen las filas de cada bloque pedido (slice o
+    índices enteros). Con matrices mapeadas desde disco permite reconstruir
+    un índice por bloques; `np.asarray` la materializa completa.
+    """
+
+    def __init__(self, matrices: Sequence[np.ndarray], positions: Optional[np.ndarray] = None):
+        self.matrices: List[np.ndarray] = list(matrices)
+        self.offsets = np.cumsum([0] + [matrix.shape[0] for matrix in self.matrices])
+        self.positions = (np.arange(self.offsets[-1]) if positions is None
+                          else np.asarray(positions, dtype=np.int64))
+        self.shape = (self.positions.size, self.matrices[0].shape[1])
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    def __getitem__(self, rows) -> np.ndarray:
+        selected = np.atleast_1d(self.positions[rows])
+        segment = np.searchsorted(self.offsets, selected, side="right") - 1
+        block = np.empty((selected.size, self.shape[1]), dtype=np.float32)
+        for i, matrix in enumerate(self.matrices):
+            in_matrix = segment == i
+            if in_matrix.any():
+                block[in_matrix] = matrix[selected[in_matrix] - self.offsets[i]]
+        return block
+
+    def __array__(self, dtype=None, copy=None) -> np.ndarray:
+        matrix = self[:]
+        return matrix if dtype is None else matrix.astype(dtype, copy=False)
+
+
+class QuantizedVectorIndex:
+    """
+    Índice de embeddings con la misma interfaz que DenseVectorIndex, pero
+    que mantiene en RAM solo los códigos cuantizados (int8: 4x menos
+    memoria; PQ con 96 subvectores: 32x menos).
+
+    La búsqueda recorre los códigos por bloques, selecciona
+    `top_k * rescore_factor` candidatos con el score aproximado y los vuelve
+    a puntuar con los vectores float32 exactos, de modo que los scores
+    retornados son cosenos exactos. Los vectores float32 se escriben por
+    bloques en un archivo de `rescore_dir` (por defecto un directorio
+    temporal propio, eliminado con `release()`) y se mapean en memoria: solo
+    se leen las filas candidatas.
+    """
+
+    # Candidatos por resultado a re-puntuar: PQ es más grueso y necesita más
+    DEFAULT_RESCORE_FACTOR = {"int8": 4, "pq": 16}
+
+    def __init__(self, dimension: int = 768, method: str = "int8", rescore_factor: Optional[int] = None,
+                 n_subvectors: int = 96, rescore_dir: Optional[Union[str, Path]] = None,
+                 block_size: int = 65536):
+        if method not in ("int8", "pq"):
+            raise ValueError(f"Método de cuantización no soportado: {method}")
+
+        self.dimension = dimension
+        self.method = method
+        self.rescore_factor = rescore_factor or self.DEFAULT_RESCORE_FACTOR[method]
+        self.block_size = block_size
+        self.rescore_dir = Path(rescore_dir) if rescore_dir is not None else None
+        self.quantizer = (ScalarQuantizer(dimension) if method == "int8"
+                          else ProductQuantizer(dimension, n_subvectors))
+
+        self.codes = np.empty((0, self.quantizer.code_size),
+                              dtype=np.int8 if method == "int8" else np.uint8)
+        self.vectors_path: Optional[Path] = None
+        self._vectors = np.empty((0, dimension), dtype=np.float32)
+        self._temp_dir: Optional[Path] = None
+        self._cleanup: Optional[weakref.finalize] = None
+
+    def __len__(self) -> int:
+        return self.codes.shape[0]
+
+    @property
+    def matrix(self) -> np.ndarray:
+        """Vectores float32 normalizados (mapeados desde disco)"""
+        return self._vectors
+
+    def build(self, embeddings: Union[Sequence[Sequence[float]], np.ndarray, StackedRows]) -> None:
+        """
+        Entrena el cuantizador y codifica todos los vectores. Acepta matrices
+        mapeadas desde disco o StackedRows: se procesan por bloques
+        """
+        source = embeddings if hasattr(embeddings, "shape") else \
+            np.asarray(embeddings, dtype=np.float32).reshape(-1, self.dimension)
+        self._write_vectors(self._normalized_blocks(source))
+        if len(self._vectors):
+            self.quantizer.train(self._vectors)
+        self.codes = self._encode(self._vectors)
+
+    def add(self, embeddings: Sequence[Sequence[float]]) -> np.ndarray:
+        """Agrega vectores con el cuantizador ya entrenado y retorna sus ids"""
+        vectors = normalize_rows(np.asarray(embeddings, dtype=np.float32).reshape(-1, self.dimension))
+        start = len(self)
+        self.codes = np.concatenate([self.codes, self._encode(vectors)])
+        previous = self._vectors
+        self._write_vectors(chain((previous[i:i + self.block_size] for i in range(0, len(previous), self.block_size)),
+                                  [vectors]))
+        return np.arange(start, start + vectors.shape[0])
+
+    def _normalized_blocks(self, source) -> Iterable[np.ndarray]:
+        for start in range(0, source.shape[0], self.block_size):
+            block = np.asarray(source[start:start + self.block_size], dtype=np.float32)
+            yield normalize_rows(block.reshape(-1, self.dimension))
+
+    def _encode(self, vectors: np.ndarray) -> np.ndarray:
+        blocks = [self.quantizer.encode(np.asarray(vectors[start:start + self.block_size]))
+                  for start in range(0, vectors.shape[0], self.block_size)]
+        return np.concatenate(blocks) if blocks else self.codes[:0]
+
+    def _directory(self) -> Path:
+        if self.rescore_dir is not None:
+            self.rescore_dir.mkdir(parents=True, exist_ok=True)
+            return self.rescore_dir
+        if self._temp_dir is None:
+            self._temp_dir = Path(tempfile.mkdtemp(prefix="decode_ev_rescore_"))
+            # Si el índice se descarta sin `release()`, el directorio se elimina al recolectarlo
+            self._cleanup = weakref.finalize(self, shutil.rmtree, str(self._temp_dir), True)
+        return self._temp_dir
+
+    def _write_vectors(self, blocks: Iterable[np.ndarray]) -> None:
+        """Escribe los bloques en un archivo nuevo y lo mapea como matriz de re-scoring"""
+        # Archivo nuevo por construcción: un índice anterior puede seguir leyendo el suyo
+        previous = self.vectors_path
+        self.vectors_path = self._directory() / f"vectors.{uuid.uuid4().hex[:12]}.f32"
+        n_rows = 0
+        with open(self.vectors_path, "wb") as handle:
+            for block in blocks:
+                np.ascontiguousarray(block, dtype=np.float32).tofile(handle)
+                n_rows += len(block)
+        self._vectors = (np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(n_rows, self.dimension))
+                         if n_rows else np.empty((0, self.dimension), dtype=np.float32))
+        if previous is not None:
+            self._remove_file(previous)
+
+    def release(self) -> None:
+        """Elimina el archivo de vectores float32 (cuando el índice se reemplaza)"""
+        self._vectors = np.empty((0, self.dimension), dtype=np.float32)
+        if self.vectors_path is not None:
+            self._remove_file(self.vectors_path)
+            self.vectors_path = None
+        if self._cleanup is not None:
+            self._cleanup()
+            self._temp_dir, self._cleanup = None, None
+
+    @staticmethod
+    def _remove_file(path: Path) -> None:
+        try:
+            os.remove(path)
+        except OSError as e:
+            logger.warning(f"⚠️ No se pudo eliminar {path}: {e}")
+
+    def search(self, query_embedding: Sequence[float], top_k: int = 10,
+               candidate_ids: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        ids, scores = self.search_batch(np.asarray(query_embedding, dtype=np.float32)[None, :],
+                                        top_k, candidate_ids)
+        return ids[0], scores[0]
+
+    def search_batch(self, query_embeddings: np.ndarray, top_k: int = 10,
+                     candidate_ids: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Búsqueda en dos fases: scores aproximados sobre los códigos y
+        re-scoring exacto de los mejores candidatos. Retorna matrices (n_queries x k).
+        """
+        queries = normalize_rows(np.asarray(query_embeddings, dtype=np.float32).reshape(-1, self.dimension))
+        row_ids = None if candidate_ids is None else np.asarray(candidate_ids, dtype=np.int64)
+        n_rows = len(self) if row_ids is None else row_ids.size
+
+        n_candidates = min(n_rows, top_k * self.rescore_factor)
+        candidates = self._approximate_top(queries, n_candidates, row_ids)
+        if candidates.shape[1] == 0:
+            return candidates, np.empty(candidates.shape, dtype=np.float32)
+
+        # Re-scoring exacto: cada fila candidata se lee una sola vez para todo el lote
+        unique_rows, inverse = np.unique(candidates, return_inverse=True)
+        exact = queries @ np.asarray(self._vectors[unique_rows]).T
+        candidate_scores = np.take_along_axis(exact, inverse.reshape(candidates.shape), axis=-1)
+
+        top = top_k_indices(candidate_scores, top_k)
+        return np.take_along_axis(candidates, top, axis=-1), np.take_along_axis(candidate_scores, top, axis=-1)
+
+    def _approximate_top(self, queries: np.ndarray, k: int, row_ids: Optional[np.ndarray]) -> np.ndarray:
+        """Ids (n_queries x k) con mayor score aproximado, recorriendo los códigos por bloques"""
+        prepared = self.quantizer.prepare(queries)
+        best_ids = np.empty((queries.shape[0], 0), dtype=np.int64)
+        best_scores = np.empty((queries.shape[0], 0), dtype=np.float32)
+
+        n_rows = len(self) if row_ids is None else row_ids.size
+        for start in range(0, n_rows, self.block_size):
+            if row_ids is None:
+                block_ids = np.arange(start, min(start + self.block_size, n_rows))
+                codes = self.codes[start:start + self.block_size]
+            else:
+                block_ids = row_ids[start:start + self.block_size]
+                codes = self.codes[block_ids]
+
+            scores = np.hstack([best_scores, self.quantizer.score(prepared, codes)])
+            ids = np.hstack([best_ids, np.broadcast_to(block_ids, (queries.shape[0], block_ids.size))])
+            top = top_k_indices(scores, k)
+            best_ids = np.take_along_axis(ids, top, axis=-1)
+            best_scores = np.take_along_axis(scores, top, axis=-1)
+        return best_ids
+
+    def memory_usage(self) -> int:
+        """Bytes en RAM (los vectores mapeados desde disco no cuentan)"""
+        in_ram = 0 if isinstance(self._vectors, np.memmap) else self._vectors.nbytes
+        return self.codes.nbytes + in_ram
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # Los snapshots incluyen los vectores float32, no la ruta al archivo mapeado
+        state = self.__dict__.copy()
+        state["_vectors"] = np.asarray(self._vectors)
+        state.update(vectors_path=None, _temp_dir=None, _cleanup=None)
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        vectors = state.pop("_vectors")
+        self.__dict__.update(state)
+        self._vectors = np.empty((0, self.dimension), dtype=np.float32)
+        self._write_vectors([vectors])
@@ -0,0 +1,59 @@
+# Detección de intenciones de consulta para DECODE-EV RAG
+# Un único matcher compilado (regex de alternancia) para plantillas, ruteo y respuestas
+
+import re
+from typing import Dict, FrozenSet, Iterable, Mapping, Sequence, Tuple
+
+from lexical_index import fold_accents
+
+# Vocabulario único de intenciones (sin tildes, en minúsculas).
+# Una palabra terminada en '*' es un prefijo (falla* -> falla, fallas, fallando);
+# en otro caso debe coincidir la palabra completa.
+INTENT_VOCABULARY: Dict[str, Tuple[str, ...]] = {
+    # Señales / categorías de recuperación
+    "voltaje": ("voltaj*", "voltag*", "v"),
+    "corriente": ("corriente*", "current*", "amper*"),
+    "temperatura": ("temperatur*", "calor"),
+    "carga": ("carga*", "charging", "bateria*"),
+    "documentacion_tecnica": ("j1939", "protocol*", "standard*"),
+    # Tipo de respuesta (plantilla de prompt)
+    "diagnostico": ("diagnostic*", "problema*", "error*", "falla*", "anomalia*"),
+    "explicacion": ("event*", "que paso", "explica*"),
+    "tendencias": ("tendencia*", "trend*", "patron*", "analisis", "analy*", "evolucion*", "historico*")
+}
+
+
+def first_intent(intents: Iterable[str], priority: Sequence[str], default: str) -> str:
+    """Primera intención de `priority` presente en `intents` (o `default`)"""
+    intents = set(intents)
+    return next((name for name in priority if name in intents), default)
+
+
+class IntentMatcher:
+    """
+    Compila todo el vocabulario en una sola expresión regular con un grupo
+    nombrado por intención; `match` recorre la consulta una vez y retorna
+    todas las intenciones encontradas.
+    """
+
+    def __init__(self, vocabulary: Mapping[str, Sequence[str]] = INTENT_VOCABULARY):
+        self.vocabulary = {name: tuple(keywords) for name, keywords in vocabulary.items()}
+        self._group_names = {f"i{i}": name for i, name in enumerate(self.vocabulary)}
+
+        groups = []
+        for group, name in self._group_names.items():
+            # Más largas primero para que la alternancia prefiera la coincidencia más específica
+            keywords = sorted(self.vocabulary[name], key=len, reverse=True)
+            groups.append(f"(?P<{group}>{'|'.join(self._keyword_pattern(k) for k in keywords)})")
+        self.pattern = re.compile(rf"(?<![a-z0-9])(?:{'|'.join(groups)})")
+
+    @staticmethod
+    def _keyword_pattern(keyword: str) -> str:
+        if keyword.endswith("*"):
+            return re.escape(keyword[:-1]) + r"[a-z0-9]*"
+        return re.escape(keyword) + r"(?![a-z0-9])"
+
+    def match(self, query: str) -> FrozenSet[str]:
+        """Intenciones presentes en la consulta (sin distinguir tildes ni mayúsculas)"""
+        text = " ".join(fold_accents(query).split())
+        return frozenset(self._group_names[m.lastgroup] for m in self.pattern.finditer(text))
@@ -0,0 +1,74 @@
+# Preprocesamiento de consultas para DECODE-EV RAG
+# Expansión de abreviaciones en una sola pasada (regex compilada) con memoización
+
+import re
+from dataclasses import dataclass
+from typing import Mapping, Optional, Tuple
+
+from lexical_index import tokenize
+from result_cache import QueryResultCache
+
+# Abreviaciones técnicas comunes (sensibles a mayúsculas: 'CAN' sí, 'can' no)
+TECHNICAL_ABBREVIATIONS = {
+    "CAN": "Controller Area Network",
+    "SOC": "State of Charge",
+    "RPM": "Revoluciones Por Minuto",
+    "km/h": "kilómetros por hora"
+}
+
+# Letra o guion bajo (\w sin dígitos): '120km/h' se expande, 'CAN_CUSTOM_31' no
+_WORD_CHAR = r"[^\W\d]"
+
+
+@dataclass(frozen=True)
+class PreprocessedQuery:
+    """Consulta normalizada y los términos que ve el analizador léxico"""
+    text: str
+    terms: Tuple[str, ...]
+
+
+class QueryPreprocessor:
+    """
+    Normaliza consultas: colapsa espacios y expande abreviaciones como
+    "CAN (Controller Area Network)".
+
+    Todas las abreviaciones se compilan en una sola alternancia (más largas
+    primero) con límites de palabra, de modo que la consulta se recorre una
+    vez y no se reescriben fragmentos de otras palabras ni expansiones ya
+    insertadas. La expansión es idempotente: una abreviación ya seguida de
+    su expansión se deja igual.
+
+    Los resultados se memorizan en un LRU acotado, indexado tanto por la
+    pregunta original como por su forma normalizada, así que `terms()` sobre
+    el texto ya procesado no vuelve a tokenizar.
+    """
+
+    def __init__(self, expansions: Mapping[str, str] = TECHNICAL_ABBREVIATIONS,
+                 cache_size: int = 1024):
+        self.expansions = dict(expansions)
+        alternatives = "|".join(re.escape(abbrev) for abbrev in sorted(self.expansions, key=len, reverse=True))
+        self.pattern = re.compile(rf"(?<!{_WORD_CHAR})(?:{alternatives})(?!{_WORD_CHAR})")
+        self.cache = QueryResultCache(cache_size, ttl_seconds=float("inf"))
+
+    def preprocess(self, question: str) -> PreprocessedQuery:
+        """Forma normalizada de la pregunta (memorizada)"""
+        cached: Optional[PreprocessedQuery] = self.cache.get(question)
+        if cached is not None:
+            return cached
+
+        text = self.pattern.sub(self._expand, " ".join(question.split()))
+        result = self.cache.get(text) or PreprocessedQuery(text, tuple(tokenize(text)))
+        self.cache.put(question, result)
+        self.cache.put(text, result)
+        return result
+
+    def terms(self, text: str) -> Tuple[str, ...]:
+        """Términos léxicos de una consulta (original o ya preprocesada)"""
+        return self.preprocess(text).terms
+
+    def _expand(self, match: re.Match) -> str:
+        abbrev = match.group()
+        expanded = f"{abbrev} ({self.expansions[abbrev]})"
+        if match.string.startswith(expanded, match.start()):
+            return abbrev
+        return expanded
@@ -0,0 +1,305 @@
+# Limitación de tasa y concurrencia adaptativa para los servicios IBM de DECODE-EV RAG
+# Token bucket por endpoint + AIMD (aumento aditivo, reducción multiplicativa) según latencia y 429
+
+import os
+import time
+import asyncio
+import threading
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Tuple
+
+
+@dataclass(frozen=True)
+class EndpointLimits:
+    """Cuota de un endpoint: tasa sostenida, ráfaga y rango de concurrencia"""
+    rate_per_second: float
+    burst: int
+    initial_concurrency: int = 4
+    min_concurrency: int = 1
+    max_concurrency: int = 32
+    latency_target: float = 5.0      # segundos; por encima se reduce la concurrencia
+    decrease_factor: float = 0.5
+
+
+# Límites por defecto de cada familia de llamadas (ajustables al plan contratado)
+DEFAULT_ENDPOINT_LIMITS = {
+    "discovery_query": EndpointLimits(rate_per_second=10, burst=20, initial_concurrency=8,
+                                      max_concurrency=32, latency_target=2.0),
+    "discovery_upload": EndpointLimits(rate_per_second=5, burst=10, initial_concurrency=4,
+                                       max_concurrency=16, latency_target=5.0),
+    "discovery_admin": EndpointLimits(rate_per_second=2, burst=4, initial_concurrency=1,
+                                      max_concurrency=2, latency_target=10.0),
+    "generation": EndpointLimits(rate_per_second=8, burst=16, initial_concurrency=8,
+                                 max_concurrency=64, latency_target=20.0),
+    "embeddings": EndpointLimits(rate_per_second=8, burst=16, initial_concurrency=4,
+                                 max_concurrency=32, latency_target=5.0),
+    "watsonx_admin": EndpointLimits(rate_per_second=2, burst=4, initial_concurrency=1,
+                                    max_concurrency=2, latency_target=10.0)
+}
+
+
+class RateLimitedError(RuntimeError):
+    """El servicio siguió respondiendo 429 tras agotar los reintentos"""
+
+
+def is_rate_limited(error: BaseException) -> bool:
+    """True si la excepción corresponde a un HTTP 429 (SDK de IBM, urllib o cliente asíncrono)"""
+    for attribute in ("code", "status", "status_code"):
+        if getattr(error, attribute, None) == 429:
+            return True
+    return "HTTP 429" in str(error) or "Too Many Requests" in str(error)
+
+
+def retry_after(error: BaseException) -> Optional[float]:
+    """Segundos indicados por la cabecera Retry-After de la respuesta 429, si existe"""
+    headers = getattr(error, "headers", None)
+    if headers is None:
+        headers = getattr(getattr(error, "http_response", None), "headers", None)
+    try:
+        value = headers.get("Retry-After") or headers.get("retry-after") if headers else None
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """Token bucket clásico; no es thread-safe por sí solo (lo protege el EndpointLimiter)"""
+
+    def __init__(self, rate_per_second: float, burst: int):
+        self.rate = rate_per_second
+        self.capacity = float(burst)
+        self.tokens = float(burst)
+        self.updated_at = time.monotonic()
+
+    def try_take(self) -> float:
+        """Toma un token y retorna 0, o retorna los segundos hasta que haya uno"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return 0.0
+        return (1.0 - self.tokens) / self.rate
+
+
+class EndpointLimiter:
+    """
+    Admisión de llamadas a un endpoint: cada llamada necesita un token del
+    bucket y un lugar dentro del límite de concurrencia.
+
+    El límite se ajusta con AIMD: cada respuesta rápida suma 1/límite (≈ +1
+    por ronda completa), y un 429 o una latencia sobre `latency_target` lo
+    multiplica por `decrease_factor`. Solo las llamadas iniciadas después de
+    la última reducción pueden volver a reducirlo, así que una ráfaga de
+    respuestas lentas simultáneas cuenta como una sola señal.
+
+    Sirve tanto a hilos (`acquire`) como a corrutinas (`acquire_async`).
+    """
+
+    def __init__(self, name: str, limits: EndpointLimits):
+        self.name = name
+        self.limits = limits
+        self.bucket = TokenBucket(limits.rate_per_second, limits.burst)
+        self.concurrency_limit = float(limits.initial_concurrency)
+        self.in_flight = 0
+
+        self.admitted = 0
+        self.rate_limited = 0
+        self.slow_responses = 0
+        self.decreases = 0
+        self.waited_seconds = 0.0
+
+        self._last_decrease_at = 0.0
+        self._condition = threading.Condition()
+        self._async_waiters: Deque[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = deque()
+
+    def acquire(self, timeout: Optional[float] = None) -> float:
+        """Bloquea hasta ser admitido; retorna el instante de admisión"""
+        start = time.monotonic()
+        deadline = None if timeout is None else start + timeout
+        with self._condition:
+            while True:
+                wait = self._try_admit()
+                if wait == 0:
+                    admitted_at = time.monotonic()
+                    self.waited_seconds += admitted_at - start
+                    return admitted_at
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise TimeoutError(f"Sin capacidad en '{self.name}' tras {timeout}s")
+                self._condition.wait(wait if wait > 0 and (remaining is None or wait < remaining) else remaining)
+
+    async def acquire_async(self) -> float:
+        """Versión para corrutinas (el timeout lo impone el llamador con asyncio.wait_for)"""
+        loop = asyncio.get_running_loop()
+        start = time.monotonic()
+        while True:
+            with self._condition:
+                wait = self._try_admit()
+                if wait == 0:
+                    admitted_at = time.monotonic()
+                    self.waited_seconds += admitted_at - start
+                    return admitted_at
+                if wait < 0:
+                    released = loop.create_future()
+                    self._async_waiters.append((loop, released))
+            if wait > 0:
+                await asyncio.sleep(wait)
+            else:
+                await released
+
+    def release(self, admitted_at: float, latency: float, rate_limited: bool = False) -> None:
+        """Libera el lugar y ajusta el límite con el resultado de la llamada"""
+        limits = self.limits
+        with self._condition:
+            self.in_flight -= 1
+            slow = latency > limits.latency_target
+            if rate_limited or slow:
+                self.rate_limited += rate_limited
+                self.slow_responses += slow
+                if admitted_at > self._last_decrease_at:
+                    self.concurrency_limit = max(float(limits.min_concurrency),
+                                                 self.concurrency_limit * limits.decrease_factor)
+                    self._last_decrease_at = time.monotonic()
+                    self.decreases += 1
+            else:
+                self.concurrency_limit = min(float(limits.max_concurrency),
+                                             self.concurrency_limit + 1.0 / self.concurrency_limit)
+
+            self._condition.notify_all()
+            waiters, self._async_waiters = self._async_waiters, deque()
+        for loop, released in waiters:
+            try:
+                loop.call_soon_threadsafe(_resolve, released)
+            except RuntimeError:
+                pass  # loop ya cerrado: el solicitante ya no espera
+
+    def stats(self) -> Dict[str, Any]:
+        with self._condition:
+            return {
+                "concurrency_limit": round(self.concurrency_limit, 2),
+                "in_flight": self.in_flight,
+                "admitted": self.admitted,
+                "rate_limited": self.rate_limited,
+                "slow_responses": self.slow_responses,
+                "decreases": self.decreases,
+                "waited_seconds": round(self.waited_seconds, 3)
+            }
+
+    def _try_admit(self) -> float:
+        """0 = admitido; >0 = esperar token; <0 = esperar a que se libere un lugar"""
+        if self.in_flight >= int(self.concurrency_limit):
+            return -1.0
+        wait = self.bucket.try_take()
+        if wait == 0:
+            self.in_flight += 1
+            self.admitted += 1
+        return wait
+
+
+def _resolve(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+class ClientRateLimiter:
+    """
+    Limitador compartido del lado del cliente: un EndpointLimiter por
+    familia de llamadas (consulta Discovery, carga, generación, embeddings…).
+
+    `call` / `call_async` ejecutan la llamada dentro de un lugar admitido y,
+    ante un 429, reintentan hasta `max_retries` veces respetando Retry-After
+    (o un backoff exponencial); si se agotan lanzan RateLimitedError.
+    """
+
+    def __init__(self, endpoints: Optional[Dict[str, EndpointLimits]] = None,
+                 max_retries: int = 3, backoff_seconds: float = 0.5):
+        self.endpoint_limits = dict(DEFAULT_ENDPOINT_LIMITS if endpoints is None else endpoints)
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self._endpoints: Dict[str, EndpointLimiter] = {}
+        self._lock = threading.Lock()
+
+    def endpoint(self, name: str) -> EndpointLimiter:
+        with self._lock:
+            if name not in self._endpoints:
+                limits = self.endpoint_limits.get(name) or EndpointLimits(rate_per_second=5, burst=10)
+                self._endpoints[name] = EndpointLimiter(name, limits)
+            return self._endpoints[name]
+
+    @contextmanager
+    def slot(self, name: str, timeout: Optional[float] = None):
+        """Lugar admitido para una llamada (la latencia y los 429 alimentan el AIMD)"""
+        limiter = self.endpoint(name)
+        admitted_at = limiter.acquire(timeout)
+        rate_limited = False
+        try:
+            yield
+        except BaseException as e:
+            rate_limited = is_rate_limited(e)
+            raise
+        finally:
+            limiter.release(admitted_at, time.monotonic() - admitted_at, rate_limited)
+
+    @asynccontextmanager
+    async def slot_async(self, name: str):
+        limiter = self.endpoint(name)
+        admitted_at = await limiter.acquire_async()
+        rate_limited = False
+        try:
+            yield
+        except BaseException as e:
+            rate_limited = is_rate_limited(e)
+            raise
+        finally:
+            limiter.release(admitted_at, time.monotonic() - admitted_at, rate_limited)
+
+    def call(self, name: str, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """Ejecuta `fn(*args, **kwargs)` bajo el límite de `name`"""
+        for attempt in range(self.max_retries + 1):
+            try:
+                with self.slot(name):
+                    return fn(*args, **kwargs)
+            except Exception as e:
+                if not is_rate_limited(e):
+                    raise
+                if attempt == self.max_retries:
+                    raise RateLimitedError(f"'{name}' sigue limitado tras {attempt + 1} intentos: {e}") from e
+                time.sleep(self._retry_delay(e, attempt))
+
+    async def call_async(self, name: str, coroutine_fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Ejecuta `await coroutine_fn()` bajo el límite de `name`"""
+        for attempt in range(self.max_retries + 1):
+            try:
+                async with self.slot_async(name):
+                    return await coroutine_fn()
+            except Exception as e:
+                if not is_rate_limited(e):
+                    raise
+                if attempt == self.max_retries:
+                    raise RateLimitedError(f"'{name}' sigue limitado tras {attempt + 1} intentos: {e}") from e
+                await asyncio.sleep(self._retry_delay(e, attempt))
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            endpoints = dict(self._endpoints)
+        return {name: limiter.stats() for name, limiter in endpoints.items()}
+
+    def _retry_delay(self, error: BaseException, attempt: int) -> float:
+        delay = retry_after(error)
+        return delay if delay is not None else self.backoff_seconds * (2 ** attempt)
+
+
+_shared_limiter: Optional[ClientRateLimiter] = None
+_shared_lock = threading.Lock()
+
+
+def shared_rate_limiter() -> ClientRateLimiter:
+    """Limitador único del proceso, compartido por setup, integración de dataset y sistema RAG"""
+    global _shared_limiter
+    with _shared_lock:
+        if _shared_limiter is None:
+            _shared_limiter = ClientRateLimiter(max_retries=int(os.getenv("WATSON_MAX_RETRIES", "3")))
+        return _shared_limiter
@@ -0,0 +1,148 @@
+# Reranking de segunda etapa para DECODE-EV RAG
+# Matriz de características por candidato y score lineal en una sola pasada vectorizada
+
+import re
+import numpy as np
+import pandas as pd
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Optional, Sequence
+
+from lexical_index import fold_accents, tokenize
+from vector_index import top_k_indices
+
+# Campos de metadatos que se buscan mencionados en la consulta
+MENTION_FIELDS = ("red_can", "evento_vehiculo")
+
+
+def detect_metadata_mentions(query: str, known_values: Mapping[str, Iterable[Any]]) -> Dict[str, List[str]]:
+    """
+    Valores conocidos de cada campo (p. ej. red_can, evento_vehiculo)
+    mencionados en la consulta como palabra completa, sin distinguir tildes
+    ni mayúsculas. Retorna solo los campos con alguna mención.
+    """
+    folded_query = fold_accents(query)
+    mentions = {}
+    for field, values in known_values.items():
+        found = [value for value in values if isinstance(value, str) and value and
+                 re.search(rf"(?<!\w){re.escape(fold_accents(value))}(?!\w)", folded_query)]
+        if found:
+            mentions[field] = found
+    return mentions
+
+
+def _metadata_value(doc: Mapping[str, Any], field: str) -> Any:
+    metadata = doc.get('metadata', {})
+    if field == "evento_vehiculo":
+        return metadata.get('evento_vehiculo', metadata.get('event_type'))
+    return metadata.get(field, doc.get(field))
+
+
+class FeatureReranker:
+    """
+    Reranker de segunda etapa sobre los candidatos del retrieval.
+
+    Por candidato se calcula una fila de características en [0, 1]:
+    - lexical_overlap: fracción (ponderada por IDF) de términos de la consulta presentes
+    - metadata_match: coincidencia con la red CAN / evento mencionados en la consulta
+    - recency: decaimiento exponencial respecto al candidato más reciente
+    - technical_density: technical_density_score relativo al máximo de los candidatos
+    - dense_score: score de entrada del retrieval (recortado a [0, 1])
+
+    El score final es el producto de la matriz por los pesos; se descartan los
+    candidatos bajo `score_threshold` y se conservan los `top_k` mejores
+    (al menos `min_documents`, aunque no alcancen el umbral).
+    """
+
+    FEATURES = ("lexical_overlap", "metadata_match", "recency", "technical_density", "dense_score")
+    DEFAULT_WEIGHTS = {
+        "lexical_overlap": 0.35,
+        "metadata_match": 0.2,
+        "recency": 0.1,
+        "technical_density": 0.1,
+        "dense_score": 0.25
+    }
+
+    def __init__(self, top_k: int = 5, score_threshold: float = 0.5,
+                 weights: Optional[Mapping[str, float]] = None,
+                 recency_half_life_days: float = 30.0, min_documents: int = 1):
+        self.top_k = top_k
+        self.score_threshold = score_threshold
+        self.recency_half_life_days = recency_half_life_days
+        self.min_documents = min_documents
+
+        weights = {**self.DEFAULT_WEIGHTS, **(weights or {})}
+        self.weights = np.array([weights[name] for name in self.FEATURES], dtype=np.float64)
+
+    def feature_matrix(self, query: str, documents: Sequence[Mapping[str, Any]],
+                       mentions: Optional[Mapping[str, Sequence[str]]] = None,
+                       idf: Optional[Callable[[str], float]] = None,
+                       query_terms: Optional[Sequence[str]] = None) -> np.ndarray:
+        """
+        Matriz (n_candidatos x n_características). `query_terms` evita
+        volver a tokenizar una consulta ya preprocesada.
+        """
+        features = np.zeros((len(documents), len(self.FEATURES)))
+        if not documents:
+            return features
+
+        features[:, 0] = self._lexical_overlap(query_terms if query_terms is not None else tokenize(query),
+                                               documents, idf)
+        features[:, 1] = self._metadata_match(documents, mentions or {})
+        features[:, 2] = self._recency(documents)
+
+        density = np.array([float(doc.get('technical_density_score', 0) or 0) for doc in documents])
+        max_density = density.max()
+        features[:, 3] = density / max_density if max_density > 0 else 0.0
+
+        features[:, 4] = np.clip([float(doc.get('score', 0) or 0) for doc in documents], 0.0, 1.0)
+        return features
+
+    def rerank(self, query: str, documents: Sequence[Dict[str, Any]],
+               mentions: Optional[Mapping[str, Sequence[str]]] = None,
+               idf: Optional[Callable[[str], float]] = None,
+               query_terms: Optional[Sequence[str]] = None) -> List[Dict[str, Any]]:
+        """Candidatos reordenados con `rerank_score`, acotados a `top_k`"""
+        if not documents:
+            return []
+
+        scores = self.feature_matrix(query, documents, mentions, idf, query_terms) @ self.weights
+        order = top_k_indices(scores, self.top_k)
+
+        passing = scores[order] >= self.score_threshold
+        keep = max(int(passing.sum()), min(self.min_documents, order.size))
+        return [{**documents[i], "rerank_score": float(scores[i])} for i in order[:keep].tolist()]
+
+    @staticmethod
+    def _lexical_overlap(query_terms: Sequence[str], documents: Sequence[Mapping[str, Any]],
+                         idf: Optional[Callable[[str], float]]) -> np.ndarray:
+        terms = list(dict.fromkeys(query_terms))
+        if not terms:
+            return np.zeros(len(documents))
+
+        term_weights = np.array([idf(term) if idf else 1.0 for term in terms])
+        present = np.array([[term in doc_terms for term in terms]
+                            for doc_terms in (set(tokenize(doc.get('text', ''))) for doc in documents)])
+        total = term_weights.sum()
+        return present @ term_weights / total if total > 0 else present.mean(axis=1)
+
+    @staticmethod
+    def _metadata_match(documents: Sequence[Mapping[str, Any]], mentions: Mapping[str, Sequence[str]]) -> np.ndarray:
+        if not mentions:
+            return np.zeros(len(documents))
+
+        matches = np.array([[_metadata_value(doc, field) in values for field, values in mentions.items()]
+                            for doc in documents])
+        return matches.mean(axis=1)
+
+    def _recency(self, documents: Sequence[Mapping[str, Any]]) -> np.ndarray:
+        timestamps = pd.to_datetime(
+            pd.Series([doc.get('metadata', {}).get('timestamp',
+                                                   doc.get('metadata', {}).get('timestamp_inicio'))
+                       for doc in documents], dtype=object),
+            errors="coerce", utc=True, format="ISO8601"
+        )
+        if timestamps.isna().all():
+            return np.zeros(len(documents))
+
+        age_days = (timestamps.max() - timestamps).dt.total_seconds().to_numpy() / 86400.0
+        recency = np.power(0.5, age_days / self.recency_half_life_days)
+        return np.nan_to_num(recency, nan=0.0)
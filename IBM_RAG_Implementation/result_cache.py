@@ -0,0 +1,320 @@
+# Caché de resultados de consultas para DECODE-EV RAG
+# LRU acotado con TTL, invalidado por la versión del corpus/índices, caché semántica
+# por similitud de embeddings y coalescencia (single-flight) de consultas idénticas en vuelo
+
+import time
+import asyncio
+import threading
+from collections import OrderedDict, deque
+from dataclasses import fields
+from typing import Any, Awaitable, Callable, Deque, Dict, Hashable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from lexical_index import fold_accents
+from metadata_filters import filters_key
+
+_EDGE_PUNCTUATION = "¿?¡!.,;: "
+
+
+def normalize_question(question: str) -> str:
+    """Forma normalizada de la pregunta: sin tildes, minúsculas, espacios colapsados"""
+    return " ".join(fold_accents(question).split()).strip(_EDGE_PUNCTUATION)
+
+
+def query_cache_key(query: Any, version: Hashable) -> Tuple:
+    """
+    Clave de caché de un RAGQuery: pregunta normalizada + resto de parámetros
+    (filtros en forma canónica) + versión del corpus
+    """
+    params = []
+    for field in fields(query):
+        value = getattr(query, field.name)
+        if field.name == "question":
+            value = normalize_question(value)
+        elif field.name == "context_filters":
+            value = filters_key(value)
+        params.append((field.name, value))
+    return tuple(params) + (("version", version),)
+
+
+class QueryResultCache:
+    """
+    Caché LRU con expiración por TTL (segura entre hilos).
+    Las entradas se invalidan explícitamente con `clear()` al cambiar el corpus.
+    """
+
+    def __init__(self, max_entries: int = 256, ttl_seconds: float = 300.0,
+                 clock: Callable[[], float] = time.monotonic):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Valor vigente para `key` (None si no existe o expiró)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.clock() - entry[0] <= self.ttl_seconds:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._entries[key] = (self.clock(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0
+        }
+
+
+class SemanticAnswerCache:
+    """
+    Caché semántica de respuestas: reutiliza la respuesta de una pregunta
+    equivalente redactada de otra forma. Solo sirve con embeddings
+    semánticos (p. ej. Slate); con feature hashing dos paráfrasis comparten
+    pocos n-gramas y su coseno queda lejos de cualquier umbral útil.
+
+    Cada entrada guarda (embedding normalizado, alcance, versión, respuesta).
+    `get` compara el embedding de la consulta contra las entradas vigentes
+    del mismo alcance (filtros y demás parámetros en forma canónica) y de la
+    misma versión del corpus con un solo producto matriz-vector, y retorna
+    la más similar si su coseno alcanza `similarity_threshold`.
+
+    Las similitudes de los aciertos (y la mejor de cada fallo) quedan en
+    `stats()` para ajustar el umbral. Al llenarse se reemplaza la entrada
+    usada hace más tiempo.
+    """
+
+    def __init__(self, dimension: int, max_entries: int = 512, similarity_threshold: float = 0.92,
+                 ttl_seconds: float = 3600.0, clock: Callable[[], float] = time.monotonic, history: int = 100):
+        self.dimension = dimension
+        self.max_entries = max_entries
+        self.similarity_threshold = similarity_threshold
+        self.ttl_seconds = ttl_seconds
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+
+        self._matrix = np.zeros((max_entries, dimension), dtype=np.float32)
+        self._scopes: List[Optional[Tuple[Hashable, Hashable]]] = [None] * max_entries
+        self._stored_at = np.zeros(max_entries)
+        self._used_at = np.full(max_entries, -np.inf)
+        self._entries: List[Optional[Tuple[str, Any]]] = [None] * max_entries
+        self._hit_similarities: Deque[Tuple[str, str, float]] = deque(maxlen=history)
+        self._miss_similarities: Deque[float] = deque(maxlen=history)
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return sum(entry is not None for entry in self._entries)
+
+    def get(self, embedding: Sequence[float], scope: Hashable, version: Hashable,
+            question: str = "") -> Optional[Tuple[Any, float]]:
+        """(respuesta, similitud) de la entrada más cercana sobre el umbral, o None"""
+        query = self._normalize(embedding)
+        with self._lock:
+            now = self.clock()
+            valid = np.fromiter((s == (scope, version) for s in self._scopes), dtype=bool, count=self.max_entries)
+            valid &= now - self._stored_at <= self.ttl_seconds
+            if not valid.any():
+                self.misses += 1
+                return None
+
+            similarities = np.where(valid, self._matrix @ query, -np.inf)
+            slot = int(np.argmax(similarities))
+            similarity = float(similarities[slot])
+            if similarity < self.similarity_threshold:
+                self.misses += 1
+                self._miss_similarities.append(similarity)
+                return None
+
+            self.hits += 1
+            self._used_at[slot] = now
+            cached_question, value = self._entries[slot]
+            self._hit_similarities.append((question, cached_question, similarity))
+            return value, similarity
+
+    def put(self, embedding: Sequence[float], scope: Hashable, version: Hashable, value: Any,
+            question: str = "") -> None:
+        vector = self._normalize(embedding)
+        with self._lock:
+            now = self.clock()
+            expired = (now - self._stored_at > self.ttl_seconds) | np.fromiter(
+                (entry is None for entry in self._entries), dtype=bool, count=self.max_entries)
+            slot = int(np.argmax(expired)) if expired.any() else int(np.argmin(self._used_at))
+
+            self._matrix[slot] = vector
+            self._scopes[slot] = (scope, version)
+            self._stored_at[slot] = now
+            self._used_at[slot] = now
+            self._entries[slot] = (question, value)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._scopes = [None] * self.max_entries
+            self._entries = [None] * self.max_entries
+            self._used_at[:] = -np.inf
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            hit_similarities = [similarity for _, _, similarity in self._hit_similarities]
+            return {
+                "entries": sum(entry is not None for entry in self._entries),
+                "similarity_threshold": self.similarity_threshold,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "mean_hit_similarity": float(np.mean(hit_similarities)) if hit_similarities else None,
+                "min_hit_similarity": min(hit_similarities) if hit_similarities else None,
+                "best_miss_similarity": max(self._miss_similarities) if self._miss_similarities else None,
+                "recent_hits": list(self._hit_similarities)
+            }
+
+    def _normalize(self, embedding: Sequence[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32).reshape(self.dimension)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+
+class InFlightCall:
+    """Cómputo en curso para una clave; los seguidores esperan su resultado"""
+
+    def __init__(self):
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self._done = threading.Event()
+
+    def wait(self, timeout: Optional[float] = None) -> Any:
+        if not self._done.wait(timeout):
+            raise TimeoutError("El cómputo compartido no terminó a tiempo")
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class SingleFlight:
+    """
+    Coalescencia de llamadas concurrentes con la misma clave (segura entre hilos).
+
+    La primera llamada (líder) ejecuta el cómputo; las que llegan mientras
+    está en vuelo esperan y reciben el mismo resultado (o la misma excepción).
+    Al terminar la clave se libera, así que llamadas posteriores vuelven a
+    ejecutar (normalmente encuentran el resultado en QueryResultCache).
+    """
+
+    def __init__(self):
+        self.executed = 0
+        self.coalesced = 0
+        self._calls: Dict[Hashable, InFlightCall] = {}
+        self._lock = threading.Lock()
+
+    def begin(self, key: Hashable) -> Tuple[InFlightCall, bool]:
+        """(llamada en vuelo, es_líder); el líder debe llamar `finish`"""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self.coalesced += 1
+                return call, False
+            call = self._calls[key] = InFlightCall()
+            self.executed += 1
+            return call, True
+
+    def finish(self, key: Hashable, call: InFlightCall, result: Any = None,
+               error: Optional[BaseException] = None) -> None:
+        """Publica el resultado (o el error) del líder; solo cuenta la primera llamada"""
+        with self._lock:
+            if call._done.is_set():
+                return
+            if self._calls.get(key) is call:
+                del self._calls[key]
+            call.result, call.error = result, error
+            call._done.set()
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """(resultado, compartido): ejecuta `fn` o espera al líder en vuelo"""
+        call, leader = self.begin(key)
+        if not leader:
+            return call.wait(), True
+
+        try:
+            result = fn()
+        except BaseException as e:
+            self.finish(key, call, error=e)
+            raise
+        self.finish(key, call, result)
+        return result, False
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"in_flight": len(self._calls), "executed": self.executed, "coalesced": self.coalesced}
+
+
+class AsyncSingleFlight:
+    """
+    Igual que SingleFlight para corrutinas de un mismo event loop.
+    El cómputo corre en su propia tarea: cancelar a un solicitante no afecta
+    a los demás, y la tarea solo se cancela cuando se cancela el último que
+    la esperaba.
+    """
+
+    def __init__(self):
+        self.executed = 0
+        self.coalesced = 0
+        self._calls: Dict[Hashable, asyncio.Task] = {}
+        self._waiters: Dict[asyncio.Task, int] = {}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """(resultado, compartido)"""
+        task = self._calls.get(key)
+        shared = task is not None
+        if shared:
+            self.coalesced += 1
+        else:
+            task = self._calls[key] = asyncio.ensure_future(fn())
+            task.add_done_callback(lambda done: self._calls.pop(key, None) if self._calls.get(key) is done else None)
+            self.executed += 1
+
+        self._waiters[task] = self._waiters.get(task, 0) + 1
+        try:
+            return await asyncio.shield(task), shared
+        except asyncio.CancelledError:
+            if self._waiters[task] == 1 and not task.done():
+                task.cancel()
+            raise
+        finally:
+            self._waiters[task] -= 1
+            if not self._waiters[task]:
+                del self._waiters[task]
+
+    def stats(self) -> Dict[str, Any]:
+        return {"in_flight": len(self._calls), "executed": self.executed, "coalesced": self.coalesced}
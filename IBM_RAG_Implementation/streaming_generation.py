@@ -0,0 +1,209 @@
+# Generación en streaming para DECODE-EV RAG
+# Cliente SSE de watsonx.ai (text/generation_stream) y flujo de fragmentos con time-to-first-token
+
+import json
+import time
+import asyncio
+import threading
+import urllib.parse
+import urllib.request
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional
+
+IAM_URL = "https://iam.cloud.ibm.com/identity/token"
+GENERATION_API_VERSION = "2023-05-29"
+
+_DONE = object()
+
+
+def text_chunks(text: str, words_per_chunk: int = 4) -> Iterator[str]:
+    """Divide un texto ya generado en fragmentos de pocas palabras (conserva los espacios)"""
+    words = text.split(" ")
+    for start in range(0, len(words), words_per_chunk):
+        chunk = " ".join(words[start:start + words_per_chunk])
+        yield chunk if start + words_per_chunk >= len(words) else chunk + " "
+
+
+class GenerationStream:
+    """
+    Fragmentos de texto de una generación a medida que llegan.
+
+    Se consume con `for` o `async for` (el iterador síncrono corre en el
+    executor por defecto del loop). Mientras se consume acumula `text` y
+    registra el instante del primer fragmento no vacío; al agotarse llama a
+    `finalize(stream)` y guarda su valor en `result` (p. ej. la respuesta
+    RAG completa). Los tiempos se miden desde `started_at`, que puede ser
+    anterior a la creación del flujo (inicio de la consulta).
+    """
+
+    def __init__(self, chunks: Iterable[str], started_at: Optional[float] = None,
+                 finalize: Optional[Callable[["GenerationStream"], Any]] = None):
+        self._chunks = chunks
+        self._finalize = finalize
+        self._consumed = False
+        self.started_at = time.time() if started_at is None else started_at
+        self.first_chunk_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.parts = []
+        self.result: Any = None
+
+    @property
+    def text(self) -> str:
+        return "".join(self.parts)
+
+    @property
+    def done(self) -> bool:
+        return self.finished_at is not None
+
+    @property
+    def time_to_first_token(self) -> Optional[float]:
+        """Segundos hasta el primer fragmento (None si aún no llega ninguno)"""
+        if self.first_chunk_at is None:
+            return None
+        return self.first_chunk_at - self.started_at
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished_at or time.time()) - self.started_at
+
+    def __iter__(self) -> Iterator[str]:
+        if self._consumed:
+            raise RuntimeError("El flujo de generación ya fue consumido")
+        self._consumed = True
+
+        chunks = iter(self._chunks)
+        try:
+            for chunk in chunks:
+                if not chunk:
+                    continue
+                if self.first_chunk_at is None:
+                    self.first_chunk_at = time.time()
+                self.parts.append(chunk)
+                yield chunk
+        finally:
+            # Consumo abandonado: cerrar también el generador de origen (libera la conexión)
+            if self.finished_at is None and hasattr(chunks, "close"):
+                chunks.close()
+
+        self.finished_at = time.time()
+        if self._finalize is not None:
+            self.result = self._finalize(self)
+
+    async def __aiter__(self):
+        loop = asyncio.get_running_loop()
+        iterator = iter(self)
+        while True:
+            chunk = await loop.run_in_executor(None, next, iterator, _DONE)
+            if chunk is _DONE:
+                return
+            yield chunk
+
+    def read(self) -> str:
+        """Consume el flujo completo y retorna el texto generado"""
+        for _ in self:
+            pass
+        return self.text
+
+
+class GraniteStreamClient:
+    """
+    Cliente REST mínimo para los endpoints de generación de watsonx.ai:
+    streaming (`/ml/v1/text/generation_stream`, Server-Sent Events) y
+    respuesta completa (`/ml/v1/text/generation`).
+
+    El token IAM se obtiene con la API key y se reutiliza hasta un minuto
+    antes de su expiración. Solo usa la librería estándar, así que también
+    funciona contra el servidor local de pruebas (fake_watson_server).
+    """
+
+    def __init__(self, url: str, api_key: str, project_id: str,
+                 model_id: str = "ibm/granite-13b-chat-v2", iam_url: str = IAM_URL,
+                 version: str = GENERATION_API_VERSION, timeout: float = 60.0):
+        self.url = url.rstrip("/")
+        self.api_key = api_key
+        self.project_id = project_id
+        self.model_id = model_id
+        self.iam_url = iam_url
+        self.version = version
+        self.timeout = timeout
+
+        self._token: Optional[str] = None
+        self._token_expiration = 0.0
+        self._token_lock = threading.Lock()
+
+    def stream(self, prompt: str, parameters: Optional[Dict[str, Any]] = None) -> Iterator[str]:
+        """Fragmentos de `generated_text` en el orden en que llegan"""
+        body = json.dumps({
+            "model_id": self.model_id,
+            "input": prompt,
+            "parameters": parameters or {},
+            "project_id": self.project_id
+        }).encode("utf-8")
+        request = urllib.request.Request(
+            f"{self.url}/ml/v1/text/generation_stream?version={self.version}",
+            data=body,
+            headers={
+                "Authorization": f"Bearer {self._access_token()}",
+                "Content-Type": "application/json",
+                "Accept": "text/event-stream"
+            },
+            method="POST"
+        )
+
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            event = "message"
+            for raw_line in response:
+                line = raw_line.decode("utf-8").rstrip("\r\n")
+                if line.startswith("event:"):
+                    event = line[6:].strip()
+                elif line.startswith("data:"):
+                    payload = json.loads(line[5:].strip() or "{}")
+                    if event == "error" or "errors" in payload:
+                        raise RuntimeError(f"Error en generation_stream: {payload}")
+                    for result in payload.get("results", []):
+                        if result.get("generated_text"):
+                            yield result["generated_text"]
+                elif not line:
+                    event = "message"
+
+    def generate(self, prompt: str, parameters: Optional[Dict[str, Any]] = None) -> str:
+        """Generación completa (`/ml/v1/text/generation`) de un solo prompt"""
+        body = json.dumps({
+            "model_id": self.model_id,
+            "input": prompt,
+            "parameters": parameters or {},
+            "project_id": self.project_id
+        }).encode("utf-8")
+        request = urllib.request.Request(
+            f"{self.url}/ml/v1/text/generation?version={self.version}",
+            data=body,
+            headers={
+                "Authorization": f"Bearer {self._access_token()}",
+                "Content-Type": "application/json",
+                "Accept": "application/json"
+            },
+            method="POST"
+        )
+
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            payload = json.loads(response.read().decode("utf-8"))
+        if "errors" in payload:
+            raise RuntimeError(f"Error en text/generation: {payload}")
+        return payload["results"][0].get("generated_text", "")
+
+    def _access_token(self) -> str:
+        with self._token_lock:
+            if self._token is None or time.time() > self._token_expiration - 60:
+                data = urllib.parse.urlencode({
+                    "grant_type": "urn:ibm:params:oauth:grant-type:apikey",
+                    "apikey": self.api_key
+                }).encode("utf-8")
+                request = urllib.request.Request(
+                    self.iam_url, data=data,
+                    headers={"Content-Type": "application/x-www-form-urlencoded", "Accept": "application/json"},
+                    method="POST"
+                )
+                with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                    token = json.loads(response.read().decode("utf-8"))
+                self._token = token["access_token"]
+                self._token_expiration = float(token.get("expiration", time.time() + token.get("expires_in", 3600)))
+            return self._token
@@ -4,7 +4,6 @@
 import streamlit as st
 import pandas as pd
 import json
-import jsonlines
 import plotly.express as px
 import plotly.graph_objects as go
 from datetime import datetime, timedelta
@@ -95,19 +94,34 @@ def render_header():
     </div>
     """, unsafe_allow_html=True)
 
+@st.cache_resource(show_spinner=False)
+def get_shared_rag_system(dataset_path: str) -> "DecodeEVRAGSystem":
+    """
+    Sistema RAG compartido por todas las sesiones del dashboard: una sola
+    caché de resultados y un solo single-flight, así que la misma pregunta
+    hecha desde varias sesiones a la vez se ejecuta una vez
+    """
+    rag_system = DecodeEVRAGSystem()
+    if not rag_system.load_processed_dataset(dataset_path):
+        # Las excepciones no quedan en caché: el siguiente intento vuelve a cargar
+        raise RuntimeError("Error cargando dataset procesado")
+    return rag_system
+
 def load_rag_system():
     """Carga e inicializa el sistema RAG"""
     if st.session_state.rag_system is None:
         with st.spinner("🔄 Inicializando sistema RAG..."):
             try:
-                # Inicializar sistema RAG
-                rag_system = DecodeEVRAGSystem()
-                
                 # Buscar dataset procesado
                 dataset_path = Path(__file__).parent / "dataset_processed_watsonx.jsonl"
                 
                 if dataset_path.exists():
-                    if rag_system.load_processed_dataset(str(dataset_path)):
+                    try:
+                        rag_system = get_shared_rag_system(str(dataset_path))
+                    except RuntimeError:
+                        rag_system = None
+                    
+                    if rag_system is not None:
                         st.session_state.rag_system = rag_system
                         st.session_state.dataset_loaded = True
                         st.session_state.system_stats = rag_system.get_system_statistics()
@@ -228,46 +242,60 @@ def execute_query(query: str, config: Dict):
         max_tokens=config['max_tokens']
     )
     
-    # Mostrar indicador de progreso
-    with st.spinner("🤔 Procesando consulta..."):
-        start_time = time.time()
+    start_time = time.time()
+    
+    try:
+        # Recuperación y contexto (el spinner solo cubre esta parte)
+        with st.spinner("🤔 Procesando consulta..."):
+            stream = st.session_state.rag_system.query_rag_stream(rag_query)
         
-        try:
-            # Ejecutar consulta
-            response = st.session_state.rag_system.query_rag(rag_query)
-            processing_time = time.time() - start_time
-            
-            # Agregar a historial
-            st.session_state.query_history.append({
-                'timestamp': datetime.now(),
-                'query': query,
-                'response': response,
-                'processing_time': processing_time
-            })
-            
-            # Renderizar respuesta
-            render_response(query, response, processing_time)
-            
-        except Exception as e:
-            st.error(f"❌ Error ejecutando consulta: {e}")
+        # Respuesta parcial a medida que llegan los fragmentos
+        st.markdown("## 💬 Respuesta del Sistema")
+        partial_answer = st.empty()
+        for _ in stream:
+            partial_answer.markdown(stream.text + "▌")
+        partial_answer.empty()
+        
+        response = stream.result
+        processing_time = time.time() - start_time
+        
+        # Agregar a historial
+        st.session_state.query_history.append({
+            'timestamp': datetime.now(),
+            'query': query,
+            'response': response,
+            'processing_time': processing_time,
+            'time_to_first_token': response.time_to_first_token
+        })
+        
+        # Renderizar respuesta
+        render_response(query, response, processing_time, show_title=False)
+        
+    except Exception as e:
+        st.error(f"❌ Error ejecutando consulta: {e}")
 
-def render_response(query: str, response: RAGResponse, processing_time: float):
+def render_response(query: str, response: RAGResponse, processing_time: float, show_title: bool = True):
     """Renderiza respuesta del sistema RAG"""
-    st.markdown("## 💬 Respuesta del Sistema")
+    if show_title:
+        st.markdown("## 💬 Respuesta del Sistema")
     
     # Métricas de la consulta
-    col1, col2, col3, col4 = st.columns(4)
+    col1, col2, col3, col4, col5 = st.columns(5)
     
     with col1:
         st.metric("⏱️ Tiempo de Respuesta", f"{processing_time:.2f}s")
     
     with col2:
-        st.metric("📊 Confianza", f"{response.confidence_score:.2%}")
+        ttft = response.time_to_first_token
+        st.metric("⚡ Primer Token", f"{ttft:.2f}s" if ttft is not None else "N/A")
     
     with col3:
-        st.metric("📄 Documentos", len(response.retrieved_documents))
+        st.metric("📊 Confianza", f"{response.confidence_score:.2%}")
     
     with col4:
+        st.metric("📄 Documentos", len(response.retrieved_documents))
+    
+    with col5:
         st.metric("📝 Contexto", f"{response.metadata.get('context_length', 0)} chars")
     
     # Respuesta principal
@@ -318,6 +346,7 @@ def render_analytics():
             'timestamp': item['timestamp'],
             'query': item['query'][:50] + "..." if len(item['query']) > 50 else item['query'],
             'processing_time': item['processing_time'],
+            'time_to_first_token': item.get('time_to_first_token'),
             'confidence': item['response'].confidence_score,
             'documents_used': len(item['response'].retrieved_documents)
         }
@@ -332,7 +361,10 @@ def render_analytics():
     
     with col2:
         avg_time = history_df['processing_time'].mean()
-        st.metric("⏱️ Tiempo Promedio", f"{avg_time:.2f}s")
+        avg_ttft = history_df['time_to_first_token'].mean()
+        st.metric("⏱️ Tiempo Promedio", f"{avg_time:.2f}s",
+                  delta=f"primer token {avg_ttft:.2f}s" if pd.notna(avg_ttft) else None,
+                  delta_color="off")
     
     with col3:
         avg_confidence = history_df['confidence'].mean() 
@@ -346,15 +378,14 @@ def render_analytics():
     col1, col2 = st.columns(2)
     
     with col1:
-        # Tiempo de procesamiento por consulta
+        # Tiempo de procesamiento y time-to-first-token por consulta
         fig_time = px.line(
             history_df.reset_index(), 
             x='index', 
-            y='processing_time',
+            y=['processing_time', 'time_to_first_token'],
             title="⏱️ Tiempo de Procesamiento por Consulta",
-            labels={'index': 'Consulta #', 'processing_time': 'Tiempo (s)'}
+            labels={'index': 'Consulta #', 'value': 'Tiempo (s)', 'variable': 'Métrica'}
         )
-        fig_time.update_layout(showlegend=False)
         st.plotly_chart(fig_time, use_container_width=True)
     
     with col2:
@@ -371,7 +402,7 @@ def render_analytics():
     # Historial detallado
     st.markdown("### 📜 Historial de Consultas")
     st.dataframe(
-        history_df[['timestamp', 'query', 'processing_time', 'confidence', 'documents_used']],
+        history_df[['timestamp', 'query', 'processing_time', 'time_to_first_token', 'confidence', 'documents_used']],
         use_container_width=True
     )
 
@@ -383,18 +414,8 @@ def render_dataset_explorer():
     
     st.markdown("## 🗂️ Explorador del Dataset")
     
-    # Cargar datos para exploración
-    dataset_path = Path(__file__).parent / "dataset_processed_watsonx.jsonl"
-    
-    if not dataset_path.exists():
-        st.error("❌ Dataset no encontrado")
-        return
-    
-    # Cargar documentos
-    documents = []
-    with jsonlines.open(dataset_path) as reader:
-        for doc in reader:
-            documents.append(doc)
+    # Reutilizar el corpus ya mapeado por el sistema RAG (sin re-parsear el JSONL)
+    documents = st.session_state.rag_system.documents
     
     # Convertir a DataFrame para análisis
     df_data = []
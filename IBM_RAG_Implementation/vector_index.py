@@ -0,0 +1,271 @@
+# Índice vectorial denso para DECODE-EV RAG
+# Búsqueda exacta por similitud coseno con NumPy e índice aproximado IVF_FLAT
+
+import time
+import numpy as np
+from typing import Dict, Optional, Sequence, Tuple
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    """Normaliza filas a norma L2 unitaria (filas nulas quedan en cero)"""
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """
+    Índices de los k mayores scores por fila, ordenados de mayor a menor.
+    Usa argpartition (O(n)) y solo ordena los k seleccionados.
+    """
+    n = scores.shape[-1]
+    k = min(k, n)
+    if k <= 0:
+        return np.empty(scores.shape[:-1] + (0,), dtype=np.int64)
+
+    if k < n:
+        candidates = np.argpartition(-scores, k - 1, axis=-1)[..., :k]
+    else:
+        candidates = np.broadcast_to(np.arange(n), scores.shape).copy()
+
+    candidate_scores = np.take_along_axis(scores, candidates, axis=-1)
+    order = np.argsort(-candidate_scores, axis=-1, kind="stable")
+    return np.take_along_axis(candidates, order, axis=-1)
+
+
+class DenseVectorIndex:
+    """
+    Índice exacto de embeddings.
+    Guarda una matriz float32 contigua con filas normalizadas L2, de modo que
+    la similitud coseno es un producto punto (BLAS) contra toda la matriz.
+    """
+
+    def __init__(self, dimension: int = 768):
+        self.dimension = dimension
+        self.matrix = np.empty((0, dimension), dtype=np.float32)
+
+    def __len__(self) -> int:
+        return self.matrix.shape[0]
+
+    def build(self, embeddings: Sequence[Sequence[float]]) -> None:
+        """Construye el índice; el id de cada vector es su fila"""
+        matrix = np.asarray(embeddings, dtype=np.float32).reshape(-1, self.dimension)
+        self.matrix = normalize_rows(matrix)
+
+    def add(self, embeddings: Sequence[Sequence[float]]) -> np.ndarray:
+        """Agrega vectores al final del índice y retorna sus ids"""
+        new_rows = normalize_rows(np.asarray(embeddings, dtype=np.float32).reshape(-1, self.dimension))
+        start = len(self)
+        self.matrix = np.ascontiguousarray(np.vstack([self.matrix, new_rows]))
+        return np.arange(start, start + new_rows.shape[0])
+
+    def memory_usage(self) -> int:
+        return self.matrix.nbytes
+
+    def search(self, query_embedding: Sequence[float], top_k: int = 10,
+               candidate_ids: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Retorna (ids, scores coseno) de los top-k vectores más similares.
+        Si se entregan `candidate_ids`, solo se puntúan esas filas.
+        """
+        ids, scores = self.search_batch(np.asarray(query_embedding, dtype=np.float32)[None, :],
+                                        top_k, candidate_ids)
+        return ids[0], scores[0]
+
+    def search_batch(self, query_embeddings: np.ndarray, top_k: int = 10,
+                     candidate_ids: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Búsqueda para una matriz de consultas (n_queries x dimension) con una
+        sola multiplicación matricial. Retorna matrices (n_queries x k).
+        """
+        queries = normalize_rows(np.asarray(query_embeddings, dtype=np.float32).reshape(-1, self.dimension))
+
+        if candidate_ids is None:
+            scores = queries @ self.matrix.T
+            row_ids = None
+        else:
+            row_ids = np.asarray(candidate_ids, dtype=np.int64)
+            scores = queries @ self.matrix[row_ids].T
+
+        top = top_k_indices(scores, top_k)
+        top_scores = np.take_along_axis(scores, top, axis=-1)
+        ids = top if row_ids is None else row_ids[top]
+        return ids, top_scores
+
+
+class IVFIndex:
+    """
+    Índice aproximado IVF_FLAT con métrica coseno (equivalente local a la
+    configuración Milvus de `_setup_vector_store`).
+
+    Un cuantizador grueso (k-means esférico) divide el corpus en `nlist`
+    listas invertidas; cada consulta solo recorre las `nprobe` listas cuyos
+    centroides son más cercanos. Los vectores se almacenan reordenados por
+    lista para que cada lista sea un bloque contiguo de memoria.
+    """
+
+    def __init__(self, dimension: int = 768, nlist: int = 256, nprobe: int = 8,
+                 n_iter: int = 10, max_training_points: int = 256, seed: int = 0):
+        self.dimension = dimension
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.n_iter = n_iter
+        self.max_training_points = max_training_points
+        self.seed = seed
+
+        self.centroids = np.empty((0, dimension), dtype=np.float32)
+        self.vectors = np.empty((0, dimension), dtype=np.float32)
+        self.ids = np.empty(0, dtype=np.int64)
+        self.offsets = np.zeros(1, dtype=np.int64)
+
+    def __len__(self) -> int:
+        return self.ids.shape[0]
+
+    @property
+    def is_trained(self) -> bool:
+        return self.centroids.shape[0] > 0
+
+    def train(self, embeddings: np.ndarray) -> None:
+        """Entrena el cuantizador grueso con k-means esférico"""
+        data = normalize_rows(np.asarray(embeddings, dtype=np.float32).reshape(-1, self.dimension))
+        rng = np.random.default_rng(self.seed)
+
+        nlist = max(1, min(self.nlist, data.shape[0]))
+        sample_size = min(data.shape[0], nlist * self.max_training_points)
+        sample = data[rng.choice(data.shape[0], sample_size, replace=False)]
+
+        centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+        for _ in range(self.n_iter):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+
+            counts = np.bincount(assignment, minlength=nlist)
+            order = np.argsort(assignment, kind="stable")
+            starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+
+            sums = np.zeros_like(centroids)
+            non_empty = counts > 0
+            sums[non_empty] = np.add.reduceat(sample[order], starts[non_empty], axis=0)
+
+            # Reinicializar clusters vacíos con puntos aleatorios
+            empty = counts == 0
+            if empty.any():
+                sums[empty] = sample[rng.choice(sample_size, int(empty.sum()))]
+
+            centroids = normalize_rows(sums)
+
+        self.centroids = centroids
+        self.nlist = nlist
+
+    def _assign(self, vectors: np.ndarray) -> np.ndarray:
+        return np.argmax(vectors @ self.centroids.T, axis=1)
+
+    def build(self, embeddings: np.ndarray, ids: Optional[np.ndarray] = None) -> None:
+        """Entrena (si hace falta) y construye las listas invertidas"""
+        vectors = normalize_rows(np.asarray(embeddings, dtype=np.float32).reshape(-1, self.dimension))
+        if not self.is_trained:
+            self.train(vectors)
+
+        ids = np.arange(vectors.shape[0], dtype=np.int64) if ids is None else np.asarray(ids, dtype=np.int64)
+        self._set_lists(vectors, ids, self._assign(vectors))
+
+    def add(self, embeddings: np.ndarray, ids: np.ndarray) -> None:
+        """Agrega vectores a las listas de sus centroides más cercanos"""
+        vectors = normalize_rows(np.asarray(embeddings, dtype=np.float32).reshape(-1, self.dimension))
+        current_lists = np.repeat(np.arange(self.nlist), np.diff(self.offsets))
+
+        self._set_lists(np.vstack([self.vectors, vectors]),
+                        np.concatenate([self.ids, np.asarray(ids, dtype=np.int64)]),
+                        np.concatenate([current_lists, self._assign(vectors)]))
+
+    def _set_lists(self, vectors: np.ndarray, ids: np.ndarray, assignment: np.ndarray) -> None:
+        order = np.argsort(assignment, kind="stable")
+        self.vectors = np.ascontiguousarray(vectors[order])
+        self.ids = ids[order]
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(assignment, minlength=self.nlist))])
+
+    def search(self, query_embedding: Sequence[float], top_k: int = 10,
+               nprobe: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Retorna (ids, scores coseno) aproximados recorriendo `nprobe` listas"""
+        if len(self) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        query = normalize_rows(np.asarray(query_embedding, dtype=np.float32).reshape(1, self.dimension))[0]
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+
+        probed = top_k_indices(self.centroids @ query, nprobe)
+        rows = np.concatenate([np.arange(self.offsets[c], self.offsets[c + 1]) for c in probed])
+        if rows.size == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        scores = self.vectors[rows] @ query
+        top = top_k_indices(scores, top_k)
+        return self.ids[rows[top]], scores[top]
+
+    def search_batch(self, query_embeddings: np.ndarray, top_k: int = 10,
+                     nprobe: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Búsqueda aproximada para varias consultas (filas con -1 si hay menos de k)"""
+        queries = np.asarray(query_embeddings, dtype=np.float32).reshape(-1, self.dimension)
+        ids = np.full((queries.shape[0], top_k), -1, dtype=np.int64)
+        scores = np.full((queries.shape[0], top_k), -np.inf, dtype=np.float32)
+
+        for row, query in enumerate(queries):
+            found_ids, found_scores = self.search(query, top_k, nprobe)
+            ids[row, :found_ids.size] = found_ids
+            scores[row, :found_scores.size] = found_scores
+        return ids, scores
+
+
+def evaluate_recall_at_k(ann_index: IVFIndex, exact_index: DenseVectorIndex, queries: np.ndarray,
+                         top_k: int = 10, nprobe: Optional[int] = None) -> Dict[str, float]:
+    """
+    Compara el índice aproximado contra la búsqueda exacta.
+    Retorna recall@k promedio y latencia media por consulta (ms) de ambos.
+    """
+    queries = np.asarray(queries, dtype=np.float32).reshape(-1, exact_index.dimension)
+
+    start = time.perf_counter()
+    exact_ids = [exact_index.search(query, top_k)[0] for query in queries]
+    exact_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+    start = time.perf_counter()
+    approx_ids = [ann_index.search(query, top_k, nprobe)[0] for query in queries]
+    approx_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+    recall = np.mean([
+        len(set(exact.tolist()) & set(approx.tolist())) / max(len(exact), 1)
+        for exact, approx in zip(exact_ids, approx_ids)
+    ])
+
+    return {
+        f"recall@{top_k}": float(recall),
+        "ann_latency_ms": approx_ms,
+        "exact_latency_ms": exact_ms,
+        "nprobe": nprobe or ann_index.nprobe
+    }
+
+
+# Benchmark IVF vs búsqueda exacta
+if __name__ == "__main__":
+    print("🚀 Benchmark IVF_FLAT vs búsqueda exacta (embeddings sintéticos)")
+
+    rng = np.random.default_rng(42)
+    n_docs, dimension, n_clusters = 50_000, 768, 200
+
+    # Corpus con estructura de clusters (similar a eventos CAN por red/evento)
+    centers = rng.normal(size=(n_clusters, dimension)).astype(np.float32)
+    corpus = centers[rng.integers(0, n_clusters, n_docs)] + 0.6 * rng.normal(size=(n_docs, dimension)).astype(np.float32)
+    queries = corpus[rng.choice(n_docs, 100, replace=False)] + 0.3 * rng.normal(size=(100, dimension)).astype(np.float32)
+
+    exact = DenseVectorIndex(dimension)
+    exact.build(corpus)
+
+    start = time.perf_counter()
+    ivf = IVFIndex(dimension, nlist=int(4 * np.sqrt(n_docs)))
+    ivf.build(corpus)
+    print(f"📊 IVF construido en {time.perf_counter() - start:.1f}s (nlist={ivf.nlist})")
+
+    for nprobe in (1, 4, 8, 16, 32):
+        result = evaluate_recall_at_k(ivf, exact, queries, top_k=10, nprobe=nprobe)
+        print(f"   • nprobe={nprobe:>3}: recall@10={result['recall@10']:.3f} "
+              f"| IVF {result['ann_latency_ms']:.2f} ms | exacto {result['exact_latency_ms']:.2f} ms")